@@ -0,0 +1,224 @@
+"""
+Admission control for the threading backend (`server.py --threads N`).
+
+PooledHTTPServer serves connections from a fixed pool of worker threads instead of
+ThreadingHTTPServer's thread per connection. Accepted connections wait in a queue of
+at most `queue_depth`; when it is full the accept thread answers `503` with
+`Retry-After` right away, without reading the request, so overload costs a few
+microseconds per rejected connection instead of a thread and a timeout.
+
+Work for callers that have given up is dropped before it is computed: connections
+that waited longer than `max_queue_wait` seconds in the queue get a `503` instead of
+being served (checked when a worker takes them and, so that they are answered even
+while every worker is busy, by the accept thread on each poll), and handlers can check
+a caller-supplied budget (the `X-Request-Timeout` header, seconds counted from when the
+connection was accepted) with past_deadline().
+At most `max_per_client` connections per client address may be queued or in service
+(0 = no limit); beyond that the client gets `429` with `Retry-After`.
+
+Workers are only freed by finished requests, so the handler class must bound how long
+a client may stay idle or slow (BaseHTTPRequestHandler.timeout; see server.py
+--request-timeout), or a few idle connections can hold every worker. That timeout
+counts from when the connection was accepted: a client that sent nothing while it was
+queued is dropped as soon as a worker takes it, instead of holding the worker again.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import socket
+import threading
+import time
+from collections import deque
+from http import HTTPStatus
+from http.server import HTTPServer
+from typing import Any
+
+# Request header with the caller's time budget in seconds (e.g. Laravel's Http::timeout).
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+
+def _reply(status: int, message: str, retry_after: int) -> bytes:
+    body = json.dumps({"message": message}).encode("utf-8")
+    return (
+        f"HTTP/1.0 {status} {HTTPStatus(status).phrase}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Retry-After: {retry_after}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode("latin-1") + body
+
+
+class PooledHTTPServer(HTTPServer):
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        handler_class: Any,
+        bind_and_activate: bool = True,
+        *,
+        workers: int = 32,
+        queue_depth: int = 128,
+        max_per_client: int = 0,
+        max_queue_wait: float = 0.0,
+        retry_after: int = 1,
+    ) -> None:
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.workers = max(1, workers)
+        self.queue_depth = max(1, queue_depth)
+        self.max_per_client = max(0, max_per_client)
+        self.max_queue_wait = max(0.0, max_queue_wait)
+        self.retry_after = max(1, retry_after)
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._queue: deque[tuple[Any, Any, str, float]] = deque()
+        self._clients: dict[str, int] = {}
+        self._local = threading.local()
+        self.active = 0
+        self.served = 0
+        self.rejected_queue_full = 0
+        self.rejected_client_limit = 0
+        self.shed_queue_wait = 0
+        self.shed_deadline = 0
+        self.shed_idle = 0
+        self._threads: list[threading.Thread] = []
+
+    def _start_workers(self) -> None:
+        # Started lazily from serve_forever(): with --workers the server is built in each forked process.
+        for i in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, name=f"http-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        self._start_workers()
+        super().serve_forever(poll_interval)
+
+    def process_request(self, request: socket.socket, client_address: Any) -> None:
+        client = client_address[0] if isinstance(client_address, tuple) else str(client_address)
+        self._shed_expired()
+        with self._lock:
+            if self.max_per_client and self._clients.get(client, 0) >= self.max_per_client:
+                self.rejected_client_limit += 1
+                status, message = 429, "Too many concurrent requests from this client"
+            elif len(self._queue) >= self.queue_depth:
+                self.rejected_queue_full += 1
+                status, message = 503, "Server overloaded"
+            else:
+                self._queue.append((request, client_address, client, time.monotonic()))
+                self._clients[client] = self._clients.get(client, 0) + 1
+                self._ready.notify()
+                return
+        self._reject(request, status, message)
+
+    def service_actions(self) -> None:
+        # Called by serve_forever() on every poll, also when no connection arrives.
+        self._shed_expired()
+
+    def _shed_expired(self) -> None:
+        """Answer connections that already waited longer than max_queue_wait (oldest are first)."""
+        if not self.max_queue_wait:
+            return
+        cutoff = time.monotonic() - self.max_queue_wait
+        with self._lock:
+            expired: list[tuple[Any, Any, str, float]] = []
+            while self._queue and self._queue[0][3] < cutoff:
+                expired.append(self._queue.popleft())
+            self.shed_queue_wait += len(expired)
+        for request, _, client, _ in expired:
+            self._reject(request, 503, "Request waited too long")
+            self._release(client)
+
+    def _release(self, client: str) -> None:
+        with self._lock:
+            if self._clients[client] <= 1:
+                del self._clients[client]
+            else:
+                self._clients[client] -= 1
+
+    def _reject(self, request: socket.socket, status: int, message: str) -> None:
+        try:
+            request.settimeout(0)
+            request.sendall(_reply(status, message, self.retry_after))
+            # Drain what the client already sent, so closing doesn't reset the connection.
+            request.recv(65536)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _work(self) -> None:
+        while True:
+            with self._ready:
+                while not self._queue:
+                    self._ready.wait()
+                request, client_address, client, accepted_at = self._queue.popleft()
+            try:
+                if self.max_queue_wait and time.monotonic() - accepted_at > self.max_queue_wait:
+                    with self._lock:
+                        self.shed_queue_wait += 1
+                    self._reject(request, 503, "Request waited too long")
+                    continue
+                if not self._client_sent(request, accepted_at):
+                    with self._lock:
+                        self.shed_idle += 1
+                    self.shutdown_request(request)
+                    continue
+                self._local.accepted_at = accepted_at
+                with self._lock:
+                    self.active += 1
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self._local.accepted_at = None
+                    self.shutdown_request(request)
+                    with self._lock:
+                        self.active -= 1
+                        self.served += 1
+            finally:
+                self._release(client)
+
+    def _client_sent(self, request: socket.socket, accepted_at: float) -> bool:
+        """Whether the client sends something within the handler's timeout, counted from accept."""
+        timeout = getattr(self.RequestHandlerClass, "timeout", None)
+        if not timeout:
+            return True
+        try:
+            request.settimeout(max(0.001, timeout - (time.monotonic() - accepted_at)))
+            return bool(request.recv(1, socket.MSG_PEEK))
+        except OSError:  # includes the timeout
+            return False
+
+    def past_deadline(self, timeout_header: str | None) -> bool:
+        """
+        True if the caller's budget (TIMEOUT_HEADER value, seconds since the connection
+        was accepted) is used up. Called from a handler on a worker thread.
+        """
+        if not timeout_header:
+            return False
+        try:
+            budget = float(timeout_header)
+        except ValueError:
+            return False
+        accepted_at = getattr(self._local, "accepted_at", None)
+        if accepted_at is None or not math.isfinite(budget) or time.monotonic() - accepted_at <= budget:
+            return False
+        with self._lock:
+            self.shed_deadline += 1
+        return True
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "active": self.active,
+                "queued": len(self._queue),
+                "served": self.served,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_client_limit": self.rejected_client_limit,
+                "shed_queue_wait": self.shed_queue_wait,
+                "shed_deadline": self.shed_deadline,
+                "shed_idle": self.shed_idle,
+            }
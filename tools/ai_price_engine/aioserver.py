@@ -0,0 +1,291 @@
+"""
+asyncio HTTP/1.1 serving backend (`server.py --backend asyncio`).
+
+One event loop handles every connection, so there is no thread per request and no
+TCP handshake per recommendation: connections are persistent (keep-alive) and
+pipelined requests are answered in order. Routing is delegated to an `app` callable
+(server.Handler.respond), which keeps both backends serving identical endpoints.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import socket
+import time
+import traceback
+from http import HTTPStatus
+from typing import Any, Callable
+
+import streaming
+
+# Header block limit (request line + headers); larger requests get 431.
+MAX_HEADER_BYTES = 64 * 1024
+
+
+def _status_line(status: int) -> bytes:
+    try:
+        phrase = HTTPStatus(status).phrase
+    except ValueError:
+        phrase = ""
+    return f"HTTP/1.1 {status} {phrase}\r\n".encode("latin-1")
+
+
+def _render(response: Any, *, keep_alive: bool) -> bytes:
+    head = [
+        _status_line(response.status),
+        f"Content-Type: {response.content_type}\r\n".encode("latin-1"),
+        f"Content-Length: {len(response.body)}\r\n".encode("latin-1"),
+        b"Connection: keep-alive\r\n" if keep_alive else b"Connection: close\r\n",
+    ]
+    for name, value in response.headers.items():
+        head.append(f"{name}: {value}\r\n".encode("latin-1"))
+    head.append(b"\r\n")
+    return b"".join(head) + response.body
+
+
+def _plain_error(status: int, message: str) -> bytes:
+    body = ('{"message": "%s"}' % message).encode("utf-8")
+    return (
+        _status_line(status)
+        + b"Content-Type: application/json; charset=utf-8\r\n"
+        + f"Content-Length: {len(body)}\r\n".encode("latin-1")
+        + b"Connection: close\r\n\r\n"
+        + body
+    )
+
+
+class AsyncHTTPServer:
+    """
+    Minimal HTTP/1.1 server: Content-Length bodies, keep-alive, pipelining.
+
+    `app(method, target, body)` must return an object with `status`, `body`,
+    `content_type` and `headers` (server.Response). At most `max_connections`
+    connections are served at once; further accepted connections wait for a slot.
+
+    `stream_app(method, target)` may claim a request for streaming by returning an
+    object with `content_type`, `feed(block) -> bytes` and `finish() -> bytes`
+    (server.LineStream): the body (Content-Length or chunked, no size limit) is fed
+    block by block and the output is sent back as it is produced; its `close(ok)` is
+    called when the request is over.
+
+    `recorder`, if given, times request stages (metrics.Metrics): `recorder.stage_timer()`
+    is called once per request, marked "body_read" and passed to `app` as a fourth
+    argument, and `recorder.observe_stage("write", seconds, timer)` receives the write.
+    """
+
+    def __init__(
+        self,
+        app: Callable[[str, str, bytes], Any],
+        *,
+        stream_app: Callable[[str, str], Any | None] | None = None,
+        recorder: Any | None = None,
+        max_connections: int = 1024,
+        keepalive_timeout: float = 15.0,
+        max_body_bytes: int = 32 * 1024 * 1024,
+    ) -> None:
+        self.app = app
+        self.stream_app = stream_app
+        self.recorder = recorder
+        self.max_connections = max(1, max_connections)
+        self.keepalive_timeout = keepalive_timeout
+        self.max_body_bytes = max_body_bytes
+        self._slots: asyncio.Semaphore | None = None
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        assert self._slots is not None
+        try:
+            async with self._slots:
+                await self._serve_connection(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive_timeout)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                return
+            except asyncio.LimitOverrunError:
+                writer.write(_plain_error(431, "Request header fields too large"))
+                await writer.drain()
+                return
+
+            lines = head[:-4].decode("latin-1").split("\r\n")
+            parts = lines[0].split()
+            if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+                writer.write(_plain_error(400, "Bad request"))
+                await writer.drain()
+                return
+            method, target, version = parts
+
+            headers: dict[str, str] = {}
+            for line in lines[1:]:
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+
+            connection = headers.get("connection", "").lower()
+            if version == "HTTP/1.1":
+                keep_alive = connection != "close"
+            else:
+                keep_alive = connection == "keep-alive"
+
+            stream = self.stream_app(method, target) if self.stream_app is not None else None
+            if stream is not None:
+                if not await self._stream(stream, reader, writer, headers, keep_alive, version):
+                    return
+                continue
+
+            if "transfer-encoding" in headers:
+                writer.write(_plain_error(501, "Transfer-Encoding is not supported"))
+                await writer.drain()
+                return
+            try:
+                length = int(headers.get("content-length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0 or length > self.max_body_bytes:
+                writer.write(_plain_error(413 if length > 0 else 400, "Invalid Content-Length"))
+                await writer.drain()
+                return
+
+            if length and headers.get("expect", "").lower() == "100-continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            stages = self.recorder.stage_timer() if self.recorder is not None else None
+            body = await reader.readexactly(length) if length else b""
+            if stages is not None and method == "POST":
+                stages.mark("body_read")
+
+            if method not in ("GET", "POST"):
+                writer.write(_plain_error(501, "Unsupported method"))
+                await writer.drain()
+                return
+
+            if method == "POST" and not body:
+                body = b"{}"
+            try:
+                response = self.app(method, target, body) if stages is None else self.app(method, target, body, stages)
+            except Exception:
+                # Like socketserver's handle_error(): log it, answer 500, close this connection only.
+                traceback.print_exc()
+                writer.write(_plain_error(500, "Internal server error"))
+                await writer.drain()
+                return
+            started = time.perf_counter()
+            writer.write(_render(response, keep_alive=keep_alive))
+            await writer.drain()
+            if stages is not None:
+                self.recorder.observe_stage("write", time.perf_counter() - started, stages)
+            if not keep_alive:
+                return
+
+    async def _stream(
+        self,
+        stream: Any,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        headers: dict[str, str],
+        keep_alive: bool,
+        version: str,
+    ) -> bool:
+        """Serve one streamed request; returns whether the connection can be reused."""
+        encoding = headers.get("transfer-encoding", "").lower()
+        if encoding:
+            if encoding != "chunked":
+                stream.close(False)
+                writer.write(_plain_error(501, "Transfer-Encoding is not supported"))
+                await writer.drain()
+                return False
+            blocks = streaming.aiter_chunked(reader)
+        else:
+            try:
+                length = int(headers.get("content-length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                stream.close(False)
+                writer.write(_plain_error(400, "Invalid Content-Length"))
+                await writer.drain()
+                return False
+            blocks = streaming.aiter_content(reader, length)
+
+        # HTTP/1.0 has no chunked encoding: the body then ends when the connection closes.
+        chunked = version == "HTTP/1.1"
+        keep_alive = keep_alive and chunked
+        if chunked and headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        writer.write(
+            _status_line(200)
+            + f"Content-Type: {stream.content_type}\r\n".encode("latin-1")
+            + (b"Transfer-Encoding: chunked\r\n" if chunked else b"")
+            + (b"Connection: keep-alive\r\n\r\n" if keep_alive else b"Connection: close\r\n\r\n")
+        )
+
+        def send(data: bytes) -> None:
+            if data:
+                writer.write(streaming.encode_chunk(data) if chunked else data)
+
+        ok = False
+        try:
+            async for block in blocks:
+                send(stream.feed(block))
+                await writer.drain()
+            send(stream.finish())
+            ok = True
+        except streaming.MalformedBody as e:
+            send(('{"error": {"message": "%s", "errors": {}}}\n' % e).encode("utf-8"))
+            keep_alive = False
+        finally:
+            stream.close(ok)
+        if chunked:
+            writer.write(streaming.LAST_CHUNK)
+        await writer.drain()
+        return keep_alive
+
+    async def serve(
+        self,
+        host: str,
+        port: int,
+        *,
+        sock: socket.socket | None = None,
+        reuse_port: bool = False,
+    ) -> None:
+        self._slots = asyncio.Semaphore(self.max_connections)
+        if sock is not None:
+            server = await asyncio.start_server(self.handle_connection, sock=sock, limit=MAX_HEADER_BYTES)
+        else:
+            server = await asyncio.start_server(
+                self.handle_connection,
+                host,
+                port,
+                reuse_port=reuse_port or None,
+                limit=MAX_HEADER_BYTES,
+            )
+        async with server:
+            await server.serve_forever()
+
+
+def serve(
+    app: Callable[[str, str, bytes], Any],
+    host: str,
+    port: int,
+    *,
+    sock: socket.socket | None = None,
+    reuse_port: bool = False,
+    max_connections: int = 1024,
+    stream_app: Callable[[str, str], Any | None] | None = None,
+    recorder: Any | None = None,
+) -> None:
+    """Run the asyncio backend until interrupted."""
+    http = AsyncHTTPServer(
+        app,
+        stream_app=stream_app,
+        recorder=recorder,
+        max_connections=max_connections,
+    )
+    try:
+        asyncio.run(http.serve(host, port, sock=sock, reuse_port=reuse_port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,191 @@
+"""
+End-to-end HTTP load generator for server.py.
+
+Starts a server subprocess on a free local port (or targets --url), then keeps
+`concurrency` client threads sending POST /v1/recommend over persistent connections
+for a fixed duration, and reports throughput plus p50/p95/p99 latency.
+
+Can also be run on its own:
+    python3 bench/http_load.py --duration 10 --concurrency 16 --backend asyncio
+    python3 bench/http_load.py --backend threading --shadow-weights weights.json  # shadow scoring cost
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from typing import Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ENGINE_DIR = os.path.dirname(BENCH_DIR)
+if BENCH_DIR not in sys.path:
+    sys.path.insert(0, BENCH_DIR)
+
+from micro import BASE_PAYLOAD  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def start_server(backend: str, extra_args: list[str] | None = None) -> tuple[subprocess.Popen[bytes], str]:
+    port = _free_port()
+    cmd = [
+        sys.executable,
+        os.path.join(ENGINE_DIR, "server.py"),
+        "--port",
+        str(port),
+        "--backend",
+        backend,
+        "--cache-size",
+        "0",  # measure scoring, not cache hits on one repeated payload
+        *(extra_args or []),
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 10.0
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/health", timeout=1) as res:
+                if res.status == 200:
+                    return proc, url
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server.py did not become healthy")
+
+
+def run_load(url: str, *, duration: float, concurrency: int, path: str = "/v1/recommend") -> dict[str, Any]:
+    target = urllib.parse.urlsplit(url)
+    body = json.dumps(BASE_PAYLOAD).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    latencies: list[list[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    stop_at = time.perf_counter() + duration
+
+    def client(i: int) -> None:
+        conn = http.client.HTTPConnection(target.hostname, target.port, timeout=10)
+        own = latencies[i]
+        while True:
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                res = conn.getresponse()
+                res.read()
+                if res.status != 200:
+                    errors[i] += 1
+                if res.will_close:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                errors[i] += 1
+                conn.close()
+                continue
+            own.append(time.perf_counter() - started)
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    merged = sorted(x for own in latencies for x in own)
+    return {
+        "requests": len(merged),
+        "errors": sum(errors),
+        "seconds": elapsed,
+        "throughput_rps": len(merged) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": _percentile(merged, 0.50) * 1000,
+        "p95_ms": _percentile(merged, 0.95) * 1000,
+        "p99_ms": _percentile(merged, 0.99) * 1000,
+    }
+
+
+def run(
+    *,
+    quick: bool = False,
+    url: str | None = None,
+    backends: tuple[str, ...] = ("threading", "asyncio"),
+    duration: float | None = None,
+    concurrency: int = 8,
+    server_args: list[str] | None = None,
+) -> dict[str, dict[str, Any]]:
+    duration = duration if duration is not None else (2.0 if quick else 10.0)
+    targets: list[tuple[str, str | None]] = [("url", url)] if url else [(b, None) for b in backends]
+    results: dict[str, dict[str, Any]] = {}
+    for name, target in targets:
+        proc = None
+        if target is None:
+            proc, target = start_server(name, server_args)
+        try:
+            stats = run_load(target, duration=duration, concurrency=concurrency)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=10)
+        prefix = f"http.{name}"
+        detail = {**stats, "concurrency": concurrency}
+        results[f"{prefix}.throughput"] = {
+            "value": stats["throughput_rps"],
+            "unit": "req/s",
+            "better": "higher",
+            "detail": detail,
+        }
+        for q in ("p50", "p95", "p99"):
+            results[f"{prefix}.{q}"] = {"value": stats[f"{q}_ms"] / 1000, "unit": "s", "better": "lower"}
+        # Tail latencies swing more between runs; give them a wider default tolerance.
+        results[f"{prefix}.p95"]["tolerance"] = 0.5
+        results[f"{prefix}.p99"]["tolerance"] = 0.75
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="HTTP load test for the AI Price Engine.")
+    parser.add_argument("--url", help="Target an already running server instead of starting one")
+    parser.add_argument("--backend", choices=("threading", "asyncio"), action="append", help="Backend(s) to start")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per target")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client connections")
+    parser.add_argument("--shadow-weights", help="Start the server(s) with this --shadow-weights candidate")
+    parser.add_argument("--shadow-cpu-budget", type=float, help="Server --shadow-cpu-budget (with --shadow-weights)")
+    args = parser.parse_args()
+
+    server_args: list[str] = []
+    if args.shadow_weights:
+        server_args += ["--shadow-weights", args.shadow_weights]
+    if args.shadow_cpu_budget is not None:
+        server_args += ["--shadow-cpu-budget", str(args.shadow_cpu_budget)]
+
+    results = run(
+        url=args.url,
+        backends=tuple(args.backend or ("threading", "asyncio")),
+        duration=args.duration,
+        concurrency=max(1, args.concurrency),
+        server_args=server_args,
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
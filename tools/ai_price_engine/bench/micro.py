@@ -0,0 +1,86 @@
+"""
+Microbenchmarks of the scoring hot path (recommend(), the competitor aggregator and
+in-process request handling).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import sys
+import timeit
+from typing import Any, Callable
+
+ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ENGINE_DIR not in sys.path:
+    sys.path.insert(0, ENGINE_DIR)
+
+import server  # noqa: E402
+
+BASE_PAYLOAD: dict[str, Any] = {
+    "competitor_avg": 199.0,
+    "cost_price": 120.0,
+    "shipping_cost": 10.0,
+    "platform_fee_pct": 5,
+    "desired_margin": 20,
+    "current_price": 189.0,
+    "demand_factor": 0.6,
+    "sales_velocity": 12,
+    "stock_level": 30,
+    "rating": 4.6,
+    "promo_factor": 0.95,
+    "seasonality_factor": 1.05,
+}
+
+
+def competitor_prices(n: int, seed: int = 7) -> list[float]:
+    rng = random.Random(seed)
+    return [round(rng.uniform(150.0, 250.0), 2) for _ in range(n)]
+
+
+def time_call(func: Callable[[], Any], *, repeat: int = 5, min_time: float = 0.2) -> dict[str, Any]:
+    """Best and median seconds per call, with the loop count calibrated to ~min_time per repeat."""
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 10_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    runs = sorted(t / number for t in timer.repeat(repeat, number))
+    return {
+        "value": runs[0],
+        "unit": "s",
+        "better": "lower",
+        "detail": {"median": runs[len(runs) // 2], "loops": number, "repeat": repeat},
+    }
+
+
+def run(*, quick: bool = False) -> dict[str, dict[str, Any]]:
+    weights = server._load_weights(os.path.join(ENGINE_DIR, "weights.json"))
+    repeat = 5 if quick else 7
+    min_time = 0.1 if quick else 0.2
+    results: dict[str, dict[str, Any]] = {}
+
+    def bench(name: str, func: Callable[[], Any]) -> None:
+        results[name] = time_call(func, repeat=repeat, min_time=min_time)
+
+    fallback = {k: v for k, v in BASE_PAYLOAD.items() if k != "competitor_avg"}
+    bench("micro.recommend.basic", lambda: server.recommend(BASE_PAYLOAD, weights))
+    bench("micro.recommend.explain", lambda: server.recommend(BASE_PAYLOAD, weights, explain=True))
+    ui_fields = server.parse_explain(False, "min_price,ceiling,clamps")
+    bench("micro.recommend.explain_fields", lambda: server.recommend(BASE_PAYLOAD, weights, explain=ui_fields))
+    bench("micro.recommend.fallback", lambda: server.recommend(fallback, weights))
+
+    for n in (5, 100, 10_000):
+        prices = competitor_prices(n)
+        payload = {**fallback, "competitor_prices": prices}
+        bench(f"micro.recommend.competitor_prices_{n}", lambda p=payload: server.recommend(p, weights))
+        bench(f"micro.robust_price_average_{n}", lambda v=prices: server._robust_price_average(v))
+
+    # Full in-process request: routing, JSON decode, recommend(), metrics and encoding.
+    server.Handler.set_weights(weights)
+    body = json.dumps(BASE_PAYLOAD).encode("utf-8")
+    bench("micro.handler.respond", lambda: server.Handler.respond("POST", "/v1/recommend", body))
+    return results
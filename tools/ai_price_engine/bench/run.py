@@ -0,0 +1,154 @@
+"""
+Run the price engine benchmarks and compare them against a stored baseline.
+
+    python3 bench/run.py --quick                        # all suites, short runs
+    python3 bench/run.py --suite micro --out results.json
+    python3 bench/run.py --quick --update-baseline      # refresh bench/baseline.json
+
+Every result is `{ "value", "unit", "better": "lower"|"higher" }`. A result regresses
+when it is worse than the baseline by more than --tolerance (relative; a baseline
+entry may carry its own "tolerance"). The exit status is 1 if anything regressed.
+Comparing a --quick run with a full baseline (or the reverse) is refused; a baseline
+from a machine with a different CPU count is compared with a warning.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import sys
+from typing import Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+if BENCH_DIR not in sys.path:
+    sys.path.insert(0, BENCH_DIR)
+
+import http_load  # noqa: E402
+import micro  # noqa: E402
+import trainer  # noqa: E402
+
+SUITES = {"micro": micro.run, "http": http_load.run, "train": trainer.run}
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+
+def compare(
+    results: dict[str, dict[str, Any]],
+    baseline: dict[str, dict[str, Any]],
+    tolerance: float,
+) -> list[dict[str, Any]]:
+    """One row per result that has a baseline; `regressed` marks the failures."""
+    rows = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or not base.get("value"):
+            continue
+        allowed = float(base.get("tolerance", tolerance))
+        ratio = result["value"] / base["value"]
+        if result.get("better", "lower") == "higher":
+            regressed = ratio < 1.0 - allowed
+        else:
+            regressed = ratio > 1.0 + allowed
+        rows.append(
+            {
+                "name": name,
+                "value": result["value"],
+                "baseline": base["value"],
+                "ratio": ratio,
+                "tolerance": allowed,
+                "regressed": regressed,
+            }
+        )
+    return rows
+
+
+def _format(value: float, unit: str) -> str:
+    if unit == "s":
+        for scale, suffix in ((1.0, "s"), (1e-3, "ms"), (1e-6, "us")):
+            if value >= scale:
+                return f"{value / scale:.3f}{suffix}"
+        return f"{value / 1e-9:.1f}ns"
+    return f"{value:,.1f} {unit}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="AI Price Engine benchmarks with regression thresholds.")
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES), help="Suite(s) to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="Short runs and smaller trainer sizes")
+    parser.add_argument("--out", help="Write results JSON here")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown (0.25 = 25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Save these results as the new baseline")
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, Any]] = {}
+    for suite in args.suite or list(SUITES):
+        print(f"Running {suite} benchmarks...", file=sys.stderr)
+        results.update(SUITES[suite](quick=args.quick))
+
+    report = {
+        "meta": {
+            "timestamp_utc": dt.datetime.now(dt.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": f"{platform.system()}-{platform.machine()}",
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+
+    for name, result in results.items():
+        print(f"{name:45s} {_format(result['value'], result['unit'])}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    if args.update_baseline:
+        existing: dict[str, Any] = {"results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                existing = json.load(f)
+        # Merge so that running one suite doesn't drop the others' baselines.
+        merged = {**existing.get("results", {}), **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": report["meta"], "results": merged}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline updated: {args.baseline}", file=sys.stderr)
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.", file=sys.stderr)
+        return
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        stored = json.load(f)
+    base_meta = stored.get("meta", {})
+    if bool(base_meta.get("quick")) != args.quick:
+        mode = "--quick" if base_meta.get("quick") else "full"
+        raise SystemExit(
+            f"{args.baseline} was recorded in {mode} mode; rerun in that mode or pass --update-baseline."
+        )
+    if base_meta.get("cpu_count") != os.cpu_count():
+        print(
+            f"warning: {args.baseline} was recorded with cpu_count={base_meta.get('cpu_count')} "
+            f"(this machine: {os.cpu_count()}); throughput and latency are not comparable.",
+            file=sys.stderr,
+        )
+    baseline = stored.get("results", {})
+    rows = compare(results, baseline, args.tolerance)
+    regressions = [r for r in rows if r["regressed"]]
+    print(f"\nCompared {len(rows)} results against {args.baseline}:")
+    for r in rows:
+        flag = "REGRESSED" if r["regressed"] else "ok"
+        print(f"  {r['name']:45s} x{r['ratio']:.2f} (tolerance {r['tolerance']:.0%}) {flag}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond tolerance.", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Trainer benchmarks: train._build_features and train._solve_ridge on synthetic rows.
+
+Rows are generated up front and excluded from the timings. Large sizes need a lot
+of memory with the list-based trainer (roughly 1 KB per row).
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import sys
+import time
+from typing import Any
+
+ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ENGINE_DIR not in sys.path:
+    sys.path.insert(0, ENGINE_DIR)
+
+import train  # noqa: E402
+
+QUICK_SIZES = (10_000, 100_000)
+FULL_SIZES = (10_000, 1_000_000, 10_000_000)
+
+
+def synthetic_rows(n: int, seed: int = 11) -> list[train.TrainingRow]:
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        comp = rng.uniform(50.0, 500.0)
+        cost = comp * rng.uniform(0.4, 0.8)
+        payload = {
+            "competitor_avg": comp,
+            "cost_price": cost,
+            "desired_margin": 20.0,
+            "demand_factor": rng.uniform(0.2, 0.9),
+            "current_price": comp * rng.uniform(0.9, 1.1),
+            "shipping_cost": rng.uniform(0.0, 15.0),
+            "platform_fee_pct": 5.0,
+            "sales_velocity": rng.uniform(0.0, 40.0),
+            "stock_level": rng.uniform(0.0, 200.0),
+            "rating": rng.uniform(3.0, 5.0),
+        }
+        rows.append(train.TrainingRow(payload=payload, y=comp * rng.uniform(0.95, 1.05)))
+    return rows
+
+
+def _timed(func: Any, *args: Any, repeat: int) -> tuple[float, Any]:
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, out
+
+
+def run(*, quick: bool = False, sizes: tuple[int, ...] | None = None) -> dict[str, dict[str, Any]]:
+    sizes = sizes or (QUICK_SIZES if quick else FULL_SIZES)
+    results: dict[str, dict[str, Any]] = {}
+    for n in sizes:
+        rows = synthetic_rows(n)
+        repeat = 3 if n <= 100_000 else 1
+        seconds, (xs, ys, _) = _timed(train._build_features, rows, repeat=repeat)
+        del rows
+        results[f"train.build_features_{n}"] = {
+            "value": seconds,
+            "unit": "s",
+            "better": "lower",
+            "detail": {"rows": n, "rows_per_s": n / seconds if seconds > 0 else 0.0},
+        }
+
+        xs_scaled, _ = train._scale_features(xs)
+        seconds, _ = _timed(
+            lambda: train._solve_ridge(xs_scaled, ys, ridge_lambda=1e-2),
+            repeat=repeat,
+        )
+        results[f"train.solve_ridge_{n}"] = {
+            "value": seconds,
+            "unit": "s",
+            "better": "lower",
+            "detail": {"rows": n, "rows_per_s": n / seconds if seconds > 0 else 0.0},
+        }
+        del xs, ys, xs_scaled
+    return results
@@ -0,0 +1,168 @@
+"""
+In-process recommendation result cache (bounded LRU + TTL) and request coalescing.
+
+Keys are built from a canonical JSON form of the payload, the model version and the
+output mode (explain, sensitivity), so field order and the `explain`/`fields`/
+`explain_format`/`sensitivity`/`listing_id` keys don't fragment the cache. The cache is
+cleared whenever the server swaps weights.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+# Payload keys that don't change recommend() output.
+# (The explain keys are covered by the explain mode part of the key.)
+_IGNORED_KEYS = frozenset({"explain", "fields", "explain_format", "sensitivity", "listing_id"})
+
+
+def canonical_key(
+    payload: dict[str, Any], model_version: str, explain: bool | str, *, sensitivity: bool = False
+) -> str | None:
+    """
+    Stable cache key for a payload, or None if it can't be serialized. `explain` is the
+    explain flag or a string naming the explain mode (see server.ExplainOptions.key);
+    results with `sensitivity` are keyed apart.
+    """
+    try:
+        body = json.dumps(
+            {k: v for k, v in payload.items() if k not in _IGNORED_KEYS},
+            sort_keys=True,
+            separators=(",", ":"),
+            allow_nan=False,
+        )
+    except (TypeError, ValueError):
+        return None
+    mode = explain if isinstance(explain, str) else int(explain)
+    if sensitivity:
+        mode = f"{mode}+sensitivity"
+    return f"{model_version}|{mode}|{body}"
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        ttl_seconds: float = 300.0,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Shallow copy: callers may add top-level keys (e.g. listing_id in batches).
+        return dict(value)
+
+    def put(self, key: str, value: dict[str, Any]) -> None:
+        expires_at = self._clock() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 6) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: dict[str, Any] | None = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Request coalescing: concurrent do() calls with the same key share one computation
+    and all get its result (or its exception). Nothing is kept once the call finishes,
+    so unlike the result cache there is no staleness window.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self.computed = 0
+        self.coalesced = 0
+
+    def do(self, key: str, compute: Callable[[], dict[str, Any]]) -> dict[str, Any]:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.computed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return dict(call.result)
+
+        try:
+            call.result = compute()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        # Shallow copies for everyone, as with cache hits.
+        return dict(call.result)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "computed": self.computed,
+                "coalesced": self.coalesced,
+            }
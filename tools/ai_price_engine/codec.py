@@ -0,0 +1,44 @@
+"""
+JSON codec for request bodies and responses.
+
+Uses orjson when it is installed and falls back to the stdlib json module otherwise.
+Behaviour is kept compatible with the stdlib: inputs orjson rejects but json accepts
+(NaN/Infinity literals, integers beyond 64 bits) are retried with json, so a body is
+only reported as invalid when the stdlib would reject it too.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def loads(data: bytes | str) -> Any:
+    """Decode JSON; raises json.JSONDecodeError (or UnicodeDecodeError) on bad input."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # let the stdlib decide (and produce its error)
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode to UTF-8 JSON bytes (non-ASCII characters are not escaped)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib handles them
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,255 @@
+"""
+Per-listing competitor price state kept by the server (`POST /v1/competitors/ingest`).
+
+Each listing keeps a ring buffer of its most recent observations, used by recommend()
+for the robust competitor average when a payload carries a `listing_id` but no
+competitor data, and a few time-windowed quantile sketches (sketch.QuantileSketch,
+merged on read) summarizing every price seen over the whole retention period.
+
+Observations older than `max_age` seconds expire: the ring buffer drops them on access
+and whole sketch windows are dropped once they end before the cutoff. Listings without
+observations are forgotten, and at most `max_listings` are kept (least recently
+updated first out). Timestamps are wall-clock epoch seconds, so snapshots written with
+save() can be loaded after a restart.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable
+
+import codec
+from sketch import QuantileSketch
+
+SNAPSHOT_VERSION = 1
+# Listing sketches trade accuracy for memory: 1% keeps a listing's prices in tens of buckets.
+SKETCH_ACCURACY = 0.01
+# Observations time-stamped this far in the future are clamped to now (clock skew).
+MAX_FUTURE_SKEW = 60.0
+
+
+class ListingPrices:
+    __slots__ = ("recent", "windows", "updated_at")
+
+    def __init__(self, ring_size: int) -> None:
+        self.recent: deque[tuple[float, float]] = deque(maxlen=ring_size)
+        self.windows: deque[tuple[float, QuantileSketch]] = deque()
+        self.updated_at = 0.0
+
+    def add(self, price: float, observed_at: float, window_seconds: float) -> None:
+        self.recent.append((observed_at, price))
+        start = observed_at - observed_at % window_seconds
+        if not self.windows or self.windows[-1][0] < start:
+            self.windows.append((start, QuantileSketch(SKETCH_ACCURACY)))
+        # Late observations go into the newest window at or before their time.
+        for window_start, sketch in reversed(self.windows):
+            if window_start <= observed_at:
+                sketch.add(price)
+                break
+        else:
+            self.windows[0][1].add(price)
+        self.updated_at = max(self.updated_at, observed_at)
+
+    def expire(self, cutoff: float, window_seconds: float) -> None:
+        # The ring buffer is in arrival order, so a late entry can sit behind newer ones.
+        if any(at < cutoff for at, _ in self.recent):
+            kept = [entry for entry in self.recent if entry[0] >= cutoff]
+            self.recent.clear()
+            self.recent.extend(kept)
+        while self.windows and self.windows[0][0] + window_seconds <= cutoff:
+            self.windows.popleft()
+
+    def sketch(self) -> QuantileSketch | None:
+        if not self.windows:
+            return None
+        merged = QuantileSketch(SKETCH_ACCURACY)
+        for _, sketch in self.windows:
+            merged.merge(sketch)
+        return merged
+
+
+class CompetitorStore:
+    def __init__(
+        self,
+        *,
+        max_age: float = 7 * 86400.0,
+        ring_size: int = 64,
+        windows: int = 7,
+        max_listings: int = 100_000,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        if max_age <= 0:
+            raise ValueError("max_age must be > 0")
+        self.max_age = max_age
+        self.ring_size = max(1, ring_size)
+        self.window_seconds = max_age / max(1, windows)
+        self.max_listings = max(1, max_listings)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._listings: OrderedDict[str, ListingPrices] = OrderedDict()
+        self.ingested = 0
+        self.rejected = 0
+        self.expired_listings = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(listing_id: Any) -> str | None:
+        """Listing ids are matched as strings (so 12 and "12" are the same listing)."""
+        if listing_id is None or isinstance(listing_id, (dict, list, bool)):
+            return None
+        key = str(listing_id)
+        return key if key else None
+
+    def ingest(self, listing_id: Any, prices: list[float], observed_at: float | None = None) -> int:
+        """Record prices observed for a listing; returns how many were accepted."""
+        key = self.key(listing_id)
+        if key is None:
+            raise ValueError("listing_id is required")
+        now = self._clock()
+        at = now if observed_at is None else min(observed_at, now + MAX_FUTURE_SKEW)
+        valid = [p for p in prices if p > 0 and math.isfinite(p)]
+        if at < now - self.max_age:
+            valid = []
+        with self._lock:
+            self.rejected += len(prices) - len(valid)
+            if not valid:
+                return 0
+            state = self._listings.get(key)
+            if state is None:
+                state = self._listings[key] = ListingPrices(self.ring_size)
+            for price in valid:
+                state.add(price, at, self.window_seconds)
+            self._listings.move_to_end(key)
+            self.ingested += len(valid)
+            while len(self._listings) > self.max_listings:
+                self._listings.popitem(last=False)
+                self.evictions += 1
+        return len(valid)
+
+    def _live(self, key: str, now: float) -> ListingPrices | None:
+        # Caller holds the lock.
+        state = self._listings.get(key)
+        if state is None:
+            return None
+        state.expire(now - self.max_age, self.window_seconds)
+        if not state.recent and not state.windows:
+            del self._listings[key]
+            self.expired_listings += 1
+            return None
+        return state
+
+    def prices(self, listing_id: Any) -> list[float]:
+        """The listing's unexpired ring-buffer prices (oldest first); [] if none."""
+        key = self.key(listing_id)
+        if key is None:
+            return []
+        with self._lock:
+            state = self._live(key, self._clock())
+            return [] if state is None else [price for _, price in state.recent]
+
+    def summary(self, listing_id: Any) -> dict[str, Any] | None:
+        key = self.key(listing_id)
+        if key is None:
+            return None
+        with self._lock:
+            state = self._live(key, self._clock())
+            if state is None:
+                return None
+            recent = [price for _, price in state.recent]
+            sketch = state.sketch()
+            updated_at = state.updated_at
+        out: dict[str, Any] = {
+            "listing_id": key,
+            "recent_count": len(recent),
+            "updated_at": updated_at,
+            "retained_count": 0,
+        }
+        if sketch is not None and sketch.count > 0:
+            out["retained_count"] = int(round(sketch.count))
+            out["quantiles"] = {f"p{int(q * 100)}": round(sketch.quantile(q), 6) for q in (0.1, 0.5, 0.9)}
+            out["min"] = sketch.min
+            out["max"] = sketch.max
+        return out
+
+    def expire(self) -> int:
+        """Drop expired observations everywhere; returns the number of listings forgotten."""
+        now = self._clock()
+        with self._lock:
+            before = self.expired_listings
+            for key in list(self._listings):
+                self._live(key, now)
+            return self.expired_listings - before
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "listings": len(self._listings),
+                "max_listings": self.max_listings,
+                "max_age_seconds": self.max_age,
+                "ring_size": self.ring_size,
+                "ingested": self.ingested,
+                "rejected": self.rejected,
+                "expired_listings": self.expired_listings,
+                "evictions": self.evictions,
+            }
+
+    def save(self, path: str) -> None:
+        """Write a snapshot atomically (temp file + rename)."""
+        self.expire()
+        with self._lock:
+            listings = {
+                key: {
+                    "recent": [list(entry) for entry in state.recent],
+                    "windows": [[start, sketch.to_dict()] for start, sketch in state.windows],
+                    "updated_at": state.updated_at,
+                }
+                for key, state in self._listings.items()
+            }
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": self._clock(),
+            "max_age_seconds": self.max_age,
+            "window_seconds": self.window_seconds,
+            "listings": listings,
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(codec.dumps(snapshot))
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> int:
+        """Replace the state with a snapshot from save(); returns the listings loaded (0 if no file)."""
+        try:
+            with open(path, "rb") as f:
+                snapshot = codec.loads(f.read())
+        except FileNotFoundError:
+            return 0
+        if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported competitor snapshot: {path}")
+
+        # Windows are re-bucketed when the snapshot was taken with another window size.
+        same_windows = snapshot.get("window_seconds") == self.window_seconds
+        listings: OrderedDict[str, ListingPrices] = OrderedDict()
+        raw_listings = sorted(snapshot["listings"].items(), key=lambda item: item[1]["updated_at"])
+        for key, raw in raw_listings[-self.max_listings :]:
+            state = ListingPrices(self.ring_size)
+            state.recent.extend((float(at), float(price)) for at, price in raw["recent"])
+            for start, sketch in raw["windows"]:
+                start = float(start)
+                if not same_windows:
+                    start -= start % self.window_seconds
+                sketch = QuantileSketch.from_dict(sketch)
+                if state.windows and state.windows[-1][0] == start:
+                    state.windows[-1][1].merge(sketch)
+                else:
+                    state.windows.append((start, sketch))
+            state.updated_at = float(raw["updated_at"])
+            listings[key] = state
+        with self._lock:
+            self._listings = listings
+        self.expire()
+        return len(self._listings)
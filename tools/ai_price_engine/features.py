@@ -0,0 +1,281 @@
+"""
+Listing feature store: the static pricing inputs of every listing in one memory-mapped file.
+
+cost_price, desired_margin, shipping_cost, platform_fee_pct and min_price rarely change,
+so instead of re-sending them with every request they can be loaded into a fixed-width
+binary file together with the min_price floor computed from them. With
+`server.py --listing-features PATH`, a payload that carries a `listing_id` and none of
+those inputs takes them from the file: recommend() neither decodes them nor recomputes
+the floor, and the payload only needs the fresh market signals.
+
+File layout (little endian): a HEADER (magic, record size, key size, record count,
+slot count), an open-addressing hash table of uint32 slots (record number + 1, 0 =
+empty; crc32 of the key, linear probing, at most half full), then the fixed-width
+RECORD entries. Lookups read the mapping directly, so every --workers process shares
+the same pages of the page cache. Listing ids are matched as strings (like
+/v1/competitors) and may be at most KEY_SIZE bytes of UTF-8. write() builds a new file
+next to the target and renames it over it; FeatureStore.refresh() maps the new file
+once it appears, while lookups already in progress finish on the old mapping. Each
+process also keeps up to `memo_size` decoded records of the mapping it reads, so hot
+listings skip the hashing and unpacking.
+
+Build a file with the bulk loader (rows are validated like recommend() payloads):
+
+    python features.py --data listings.csv --out listing_features.bin
+"""
+
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from collections.abc import Iterable
+from typing import Any, NamedTuple
+
+from competitors import CompetitorStore
+
+MAGIC = b"APEFEAT2"
+KEY_SIZE = 40
+HEADER = struct.Struct("<8sIIQQ")
+SLOT = struct.Struct("<I")
+# Payload inputs a record replaces, in RECORD order.
+INPUTS = ("cost_price", "desired_margin", "shipping_cost", "platform_fee_pct", "min_price")
+# key, INPUTS, floor, margin used, fee used, computed floor (NaN = missing), floor source.
+RECORD = struct.Struct(f"<{KEY_SIZE}s9dB7x")
+# Floor sources, as reported by server._compute_min_price(), by their code in RECORD.
+SOURCES = ("computed", "provided", "max(provided, computed)")
+
+_NAN = float("nan")
+
+
+class ListingFeatures(NamedTuple):
+    # INPUTS as given for the listing (None = missing).
+    cost_price: float | None
+    desired_margin: float | None
+    shipping_cost: float | None
+    platform_fee_pct: float | None
+    min_price: float | None
+    # The precomputed floor and how it was derived (see server._compute_min_price).
+    floor: float
+    floor_source: str
+    margin_used: float
+    fee_used: float
+    computed_floor: float | None
+
+
+def encode_key(listing_id: Any) -> bytes | None:
+    """The RECORD key of a listing id, or None if it can't be stored (see KEY_SIZE)."""
+    key = listing_id if type(listing_id) is str else CompetitorStore.key(listing_id)
+    if not key:
+        return None
+    raw = key.encode("utf-8")
+    if len(raw) > KEY_SIZE or b"\0" in raw:
+        return None
+    return raw.ljust(KEY_SIZE, b"\0")
+
+
+def _slot_count(count: int) -> int:
+    return 1 << max(1, (2 * count - 1).bit_length())
+
+
+def _tables_size(slots: int) -> int:
+    # The slot table is padded to 8 bytes so records stay aligned.
+    return HEADER.size + (slots * SLOT.size + 7) // 8 * 8
+
+
+def _pack(key: bytes, f: ListingFeatures) -> bytes:
+    numbers = (*f[:5], f.floor, f.margin_used, f.fee_used, f.computed_floor)
+    return RECORD.pack(key, *(_NAN if value is None else value for value in numbers), SOURCES.index(f.floor_source))
+
+
+def _unpack(record: tuple[Any, ...]) -> ListingFeatures:
+    # x == x is False only for NaN (missing).
+    _, cost, margin, shipping, fee, min_price, floor, margin_used, fee_used, computed, source = record
+    return ListingFeatures(
+        cost if cost == cost else None,
+        margin if margin == margin else None,
+        shipping if shipping == shipping else None,
+        fee if fee == fee else None,
+        min_price if min_price == min_price else None,
+        floor,
+        SOURCES[source],
+        margin_used,
+        fee_used,
+        computed if computed == computed else None,
+    )
+
+
+def write(path: str, listings: Iterable[tuple[Any, ListingFeatures]]) -> int:
+    """
+    Write a feature file from (listing_id, features) pairs and atomically replace `path`
+    with it (temp file + rename); a later pair for the same listing wins. Returns the
+    listings written. Raises ValueError for a listing id that can't be stored.
+    """
+    records: dict[bytes, ListingFeatures] = {}
+    for listing_id, feature in listings:
+        key = encode_key(listing_id)
+        if key is None:
+            raise ValueError(f"Unusable listing_id: {listing_id!r}")
+        records[key] = feature
+    keys = sorted(records)
+    slots = _slot_count(len(keys))
+    mask = slots - 1
+    table = bytearray(_tables_size(slots) - HEADER.size)
+    for number, key in enumerate(keys, 1):
+        slot = zlib.crc32(key) & mask
+        while SLOT.unpack_from(table, slot * SLOT.size)[0]:
+            slot = (slot + 1) & mask
+        SLOT.pack_into(table, slot * SLOT.size, number)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, RECORD.size, KEY_SIZE, len(keys), slots))
+        f.write(table)
+        for key in keys:
+            f.write(_pack(key, records[key]))
+    os.replace(tmp, path)
+    return len(keys)
+
+
+class _Mapping(NamedTuple):
+    data: mmap.mmap
+    count: int
+    mask: int
+    records_at: int
+    identity: tuple[int, int, int]
+    # Decoded records by listing key string; replaced along with the mapping.
+    memo: dict[str, ListingFeatures]
+
+
+def _file_identity(st: os.stat_result) -> tuple[int, int, int]:
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _open(path: str) -> _Mapping:
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        if st.st_size < HEADER.size:
+            raise ValueError(f"Not a listing feature file: {path}")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, record_size, key_size, count, slots = HEADER.unpack_from(data)
+    if magic != MAGIC or record_size != RECORD.size or key_size != KEY_SIZE or slots != _slot_count(count):
+        data.close()
+        raise ValueError(f"Unsupported listing feature file: {path}")
+    records_at = _tables_size(slots)
+    if st.st_size != records_at + count * RECORD.size:
+        data.close()
+        raise ValueError(f"Truncated listing feature file: {path}")
+    return _Mapping(data, count, slots - 1, records_at, _file_identity(st), {})
+
+
+class FeatureStore:
+    """Read-only view of a write() file; thread-safe, and cheap to share across a fork."""
+
+    def __init__(self, path: str, *, memo_size: int = 16_384) -> None:
+        self.path = path
+        self.memo_size = max(0, memo_size)
+        self._mapping = _open(path)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.reload_errors = 0
+
+    def __len__(self) -> int:
+        return self._mapping.count
+
+    def get(self, listing_id: Any) -> ListingFeatures | None:
+        mapping = self._mapping
+        name = listing_id if type(listing_id) is str else CompetitorStore.key(listing_id)
+        found = mapping.memo.get(name) if name else None
+        if found is None:
+            key = encode_key(name)
+            found = None if key is None else self._find(mapping, key)
+            if found is not None and self.memo_size:
+                if len(mapping.memo) >= self.memo_size:
+                    mapping.memo.clear()
+                mapping.memo[name] = found
+        # Plain counters: an occasional lost update under threads is fine for stats.
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return found
+
+    @staticmethod
+    def _find(mapping: _Mapping, key: bytes) -> ListingFeatures | None:
+        data, _, mask, records_at, _, _ = mapping
+        slot = zlib.crc32(key) & mask
+        while True:
+            number = SLOT.unpack_from(data, HEADER.size + slot * SLOT.size)[0]
+            if not number:
+                return None
+            offset = records_at + (number - 1) * RECORD.size
+            if data[offset : offset + KEY_SIZE] == key:
+                return _unpack(RECORD.unpack_from(data, offset))
+            slot = (slot + 1) & mask
+
+    def refresh(self) -> bool:
+        """Map `path` again if it was replaced since it was mapped; True if it was."""
+        with self._lock:
+            try:
+                if _file_identity(os.stat(self.path)) == self._mapping.identity:
+                    return False
+                mapping = _open(self.path)
+            except (OSError, ValueError):
+                # Keep serving the current file; a bad or half-copied update is retried later.
+                self.reload_errors += 1
+                return False
+            # The old mapping is not closed: in-flight lookups may still read it, and
+            # it is unmapped once they drop their reference.
+            self._mapping = mapping
+            self.reloads += 1
+            return True
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "path": self.path,
+            "listings": self._mapping.count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+        }
+
+
+def main() -> None:
+    # The loader validates rows with the server's rules, so it is the one part of this
+    # module that depends on server.py (which imports this module for FeatureStore).
+    import score
+    import server
+    import train
+
+    parser = argparse.ArgumentParser(description="Build a listing feature file for server.py --listing-features.")
+    parser.add_argument("--data", required=True, help="Input listings (.csv, .jsonl/.ndjson, .json or .npz)")
+    parser.add_argument("--out", required=True, help="Feature file to (atomically) replace")
+    args = parser.parse_args()
+
+    listings: list[tuple[Any, ListingFeatures]] = []
+    rejected = 0
+    for number, row in enumerate(score.iter_rows(args.data), 1):
+        listing_id = score.row_listing_id(row) if isinstance(row, dict) else None
+        if encode_key(listing_id) is None:
+            problem = "missing or unusable listing_id"
+        else:
+            try:
+                listings.append((listing_id, server.listing_features(train.payload_from_row(row, keep_invalid=True))))
+                continue
+            except server.InputError as e:
+                problem = f"{e.message} {e.errors}"
+        rejected += 1
+        print(f"Row {number}: {problem}", file=sys.stderr)
+    written = write(args.out, listings)
+    print(f"Wrote {written} listings to {args.out} ({rejected} rows rejected)")
+
+
+if __name__ == "__main__":
+    main()
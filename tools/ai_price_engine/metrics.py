@@ -0,0 +1,280 @@
+"""
+In-process request metrics, rendered in the Prometheus text exposition format.
+
+Tracks request counts by route and status, request latency per route, per-stage
+latency (body read, JSON decode, cache lookup, validation, min price, competitor
+aggregation, formula, serialization, socket write), in-flight requests and
+InputError counts by field. With --workers every process keeps its own metrics.
+
+Request counts and latencies cover every request. Stage timings can be sampled
+(every Nth request) since timing each stage costs about as much as a cheap stage.
+"""
+
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds (upper bounds, inclusive).
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+STAGES: tuple[str, ...] = (
+    "body_read",
+    "json_decode",
+    "cache",
+    "validate",
+    "min_price",
+    "competitor",
+    "formula",
+    "serialize",
+    "write",
+)
+
+
+class StageTimer:
+    """
+    Collects stage timings for one request.
+
+    `mark(stage)` attributes the time since the previous mark (or creation/reset) to
+    `stage`. Marks are only recorded here and observed when the request finishes, one
+    observation per mark (a batch of N items yields N formula timings).
+    """
+
+    __slots__ = ("marks",)
+
+    def __init__(self) -> None:
+        self.marks: list[tuple[str | None, float]] = [(None, time.perf_counter())]
+
+    def mark(self, stage: str) -> None:
+        self.marks.append((stage, time.perf_counter()))
+
+    def reset(self) -> None:
+        """Restart the clock without attributing the elapsed time to any stage."""
+        self.marks.append((None, time.perf_counter()))
+
+
+class _NoStages:
+    __slots__ = ()
+
+    def mark(self, stage: str) -> None:
+        pass
+
+    def reset(self) -> None:
+        pass
+
+
+# Stand-in for callers that don't collect stage timings.
+NO_STAGES: Any = _NoStages()
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)  # last slot: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list[str]:
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.bounds, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum!r}" if labels else f"{name}_sum {self.sum!r}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}" if labels else f"{name}_count {self.count}")
+        return lines
+
+
+def _label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS, *, stage_sample_every: int = 1) -> None:
+        self.buckets = tuple(buckets)
+        self.stage_sample_every = max(1, stage_sample_every)
+        self._ticks = itertools.count()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests: dict[tuple[str, int], int] = {}
+        self.request_seconds: dict[str, Histogram] = {}
+        self.stage_seconds: dict[str, Histogram] = {stage: Histogram(self.buckets) for stage in STAGES}
+        self.input_errors: dict[str, int] = {}
+
+    def _sampled(self) -> bool:
+        return self.stage_sample_every == 1 or next(self._ticks) % self.stage_sample_every == 0
+
+    def stage_timer(self) -> StageTimer:
+        """
+        A StageTimer for a sampled request, NO_STAGES otherwise. Call it once per request:
+        it decides whether any of that request's stages are recorded.
+        """
+        return StageTimer() if self._sampled() else NO_STAGES
+
+    def start_request(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def finish_request(self, route: str, status: int, seconds: float, stages: StageTimer | None = None) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            key = (route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.request_seconds.get(route)
+            if histogram is None:
+                histogram = self.request_seconds[route] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            if stages is not None and stages is not NO_STAGES:
+                self._observe_marks(stages.marks)
+
+    def _observe_marks(self, marks: list[tuple[str | None, float]]) -> None:
+        # Histogram.observe() inlined: this runs for every mark of every request.
+        histograms = self.stage_seconds
+        previous = marks[0][1]
+        for stage, at in marks:
+            if stage is not None:
+                histogram = histograms.get(stage) or self._stage(stage)
+                value = at - previous
+                histogram.counts[bisect_left(histogram.bounds, value)] += 1
+                histogram.sum += value
+                histogram.count += 1
+            previous = at
+
+    def observe_stage(self, stage: str, seconds: float, stages: StageTimer) -> None:
+        """Record a stage timed after finish_request() (the response write) if `stages` is sampled."""
+        if stages is NO_STAGES:
+            return
+        with self._lock:
+            self._stage(stage).observe(seconds)
+
+    def _stage(self, stage: str) -> Histogram:
+        histogram = self.stage_seconds.get(stage)
+        if histogram is None:
+            histogram = self.stage_seconds[stage] = Histogram(self.buckets)
+        return histogram
+
+    def count_input_errors(self, errors: Mapping[str, Any]) -> None:
+        if not errors:
+            return
+        with self._lock:
+            for name in errors:
+                self.input_errors[name] = self.input_errors.get(name, 0) + 1
+
+    def render(
+        self,
+        *,
+        model_version: str,
+        cache_stats: Mapping[str, Any] | None = None,
+        coalesce_stats: Mapping[str, Any] | None = None,
+        admission_stats: Mapping[str, Any] | None = None,
+    ) -> str:
+        """Text exposition of every metric (plus model, cache, request coalescing and admission info)."""
+        out: list[str] = []
+        with self._lock:
+            out += [
+                "# HELP price_engine_requests_total Requests handled, by route and status.",
+                "# TYPE price_engine_requests_total counter",
+            ]
+            for (route, status), n in sorted(self.requests.items()):
+                out.append(f'price_engine_requests_total{{route="{_label(route)}",status="{status}"}} {n}')
+
+            out += [
+                "# HELP price_engine_request_duration_seconds Time to handle a request, by route.",
+                "# TYPE price_engine_request_duration_seconds histogram",
+            ]
+            for route, histogram in sorted(self.request_seconds.items()):
+                out += histogram.render("price_engine_request_duration_seconds", f'route="{_label(route)}"')
+
+            out += [
+                "# HELP price_engine_stage_duration_seconds Time spent in a processing stage (per occurrence, sampled).",
+                "# TYPE price_engine_stage_duration_seconds histogram",
+            ]
+            for stage, histogram in self.stage_seconds.items():
+                out += histogram.render("price_engine_stage_duration_seconds", f'stage="{_label(stage)}"')
+
+            out += [
+                "# HELP price_engine_in_flight_requests Requests currently being handled.",
+                "# TYPE price_engine_in_flight_requests gauge",
+                f"price_engine_in_flight_requests {self.in_flight}",
+                "# HELP price_engine_input_errors_total Rejected payload fields (InputError), by field.",
+                "# TYPE price_engine_input_errors_total counter",
+            ]
+            for name, n in sorted(self.input_errors.items()):
+                out.append(f'price_engine_input_errors_total{{field="{_label(name)}"}} {n}')
+
+        out += [
+            "# HELP price_engine_model_info Currently loaded weights.",
+            "# TYPE price_engine_model_info gauge",
+            f'price_engine_model_info{{model_version="{_label(model_version)}"}} 1',
+        ]
+        if cache_stats is not None:
+            out += [
+                "# HELP price_engine_cache_entries Result cache entries.",
+                "# TYPE price_engine_cache_entries gauge",
+                f"price_engine_cache_entries {cache_stats['size']}",
+            ]
+            for key in ("hits", "misses", "evictions", "expirations", "invalidations"):
+                out += [
+                    f"# TYPE price_engine_cache_{key}_total counter",
+                    f"price_engine_cache_{key}_total {cache_stats[key]}",
+                ]
+        if coalesce_stats is not None:
+            out += [
+                "# HELP price_engine_coalesced_requests_total Requests answered by another request's computation.",
+                "# TYPE price_engine_coalesced_requests_total counter",
+                f"price_engine_coalesced_requests_total {coalesce_stats['coalesced']}",
+                "# HELP price_engine_coalesce_computations_total Recommendations computed (not coalesced).",
+                "# TYPE price_engine_coalesce_computations_total counter",
+                f"price_engine_coalesce_computations_total {coalesce_stats['computed']}",
+            ]
+        if admission_stats is not None:
+            out += [
+                "# HELP price_engine_admission_queue_length Connections waiting for a worker thread.",
+                "# TYPE price_engine_admission_queue_length gauge",
+                f"price_engine_admission_queue_length {admission_stats['queued']}",
+                "# HELP price_engine_admission_busy_workers Worker threads serving a connection.",
+                "# TYPE price_engine_admission_busy_workers gauge",
+                f"price_engine_admission_busy_workers {admission_stats['active']}",
+                "# HELP price_engine_admission_rejected_total Connections refused or dropped unserved, by reason.",
+                "# TYPE price_engine_admission_rejected_total counter",
+            ]
+            for reason, key in (
+                ("queue_full", "rejected_queue_full"),
+                ("client_limit", "rejected_client_limit"),
+                ("queue_wait", "shed_queue_wait"),
+                ("deadline", "shed_deadline"),
+                ("idle", "shed_idle"),
+            ):
+                out.append(f'price_engine_admission_rejected_total{{reason="{reason}"}} {admission_stats[key]}')
+        return "\n".join(out) + "\n"
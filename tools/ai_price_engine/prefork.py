@@ -0,0 +1,133 @@
+"""
+Pre-fork process supervisor for the price engine.
+
+The parent loads everything it can (weights, lookup tables) and then forks N workers,
+so read-only state is shared copy-on-write. Workers either inherit one listening
+socket from the parent or each bind their own with SO_REUSEPORT, letting the kernel
+spread connections across processes. Crashed workers are restarted.
+
+POSIX only (requires os.fork).
+"""
+
+from __future__ import annotations
+
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from typing import Callable
+
+# Workers that die sooner than this after starting are restarted with a delay, so a
+# worker that crashes on boot does not turn the supervisor into a fork loop.
+_MIN_WORKER_UPTIME = 1.0
+_RESTART_BACKOFF = 1.0
+
+
+def fork_supported() -> bool:
+    return hasattr(os, "fork")
+
+
+def reuse_port_supported() -> bool:
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def bind_socket(host: str, port: int, *, reuse_port: bool = False, backlog: int = 1024) -> socket.socket:
+    """Create a listening TCP socket (IPv4 or IPv6, matching `host`)."""
+    info = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)
+    family, socktype, proto, _, address = info[0]
+    sock = socket.socket(family, socktype, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    sock.set_inheritable(True)
+    return sock
+
+
+def _exit_when_orphaned(parent: int, interval: float = 1.0) -> None:
+    # If the supervisor is killed outright (SIGKILL), don't leave workers serving forever.
+    while os.getppid() == parent:
+        time.sleep(interval)
+    os._exit(0)
+
+
+class Supervisor:
+    """
+    Fork `workers` processes running `serve()` and keep that many alive.
+
+    `serve` runs in the child and should block until the worker is told to stop
+    (SIGTERM). Returning, or raising, ends the worker; the supervisor restarts it.
+    """
+
+    def __init__(self, serve: Callable[[], None], workers: int) -> None:
+        if not fork_supported():
+            raise RuntimeError("Pre-fork mode requires os.fork (POSIX only)")
+        self.serve = serve
+        self.workers = max(1, workers)
+        self.children: dict[int, float] = {}  # pid -> start time
+        self._stopping = False
+
+    def _spawn(self) -> None:
+        parent = os.getpid()
+        pid = os.fork()
+        if pid == 0:  # child
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            threading.Thread(target=_exit_when_orphaned, args=(parent,), daemon=True).start()
+            code = 0
+            try:
+                self.serve()
+            except BaseException:  # noqa: BLE001 - the worker must never return into the supervisor loop
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+
+    def _stop(self, signum: int, frame: object) -> None:
+        self._stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        # Move everything loaded so far out of the GC's reach so collections in the
+        # workers don't write to (and un-share) the parent's pages.
+        gc.collect()
+        gc.freeze()
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            started = self.children.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            print(f"Worker {pid} exited with status {code}; restarting", file=sys.stderr)
+            if time.monotonic() - started < _MIN_WORKER_UPTIME:
+                time.sleep(_RESTART_BACKOFF)
+            if not self._stopping:
+                self._spawn()
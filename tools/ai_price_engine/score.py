@@ -0,0 +1,316 @@
+"""
+Offline bulk scoring: reprice a whole listing file without going through the HTTP server.
+
+Rows are read lazily from CSV, JSON lines or a columnar .npz file (the same field
+names train.py understands; a .json document is parsed whole, and .npz arrays become
+rows one slice at a time), scored in chunks across a process pool with the
+server.recommend() semantics, and written to CSV or JSON lines in input order as each
+chunk completes. Every input row produces one output row; rows that can't be scored
+carry the error instead of a price.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from collections.abc import Iterator
+from typing import Any
+
+import codec
+import server
+import train
+
+try:
+    import numpy as np
+
+    import vectorized
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+    vectorized = None
+
+CSV_COLUMNS = ("row", "listing_id", "recommended_price", "confidence", "model_version", "error")
+
+# Input columns echoed back to identify a listing, in order of preference.
+_ID_COLUMNS = ("listing_id", "id")
+# Rows converted from .npz arrays to Python values at a time.
+_NPZ_SLICE = 4096
+
+
+class InvalidRow:
+    """Placeholder for an input row that couldn't be decoded."""
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+
+def iter_rows(path: str) -> Iterator[Any]:
+    """
+    Input rows of a .csv, .jsonl/.ndjson, .json or .npz file, in file order. A JSON line
+    that can't be decoded is yielded as an InvalidRow so the row count stays aligned.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+    elif ext in (".jsonl", ".ndjson"):
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield codec.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    yield InvalidRow("Invalid JSON")
+    elif ext == ".json":
+        yield from train._load_dataset(path)
+    elif ext == ".npz":
+        yield from _iter_npz_rows(path)
+    else:
+        raise ValueError("Unsupported input format (use .csv, .jsonl/.ndjson, .json or .npz)")
+
+
+def _iter_npz_rows(path: str) -> Iterator[dict[str, Any]]:
+    # Columnar input: one equal-length array per field; NaN means the field is missing.
+    if np is None:
+        raise ValueError("Reading .npz files requires numpy")
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {key: data[key] for key in data.files}
+    n = len(next(iter(arrays.values()))) if arrays else 0
+    # Only one slice at a time becomes Python objects, not every column at once.
+    for offset in range(0, n, _NPZ_SLICE):
+        columns = {key: values[offset : offset + _NPZ_SLICE].tolist() for key, values in arrays.items()}
+        for i in range(min(_NPZ_SLICE, n - offset)):
+            row: dict[str, Any] = {}
+            for key, values in columns.items():
+                value = values[i]
+                if isinstance(value, float) and math.isnan(value):
+                    continue
+                row[key] = value
+            yield row
+
+
+def row_listing_id(row: dict[str, Any]) -> Any:
+    """The first non-blank _ID_COLUMNS value of an input row, or None."""
+    for key in _ID_COLUMNS:
+        value = row.get(key)
+        if value is not None and value != "":
+            return value
+    return None
+
+
+# Set in each pool worker by _init_worker().
+_weights: server.CompiledWeights | None = None
+_engine = "scalar"
+
+
+def _init_worker(weights: dict[str, Any], engine: str) -> None:
+    global _weights, _engine
+    _weights = server.compile_weights(weights)
+    _engine = engine
+
+
+def _score_rows(rows: list[Any]) -> list[dict[str, Any]]:
+    """Score decoded input rows; returns one recommend_many()-style dict per row."""
+    assert _weights is not None
+    results: list[dict[str, Any]] = [{} for _ in rows]
+    payloads: list[dict[str, Any]] = []
+    positions: list[int] = []
+    for i, row in enumerate(rows):
+        if isinstance(row, InvalidRow):
+            results[i] = {"error": {"message": row.message, "errors": {}}}
+        elif not isinstance(row, dict):
+            results[i] = {"error": {"message": "Row must be an object", "errors": {}}}
+        else:
+            payloads.append(train.payload_from_row(row, keep_invalid=True))
+            positions.append(i)
+
+    if _engine == "vectorized" and payloads:
+        scored = vectorized.recommend_batch(vectorized.columns_from_payloads(payloads), _weights).to_results()
+    else:
+        scored = server.recommend_many(payloads, _weights)
+
+    for i, result in zip(positions, scored):
+        listing_id = row_listing_id(rows[i])
+        if listing_id is not None:
+            result = {"listing_id": listing_id, **result}
+        results[i] = result
+    return results
+
+
+def _format_error(error: dict[str, Any]) -> str:
+    fields = "; ".join(f"{key}: {message}" for key, message in error["errors"].items())
+    return f"{error['message']} ({fields})" if fields else error["message"]
+
+
+def _score_chunk(task: tuple[int, list[Any], str]) -> tuple[bytes, int, int]:
+    """Score one chunk and render it in the output format; returns (data, rows, errors)."""
+    start, rows, out_format = task
+    results = _score_rows(rows)
+    errors = sum(1 for r in results if "error" in r)
+
+    if out_format == "jsonl":
+        data = b"".join(codec.dumps({"row": start + i, **r}) + b"\n" for i, r in enumerate(results))
+        return data, len(results), errors
+
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    for i, r in enumerate(results):
+        error = r.get("error")
+        writer.writerow(
+            (
+                start + i,
+                r.get("listing_id", ""),
+                r.get("recommended_price", ""),
+                r.get("confidence", ""),
+                r.get("model_version", ""),
+                _format_error(error) if error else "",
+            )
+        )
+    return buf.getvalue().encode("utf-8"), len(results), errors
+
+
+def _chunks(rows: Iterator[Any], start: int, size: int, out_format: str) -> Iterator[tuple[int, list[Any], str]]:
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield start, chunk, out_format
+        start += len(chunk)
+
+
+def _resume_offset(path: str, out_format: str) -> int | None:
+    """
+    Input row to resume from, based on the last complete line of an existing output.
+
+    A partially written last line (e.g. from a killed run) is truncated away.
+    Returns None if there is nothing to resume from.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        # Scan backwards in blocks for the last two newlines.
+        tail = b""
+        pos = size
+        while pos > 0 and tail.count(b"\n") < 2:
+            step = min(pos, 64 * 1024)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+        complete = tail[: tail.rfind(b"\n") + 1]
+        f.truncate(pos + len(complete))
+
+    lines = complete.splitlines()
+    if not lines:
+        return None
+    last = lines[-1]
+    try:
+        if out_format == "jsonl":
+            return int(json.loads(last)["row"]) + 1
+        if last.startswith(b"row,"):
+            return None  # header only
+        return int(last.split(b",", 1)[0]) + 1
+    except (ValueError, KeyError, TypeError):
+        raise SystemExit(f"Can't resume: unrecognized last line in {path}") from None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Score a listing file offline with the AI Price Engine formula.")
+    parser.add_argument("--data", required=True, help="Input listings (.csv, .jsonl/.ndjson, .json or .npz)")
+    parser.add_argument("--out", required=True, help="Output file (.csv or .jsonl/.ndjson)")
+    parser.add_argument(
+        "--weights",
+        default=os.path.join(os.path.dirname(__file__), "weights.json"),
+        help="Path to weights.json",
+    )
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes (0 = one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Rows scored and written per chunk")
+    parser.add_argument("--start", type=int, default=0, help="Skip this many input rows (0-based offset)")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Append to an existing --out, continuing after the last row it contains",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("auto", "scalar", "vectorized"),
+        default="auto",
+        help="vectorized needs numpy (identical results, faster); auto picks it when available",
+    )
+    args = parser.parse_args()
+
+    out_format = "jsonl" if os.path.splitext(args.out)[1].lower() in (".jsonl", ".ndjson") else "csv"
+    engine = args.engine
+    if engine == "auto":
+        engine = "vectorized" if vectorized is not None else "scalar"
+    elif engine == "vectorized" and vectorized is None:
+        raise SystemExit("--engine vectorized requires numpy")
+
+    start = max(0, args.start)
+    append = False
+    if args.resume:
+        resumed = _resume_offset(args.out, out_format)
+        if resumed is not None:
+            start, append = resumed, True
+
+    weights = server._load_weights(args.weights)
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    chunk_size = max(1, args.chunk_size)
+
+    rows = iter_rows(args.data)
+    if start:
+        next(itertools.islice(rows, start, start), None)
+    tasks = _chunks(rows, start, chunk_size, out_format)
+
+    scored = errors = 0
+    started = time.monotonic()
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "ab" if append else "wb") as out:
+        if out_format == "csv" and out.tell() == 0:
+            out.write((",".join(CSV_COLUMNS) + "\n").encode("utf-8"))
+
+        def write(result: tuple[bytes, int, int]) -> None:
+            nonlocal scored, errors
+            data, chunk_rows, chunk_errors = result
+            out.write(data)
+            out.flush()
+            scored += chunk_rows
+            errors += chunk_errors
+
+        if workers == 1:
+            _init_worker(dict(weights), engine)
+            for task in tasks:
+                write(_score_chunk(task))
+        else:
+            # Keep a bounded number of chunks in flight so memory stays flat however
+            # large the input is, and write results in input order.
+            with multiprocessing.Pool(workers, _init_worker, (dict(weights), engine)) as pool:
+                pending: deque[Any] = deque()
+                for task in tasks:
+                    pending.append(pool.apply_async(_score_chunk, (task,)))
+                    if len(pending) >= workers * 2:
+                        write(pending.popleft().get())
+                while pending:
+                    write(pending.popleft().get())
+
+    elapsed = time.monotonic() - started
+    rate = scored / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Scored {scored} rows from offset {start} ({errors} errors) in {elapsed:.1f}s "
+        f"[{rate:,.0f} rows/s, {workers} workers, {engine}] -> {args.out}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
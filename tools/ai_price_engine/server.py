@@ -1,12 +1,40 @@
 from __future__ import annotations
 
 import argparse
+import functools
+import itertools
 import json
 import math
 import os
+import socket
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from dataclasses import dataclass, field
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from typing import Any
-from urllib.parse import parse_qs, urlsplit
+from typing import Any, NamedTuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import admission
+import aioserver
+import codec
+import metrics
+import prefork
+import streaming
+from cache import ResultCache, SingleFlight, canonical_key
+from competitors import CompetitorStore
+from features import FeatureStore, ListingFeatures
+from features import INPUTS as LISTING_INPUTS
+from shadow import Outcome, ShadowScorer
+
+try:
+    import numpy as _np
+except ImportError:  # pragma: no cover - numpy is optional
+    _np = None
+
+# Competitor lists at least this long are aggregated with np.partition (introselect, O(n))
+# instead of a full sort; below it, sorted() is faster than the array round trip.
+SELECT_MIN_SIZE = 512
 
 
 def _clamp(value: float, low: float, high: float) -> float:
@@ -25,18 +53,6 @@ def _to_float(value: Any) -> float | None:
         return None
 
 
-def _parse_optional_float(payload: dict[str, Any], key: str) -> float | None:
-    if key not in payload:
-        return None
-    raw = payload.get(key)
-    if raw is None:
-        return None
-    parsed = _to_float(raw)
-    if parsed is None:
-        raise InputError("Invalid numeric inputs", {key: "Must be a finite number"})
-    return parsed
-
-
 class InputError(Exception):
     def __init__(self, message: str, errors: dict[str, str] | None = None):
         super().__init__(message)
@@ -44,6 +60,114 @@ class InputError(Exception):
         self.errors = errors or {}
 
 
+class PayloadField(NamedTuple):
+    key: str
+    kind: str  # "number" | "number_list"
+    stage: int
+
+
+# Declarative recommend() payload schema, decoded and validated in one pass.
+# `stage` mirrors where recommend() checks the field, so when a payload has several
+# problems the reported error is the same one the staged checks always reported:
+#   0: cost/margin/current/shipping/fee (then ">= 0" checks)
+#   1: min_price (then floor computation)
+#   2: competitor signal
+#   3: demand and optional features
+PAYLOAD_SCHEMA: tuple[PayloadField, ...] = (
+    PayloadField("cost_price", "number", 0),
+    PayloadField("desired_margin", "number", 0),
+    PayloadField("current_price", "number", 0),
+    PayloadField("shipping_cost", "number", 0),
+    PayloadField("platform_fee_pct", "number", 0),
+    PayloadField("min_price", "number", 1),
+    PayloadField("competitor_avg", "number", 2),
+    PayloadField("competitor_prices", "number_list", 2),
+    PayloadField("market_sample_size", "number", 3),
+    PayloadField("demand_factor", "number", 3),
+    PayloadField("sales_velocity", "number", 3),
+    PayloadField("stock_level", "number", 3),
+    PayloadField("rating", "number", 3),
+    PayloadField("promo_factor", "number", 3),
+    PayloadField("seasonality_factor", "number", 3),
+)
+
+
+class DecodedPayload:
+    """Validated payload values (None = missing) plus field errors awaiting their stage."""
+
+    __slots__ = ("values", "competitor_prices", "errors")
+
+    def __init__(
+        self,
+        values: dict[str, float | None],
+        competitor_prices: list[float],
+        errors: dict[str, str] | None,
+    ) -> None:
+        self.values = values
+        self.competitor_prices = competitor_prices
+        self.errors = errors
+
+    def check(self, stage: int) -> None:
+        """Raise the first decode error belonging to `stage`, if any."""
+        if not self.errors:
+            return
+        for spec in PAYLOAD_SCHEMA:
+            if spec.stage == stage and spec.key in self.errors:
+                raise InputError("Invalid numeric inputs", {spec.key: self.errors[spec.key]})
+
+
+def _decode_number_list(raw: Any) -> tuple[list[float], str | None]:
+    if not isinstance(raw, list):
+        return [], "Must be a list of numbers"
+    out: list[float] = []
+    for x in raw:
+        if x is None:
+            continue
+        parsed = _to_float(x)
+        if parsed is None:
+            return [], "List contains a non-numeric value"
+        if parsed > 0:
+            out.append(parsed)
+    if raw and not out:
+        return [], "Must include at least one positive number"
+    return out, None
+
+
+_NUMBER_FIELDS = tuple(spec.key for spec in PAYLOAD_SCHEMA if spec.kind == "number")
+
+
+def decode_payload(payload: dict[str, Any]) -> DecodedPayload:
+    """Decode every PAYLOAD_SCHEMA field of a recommend() payload in one pass."""
+    values: dict[str, float | None] = dict.fromkeys(_NUMBER_FIELDS)
+    errors: dict[str, str] | None = None
+    for key, raw in payload.items():
+        if raw is None or key not in values:
+            continue
+        # Fast paths for what JSON decoding produces; everything else goes via _to_float.
+        raw_type = type(raw)
+        if raw_type is float:
+            parsed = raw if raw - raw == 0.0 else None  # rejects inf/nan
+        elif raw_type is int:
+            parsed = float(raw)
+        else:
+            parsed = _to_float(raw)
+        if parsed is None:
+            if errors is None:
+                errors = {}
+            errors[key] = "Must be a finite number"
+        values[key] = parsed
+
+    competitor_prices: list[float] = []
+    raw_prices = payload.get("competitor_prices")
+    if raw_prices is not None:
+        competitor_prices, error = _decode_number_list(raw_prices)
+        if error is not None:
+            if errors is None:
+                errors = {}
+            errors["competitor_prices"] = error
+    return DecodedPayload(values, competitor_prices, errors)
+
+
 def _as_percent(value: float) -> float:
     if value > 1.0:
         return value / 100.0
@@ -64,6 +188,9 @@ def _robust_price_average(values: list[float]) -> tuple[float, str]:
     - n < 5: median (stable for small samples)
     - n >= 5: 10% trimmed mean
     """
+    if _np is not None and len(values) >= SELECT_MIN_SIZE:
+        return _trimmed_mean_by_selection(values)
+
     values = [v for v in values if v > 0 and math.isfinite(v)]
     if not values:
         raise ValueError("No valid competitor prices")
@@ -80,6 +207,26 @@ def _robust_price_average(values: list[float]) -> tuple[float, str]:
     return sum(core) / len(core), "trimmed_mean_10pct"
 
 
+def _trimmed_mean_by_selection(values: list[float]) -> tuple[float, str]:
+    """
+    _robust_price_average for long lists: two-sided partition around the trim bounds
+    selects the same core as sorting, in linear time. The core is then summed in
+    ascending order, one value at a time, exactly like the sorted path, so the mean is
+    bit-identical (numpy's pairwise sum is not).
+    """
+    prices = _np.asarray(values, dtype=_np.float64)
+    prices = prices[(prices > 0) & _np.isfinite(prices)]
+    n = int(prices.size)
+    if n == 0:
+        raise ValueError("No valid competitor prices")
+    if n < 5:
+        return _median(prices.tolist()), "median"
+
+    trim = max(1, int(n * 0.1))
+    core = _np.partition(prices, (trim, n - trim - 1))[trim : n - trim]
+    return sum(_np.sort(core).tolist()) / int(core.size), "trimmed_mean_10pct"
+
+
 def _boolish(value: Any) -> bool:
     if isinstance(value, bool):
         return value
@@ -92,7 +239,94 @@ def _boolish(value: Any) -> bool:
     return False
 
 
-def _sanitize_weights(raw: dict[str, Any]) -> dict[str, Any]:
+class CompiledWeights(Mapping[str, Any]):
+    """
+    Immutable, sanitized weights with the per-request constants precomputed.
+
+    Reads like the weights dict (`w["alpha"]`, `w.get(...)`, `dict(w)`), but the
+    scoring engines use the attributes directly: no per-request dict lookups, float()
+    conversions or log1p(ref) recomputation.
+    """
+
+    __slots__ = (
+        "_raw",
+        "model_version",
+        "alpha",
+        "beta",
+        "gamma_multiplier",
+        "ceiling_pct",
+        "ceiling_factor",
+        "demand_default",
+        "sales_velocity_ref",
+        "sales_velocity_weight",
+        "sales_velocity_log_ref",
+        "stock_level_ref",
+        "stock_level_log_ref",
+        "stock_max_delta",
+        "stock_multiplier_low",
+        "stock_multiplier_high",
+        "rating_weight",
+        "smoothing",
+        "smoothing_keep",
+    )
+
+    def __init__(self, raw: Mapping[str, Any]) -> None:
+        # Defaults mirror what recommend() assumed for missing keys before compilation.
+        values = dict(raw)
+        sales_ref = float(values.get("sales_velocity_ref", 50.0))
+        stock_ref = float(values.get("stock_level_ref", 200.0))
+        ceiling_pct = float(values.get("competitive_ceiling_pct", 0.07))
+        max_delta = float(values.get("stock_multiplier_max_delta", 0.08))
+        smoothing = float(values.get("current_price_smoothing", 0.10))
+
+        init = super().__setattr__
+        init("_raw", values)
+        init("model_version", str(values.get("model_version", "mock-formula-v2")))
+        init("alpha", float(values.get("alpha", 0.65)))
+        init("beta", float(values.get("beta", 0.35)))
+        init("gamma_multiplier", float(values.get("gamma_multiplier", 0.05)))
+        init("ceiling_pct", ceiling_pct)
+        init("ceiling_factor", 1.0 + max(0.0, ceiling_pct))
+        init("demand_default", float(values.get("demand_default", 0.5)))
+        init("sales_velocity_ref", sales_ref)
+        init("sales_velocity_weight", float(values.get("sales_velocity_weight", 0.12)))
+        init("sales_velocity_log_ref", math.log1p(sales_ref))
+        init("stock_level_ref", stock_ref)
+        init("stock_level_log_ref", math.log1p(stock_ref))
+        init("stock_max_delta", max_delta)
+        init("stock_multiplier_low", 1.0 - max_delta)
+        init("stock_multiplier_high", 1.0 + max_delta)
+        init("rating_weight", float(values.get("rating_weight", 0.08)))
+        init("smoothing", smoothing)
+        init("smoothing_keep", 1.0 - smoothing)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("CompiledWeights is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("CompiledWeights is immutable")
+
+    def __getitem__(self, key: str) -> Any:
+        return self._raw[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._raw)
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def __repr__(self) -> str:
+        return f"CompiledWeights({self._raw!r})"
+
+
+def compile_weights(weights: Mapping[str, Any]) -> CompiledWeights:
+    """Return `weights` as CompiledWeights (plain dicts are compiled as-is, not sanitized)."""
+    if isinstance(weights, CompiledWeights):
+        return weights
+    return CompiledWeights(weights)
+
+
+def _sanitize_weights(raw: Mapping[str, Any]) -> CompiledWeights:
     """
     Enforce stability constraints:
     - alpha,beta: non-negative and sum to 1
@@ -136,25 +370,27 @@ def _sanitize_weights(raw: dict[str, Any]) -> dict[str, Any]:
     )
 
     # Keep unknown keys (like training metadata) but override sanitized core keys.
-    return {
-        **raw,
-        "model_version": model_version,
-        "alpha": alpha,
-        "beta": beta,
-        "gamma_multiplier": gamma_multiplier,
-        "competitive_ceiling_pct": ceiling_pct,
-        "demand_default": demand_default,
-        "sales_velocity_ref": sales_velocity_ref,
-        "sales_velocity_weight": sales_velocity_weight,
-        "stock_level_ref": stock_level_ref,
-        "stock_multiplier_max_delta": stock_multiplier_max_delta,
-        "rating_weight": rating_weight,
-        "current_price_smoothing": current_price_smoothing,
-    }
+    return CompiledWeights(
+        {
+            **raw,
+            "model_version": model_version,
+            "alpha": alpha,
+            "beta": beta,
+            "gamma_multiplier": gamma_multiplier,
+            "competitive_ceiling_pct": ceiling_pct,
+            "demand_default": demand_default,
+            "sales_velocity_ref": sales_velocity_ref,
+            "sales_velocity_weight": sales_velocity_weight,
+            "stock_level_ref": stock_level_ref,
+            "stock_multiplier_max_delta": stock_multiplier_max_delta,
+            "rating_weight": rating_weight,
+            "current_price_smoothing": current_price_smoothing,
+        }
+    )
 
 
-def _load_weights(path: str) -> dict[str, Any]:
-    defaults: dict[str, Any] = _sanitize_weights(
+def _load_weights(path: str) -> CompiledWeights:
+    defaults = _sanitize_weights(
         {
             "model_version": "mock-formula-v2",
             "alpha": 0.65,
@@ -184,10 +420,28 @@ def _load_weights(path: str) -> dict[str, Any]:
     return defaults
 
 
+_LOG1P_10 = math.log1p(10.0)
+
+
 def _log_norm(value: float, ref: float) -> float:
+    return _log_ratio(value, math.log1p(ref))
+
+
+def _log_ratio(value: float, log_ref: float) -> float:
+    # _log_norm with log1p(ref) precomputed (see CompiledWeights).
     if value <= 0:
         return 0.0
-    return _clamp(math.log1p(value) / math.log1p(ref), 0.0, 1.0)
+    return _clamp(math.log1p(value) / log_ref, 0.0, 1.0)
+
+
+def _check_nonnegative(values: Mapping[str, float | None]) -> None:
+    invalids: dict[str, str] = {}
+    for key in ("cost_price", "desired_margin", "current_price", "shipping_cost", "platform_fee_pct"):
+        value = values[key]
+        if value is not None and value < 0:
+            invalids[key] = "Must be >= 0"
+    if invalids:
+        raise InputError("Invalid numeric inputs", invalids)
 
 
 def _compute_min_price(
@@ -237,70 +491,343 @@ def _compute_min_price(
     }
 
 
+def _stored_min_price(stored: ListingFeatures) -> tuple[float, dict[str, Any]]:
+    """What _compute_min_price() returned for a listing when its feature record was built."""
+    return stored.floor, {
+        "min_price_source": stored.floor_source,
+        "desired_margin": stored.margin_used,
+        "platform_fee_pct": stored.fee_used,
+        "shipping_cost": stored.shipping_cost or 0.0,
+        "computed_floor": stored.computed_floor,
+    }
+
+
+def listing_features(payload: dict[str, Any]) -> ListingFeatures:
+    """
+    A listing's feature record (features.py): its static inputs from `payload`, validated
+    as recommend() validates them, and the min_price floor they give.
+    """
+    decoded = decode_payload({key: payload.get(key) for key in LISTING_INPUTS})
+    values = decoded.values
+    decoded.check(0)
+    _check_nonnegative(values)
+    decoded.check(1)
+    min_price, min_debug = _compute_min_price(
+        cost_price=values["cost_price"],
+        desired_margin=values["desired_margin"] or 0.0,
+        min_price_input=values["min_price"],
+        shipping_cost=values["shipping_cost"] or 0.0,
+        platform_fee_pct=values["platform_fee_pct"] or 0.0,
+    )
+    return ListingFeatures(
+        *(values[key] for key in LISTING_INPUTS),
+        floor=min_price,
+        floor_source=min_debug["min_price_source"],
+        margin_used=min_debug["desired_margin"],
+        fee_used=min_debug["platform_fee_pct"],
+        computed_floor=min_debug["computed_floor"],  # only reported by explain
+    )
+
+
+# Inputs `sensitivity` reports on (those present in the payload), in response order.
+SENSITIVITY_INPUTS = (
+    "competitor_avg",
+    "current_price",
+    "min_price",
+    "cost_price",
+    "desired_margin",
+    "shipping_cost",
+    "platform_fee_pct",
+    "demand_factor",
+    "sales_velocity",
+    "rating",
+    "stock_level",
+    "promo_factor",
+    "seasonality_factor",
+    "market_sample_size",
+)
+
+
+def _percent_slope(raw: float, high: float) -> float:
+    # d/d(raw) of _clamp(_as_percent(raw), 0, high).
+    scale = 0.01 if raw > 1.0 else 1.0
+    return scale if 0.0 <= raw * scale < high else 0.0
+
+
+def _floor_gradients(values: Mapping[str, float | None], min_debug: Mapping[str, Any]) -> dict[str, float]:
+    """d(min_price used)/d(input) for the inputs of _compute_min_price()."""
+    if min_debug["min_price_source"] == "provided":
+        return {"min_price": 1.0}
+    margin = min_debug["desired_margin"]
+    fee_divisor = max(0.01, 1.0 - min_debug["platform_fee_pct"])
+    subtotal = (values["cost_price"] or 0.0) + min_debug["shipping_cost"]
+    per_cost = (1.0 + margin) / fee_divisor
+    return {
+        "cost_price": per_cost,
+        "shipping_cost": per_cost,
+        "desired_margin": subtotal / fee_divisor * _percent_slope(values["desired_margin"] or 0.0, 1.0),
+        "platform_fee_pct": subtotal * per_cost / fee_divisor * _percent_slope(values["platform_fee_pct"] or 0.0, 0.3),
+    }
+
+
+def _sensitivity(
+    values: Mapping[str, float | None],
+    w: CompiledWeights,
+    *,
+    price: float,
+    clamps: Mapping[str, bool],
+    min_price: float,
+    min_debug: Mapping[str, Any],
+    competitor_avg: float | None,
+    candidate_raw: float,
+    demand_effective: float,
+    multipliers: tuple[float, float, float],
+) -> dict[str, Any]:
+    """
+    Closed-form d(recommended_price)/d(input) for the inputs present in the payload,
+    taken before rounding to cents, plus elasticities (d ln price / d ln input) and the
+    active clamp. Under a clamp only the clamp's own inputs move the price. At a kink
+    the derivative of the branch recommend() took is reported.
+    """
+    stock_multiplier, promo_multiplier, seasonality_multiplier = multipliers
+    current_price = values["current_price"] or 0.0
+    smoothing_on = current_price > 0 and w.smoothing > 0
+    keep = w.smoothing_keep if smoothing_on else 1.0
+
+    grad = dict.fromkeys(SENSITIVITY_INPUTS, 0.0)
+    d_min = 0.0  # d price / d min_price used
+    active_clamp = None
+    if clamps["min_price"]:
+        active_clamp = "min_price"
+        d_min = 1.0
+    elif clamps["ceiling"]:
+        # ceiling = max(min_price, competitor_avg * ceiling_factor)
+        active_clamp = "ceiling"
+        if competitor_avg * w.ceiling_factor >= min_price:
+            grad["competitor_avg"] = w.ceiling_factor
+        else:
+            d_min = 1.0
+    else:
+        d_raw = keep * stock_multiplier * promo_multiplier * seasonality_multiplier
+        d_multipliers = keep * candidate_raw
+        if smoothing_on:
+            grad["current_price"] = w.smoothing
+        d_demand = 0.0
+        if competitor_avg is None:
+            # Fallback base: max(min_price, current_price or min_price).
+            if current_price > min_price:
+                grad["current_price"] += d_raw
+            else:
+                d_min = d_raw
+        else:
+            grad["competitor_avg"] = d_raw * (w.alpha + w.gamma_multiplier * demand_effective)
+            d_min = d_raw * w.beta
+            if 0.0 < demand_effective < 1.0:
+                d_demand = d_raw * w.gamma_multiplier * competitor_avg
+
+        if d_demand:
+            demand_factor = values["demand_factor"]
+            if demand_factor is not None:
+                grad["demand_factor"] = d_demand * _percent_slope(demand_factor, 1.0)
+            sales_velocity = values["sales_velocity"]
+            if sales_velocity is not None and sales_velocity >= 0:
+                log_ref = w.sales_velocity_log_ref
+                if math.log1p(sales_velocity) < log_ref:
+                    slope = 2.0 * w.sales_velocity_weight / ((1.0 + sales_velocity) * log_ref)
+                    grad["sales_velocity"] = d_demand * slope
+            rating = values["rating"]
+            if rating is not None and 0.0 <= rating < 5.0:
+                grad["rating"] = d_demand * 2.0 * w.rating_weight / 5.0
+
+        stock_level = values["stock_level"]
+        if stock_level is not None and stock_level >= 0:
+            log_ref = w.stock_level_log_ref
+            if math.log1p(stock_level) < log_ref:
+                slope = -2.0 * w.stock_max_delta / ((1.0 + stock_level) * log_ref)
+                grad["stock_level"] = d_multipliers * promo_multiplier * seasonality_multiplier * slope
+        promo_factor = values["promo_factor"]
+        if promo_factor is not None:
+            if 1.5 <= promo_factor <= 100:
+                unclamped, slope = 1.0 - promo_factor / 100.0, -0.01
+            else:
+                unclamped, slope = promo_factor, 1.0
+            if 0.70 < unclamped < 1.20:
+                grad["promo_factor"] = d_multipliers * stock_multiplier * seasonality_multiplier * slope
+        seasonality_factor = values["seasonality_factor"]
+        if seasonality_factor is not None and 0.85 < seasonality_factor < 1.15:
+            grad["seasonality_factor"] = d_multipliers * stock_multiplier * promo_multiplier
+
+    if d_min:
+        for name, slope in _floor_gradients(values, min_debug).items():
+            grad[name] += d_min * slope
+
+    gradients: dict[str, float] = {}
+    elasticities: dict[str, float | None] = {}
+    for name in SENSITIVITY_INPUTS:
+        value = competitor_avg if name == "competitor_avg" else values[name]
+        if value is None:
+            continue
+        gradients[name] = round(grad[name], 6)
+        elasticities[name] = round(grad[name] * value / price, 6) if price > 0 else None
+    return {"active_clamp": active_clamp, "gradients": gradients, "elasticities": elasticities}
+
+
+# Top-level explain keys (sections); `fields=` selects among these.
+EXPLAIN_FIELDS = frozenset(
+    {
+        "competitor_avg_used",
+        "competitor_method",
+        "market_sample_size",
+        "min_price",
+        "ceiling",
+        "demand_factor_used",
+        "demand_effective",
+        "clamps",
+        "components",
+        "multipliers",
+        "normalized_features",
+        "weights_used",
+        "inputs",
+        "confidence",
+    }
+)
+# Compact explain keys ("section.key"), built once per key instead of per response.
+_COMPACT_KEYS: dict[str, dict[str, str]] = {name: {} for name in EXPLAIN_FIELDS}
+
+
+class ExplainOptions(NamedTuple):
+    """Explain with only `fields` (None = every section), flattened when `compact`."""
+
+    fields: frozenset[str] | None = None
+    compact: bool = False
+
+    def key(self) -> str:
+        """Explain mode for result cache keys."""
+        names = "*" if self.fields is None else ",".join(sorted(self.fields))
+        return f"{'compact' if self.compact else 'full'}:{names}"
+
+
+def _explain_filter(explain: bool | ExplainOptions) -> Callable[[str], bool]:
+    if isinstance(explain, ExplainOptions) and explain.fields is not None:
+        return explain.fields.__contains__
+    return _every_section
+
+
+def _every_section(name: str) -> bool:
+    return True
+
+
+def _shape_explain(info: dict[str, Any], explain: bool | ExplainOptions) -> dict[str, Any]:
+    """Apply the `fields` selection and the compact (flat, dotted keys) format."""
+    if not isinstance(explain, ExplainOptions):
+        return info
+    if explain.fields is not None:
+        info = {name: value for name, value in info.items() if name in explain.fields}
+    if not explain.compact:
+        return info
+    flat: dict[str, Any] = {}
+    for name, value in info.items():
+        if type(value) is dict:
+            keys = _COMPACT_KEYS[name]
+            for key, inner in value.items():
+                dotted = keys.get(key)
+                if dotted is None:
+                    dotted = keys[key] = f"{name}.{key}"
+                flat[dotted] = inner
+        else:
+            flat[name] = value
+    return flat
+
+
+def parse_explain(explain_flag: Any, fields: Any = None, explain_format: Any = None) -> bool | ExplainOptions:
+    """
+    Explain request from the `explain`, `fields` and `explain_format` inputs (query
+    string or body). Naming fields or the compact format turns explain on.
+    """
+    compact = False
+    if explain_format is not None:
+        if explain_format not in ("full", "compact"):
+            raise InputError("Invalid explain options", {"explain_format": 'Must be "full" or "compact"'})
+        compact = explain_format == "compact"
+
+    selected = None
+    if fields is not None:
+        names = fields.split(",") if isinstance(fields, str) else fields
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise InputError("Invalid explain options", {"fields": "Must be a comma-separated string or a list"})
+        selected = frozenset(name.strip() for name in names if name.strip())
+        unknown = selected - EXPLAIN_FIELDS
+        if unknown:
+            raise InputError(
+                "Invalid explain options",
+                {"fields": f"Unknown explain field(s): {', '.join(sorted(unknown))}"},
+            )
+
+    if selected is None and not compact:
+        return _boolish(explain_flag)
+    return ExplainOptions(selected, compact)
+
+
 def recommend(
     payload: dict[str, Any],
-    weights: dict[str, Any],
+    weights: Mapping[str, Any],
     *,
-    explain: bool = False,
+    explain: bool | ExplainOptions = False,
+    stages: metrics.StageTimer = metrics.NO_STAGES,
+    competitors: CompetitorStore | None = None,
+    features: FeatureStore | None = None,
+    stored_prices: list[float] | None = None,
+    feature_record: ListingFeatures | None = None,
+    sensitivity: bool = False,
 ) -> dict[str, Any]:
+    """
+    Score one payload. `explain` adds the explain breakdown: True for every section,
+    or ExplainOptions to build only some sections and/or flatten them (compact).
+    `sensitivity` adds the price gradients and the active clamp (see _sensitivity).
+    With `features`, a payload with a listing_id and none of the static inputs takes
+    them and the precomputed floor from the listing's feature record, if it has one.
+    `feature_record` is that record, and `stored_prices` the listing's prices in
+    `competitors`, when the caller already looked them up.
+    """
+    w = compile_weights(weights)
+    decoded = decode_payload(payload)
+    values = decoded.values
+    stored = feature_record
+    if stored is None and features is not None and _uses_listing_features(payload):
+        stored = features.get(payload["listing_id"])
+    if stored is not None:
+        values.update(zip(LISTING_INPUTS, stored))
+    decoded.check(0)
+
     # Required-ish inputs (for a sensible floor).
-    cost_price = _parse_optional_float(payload, "cost_price")
-    desired_margin = _parse_optional_float(payload, "desired_margin") or 0.0
-    current_price = _parse_optional_float(payload, "current_price") or 0.0
+    cost_price = values["cost_price"]
+    desired_margin = values["desired_margin"] or 0.0
+    current_price = values["current_price"] or 0.0
 
     # Optional additional costs / constraints.
-    shipping_cost = _parse_optional_float(payload, "shipping_cost") or 0.0
-    platform_fee_pct = _parse_optional_float(payload, "platform_fee_pct") or 0.0
-
-    invalids: dict[str, str] = {}
-    if cost_price is not None and cost_price < 0:
-        invalids["cost_price"] = "Must be >= 0"
-    if desired_margin < 0:
-        invalids["desired_margin"] = "Must be >= 0"
-    if current_price < 0:
-        invalids["current_price"] = "Must be >= 0"
-    if shipping_cost < 0:
-        invalids["shipping_cost"] = "Must be >= 0"
-    if platform_fee_pct < 0:
-        invalids["platform_fee_pct"] = "Must be >= 0"
-    if invalids:
-        raise InputError("Invalid numeric inputs", invalids)
-
-    min_price_input = _parse_optional_float(payload, "min_price")
-    min_price, min_debug = _compute_min_price(
-        cost_price=cost_price,
-        desired_margin=desired_margin,
-        min_price_input=min_price_input,
-        shipping_cost=shipping_cost,
-        platform_fee_pct=platform_fee_pct,
-    )
+    shipping_cost = values["shipping_cost"] or 0.0
+    platform_fee_pct = values["platform_fee_pct"] or 0.0
+
+    _check_nonnegative(values)
+
+    decoded.check(1)
+    stages.mark("validate")
+    if stored is None:
+        min_price, min_debug = _compute_min_price(
+            cost_price=cost_price,
+            desired_margin=desired_margin,
+            min_price_input=values["min_price"],
+            shipping_cost=shipping_cost,
+            platform_fee_pct=platform_fee_pct,
+        )
+    else:
+        min_price, min_debug = _stored_min_price(stored)
+    stages.mark("min_price")
 
     # Market competitor signal: accept either a precomputed avg or a list of samples.
-    competitor_avg = _parse_optional_float(payload, "competitor_avg")
-    competitor_prices_raw = payload.get("competitor_prices")
-    competitor_prices: list[float] = []
-    if competitor_prices_raw is not None:
-        if not isinstance(competitor_prices_raw, list):
-            raise InputError(
-                "Invalid numeric inputs",
-                {"competitor_prices": "Must be a list of numbers"},
-            )
-        for x in competitor_prices_raw:
-            if x is None:
-                continue
-            parsed = _to_float(x)
-            if parsed is None:
-                raise InputError(
-                    "Invalid numeric inputs",
-                    {"competitor_prices": "List contains a non-numeric value"},
-                )
-            if parsed > 0:
-                competitor_prices.append(parsed)
-        if competitor_prices_raw and not competitor_prices:
-            raise InputError(
-                "Invalid numeric inputs",
-                {"competitor_prices": "Must include at least one positive number"},
-            )
+    decoded.check(2)
+    competitor_avg = values["competitor_avg"]
+    competitor_prices = decoded.competitor_prices
 
     competitor_method = "avg"
     competitor_sample_size = 0
@@ -308,13 +835,22 @@ def recommend(
     if competitor_prices:
         competitor_avg_used, competitor_method = _robust_price_average(competitor_prices)
         competitor_sample_size = len(competitor_prices)
-
-    market_sample_size = int(_parse_optional_float(payload, "market_sample_size") or 0)
+    elif (stored_prices is not None or competitors is not None) and _uses_stored_competitors(payload):
+        if stored_prices is None:
+            stored_prices = competitors.prices(payload["listing_id"])
+        if stored_prices:
+            competitor_avg_used, competitor_method = _robust_price_average(stored_prices)
+            competitor_method = "stored_" + competitor_method
+            competitor_sample_size = len(stored_prices)
+    stages.mark("competitor")
+
+    decoded.check(3)
+    market_sample_size = int(values["market_sample_size"] or 0)
     market_sample_size = max(competitor_sample_size, market_sample_size)
 
     # Demand signal.
-    demand_default = float(weights.get("demand_default", 0.5))
-    demand_factor = _parse_optional_float(payload, "demand_factor")
+    demand_default = w.demand_default
+    demand_factor = values["demand_factor"]
     demand_source = "provided"
     if demand_factor is None:
         demand_source = "default"
@@ -324,16 +860,16 @@ def recommend(
     demand_factor = _clamp(demand_factor, 0.0, 1.0)
 
     # Optional extra features (bounded + explainable).
-    sales_velocity = _parse_optional_float(payload, "sales_velocity")
-    stock_level = _parse_optional_float(payload, "stock_level")
-    rating = _parse_optional_float(payload, "rating")
+    sales_velocity = values["sales_velocity"]
+    stock_level = values["stock_level"]
+    rating = values["rating"]
 
-    promo_factor = _parse_optional_float(payload, "promo_factor")
-    seasonality_factor = _parse_optional_float(payload, "seasonality_factor")
+    promo_factor = values["promo_factor"]
+    seasonality_factor = values["seasonality_factor"]
 
     sales_norm = None
     if sales_velocity is not None:
-        sales_norm = _log_norm(max(0.0, sales_velocity), float(weights.get("sales_velocity_ref", 50.0)))
+        sales_norm = _log_ratio(max(0.0, sales_velocity), w.sales_velocity_log_ref)
 
     rating_norm = None
     if rating is not None:
@@ -341,22 +877,19 @@ def recommend(
 
     demand_effective = demand_factor
     if sales_norm is not None:
-        w = float(weights.get("sales_velocity_weight", 0.12))
-        demand_effective += w * ((sales_norm - 0.5) * 2.0)
+        demand_effective += w.sales_velocity_weight * ((sales_norm - 0.5) * 2.0)
 
     if rating_norm is not None:
-        w = float(weights.get("rating_weight", 0.08))
-        demand_effective += w * ((rating_norm - 0.5) * 2.0)
+        demand_effective += w.rating_weight * ((rating_norm - 0.5) * 2.0)
 
     demand_effective = _clamp(demand_effective, 0.0, 1.0)
 
     stock_norm = None
     stock_multiplier = 1.0
     if stock_level is not None:
-        stock_norm = _log_norm(max(0.0, stock_level), float(weights.get("stock_level_ref", 200.0)))
-        max_delta = float(weights.get("stock_multiplier_max_delta", 0.08))
-        delta = max_delta * ((0.5 - stock_norm) * 2.0)
-        stock_multiplier = _clamp(1.0 + delta, 1.0 - max_delta, 1.0 + max_delta)
+        stock_norm = _log_ratio(max(0.0, stock_level), w.stock_level_log_ref)
+        delta = w.stock_max_delta * ((0.5 - stock_norm) * 2.0)
+        stock_multiplier = _clamp(1.0 + delta, w.stock_multiplier_low, w.stock_multiplier_high)
 
     promo_multiplier = 1.0
     if promo_factor is not None:
@@ -371,11 +904,11 @@ def recommend(
         seasonality_multiplier = _clamp(seasonality_factor, 0.85, 1.15)
 
     # Candidate computation (core explainable formula).
-    alpha = float(weights.get("alpha", 0.65))
-    beta = float(weights.get("beta", 0.35))
-    gamma_multiplier = float(weights.get("gamma_multiplier", 0.05))
-    ceiling_pct = float(weights.get("competitive_ceiling_pct", 0.07))
-    smoothing = float(weights.get("current_price_smoothing", 0.10))
+    alpha = w.alpha
+    beta = w.beta
+    gamma_multiplier = w.gamma_multiplier
+    ceiling_pct = w.ceiling_pct
+    smoothing = w.smoothing
 
     clamps: dict[str, bool] = {
         "min_price": False,
@@ -388,7 +921,7 @@ def recommend(
         candidate_adj = candidate_raw * stock_multiplier * promo_multiplier * seasonality_multiplier
         candidate_smoothed = candidate_adj
         if current_price > 0 and smoothing > 0:
-            candidate_smoothed = (1.0 - smoothing) * candidate_adj + (smoothing * current_price)
+            candidate_smoothed = w.smoothing_keep * candidate_adj + (smoothing * current_price)
         if not math.isfinite(candidate_smoothed):
             raise InputError("Numeric overflow", {"recommended_price": "Computation produced a non-finite value"})
         candidate = max(min_price, candidate_smoothed)
@@ -401,11 +934,25 @@ def recommend(
         result: dict[str, Any] = {
             "recommended_price": round(candidate, 2),
             "confidence": round(confidence, 4),
-            "model_version": str(weights.get("model_version", "mock-formula-v2")),
+            "model_version": w.model_version,
         }
 
+        if sensitivity:
+            result["sensitivity"] = _sensitivity(
+                values,
+                w,
+                price=candidate,
+                clamps=clamps,
+                min_price=min_price,
+                min_debug=min_debug,
+                competitor_avg=None,
+                candidate_raw=candidate_raw,
+                demand_effective=demand_effective,
+                multipliers=(stock_multiplier, promo_multiplier, seasonality_multiplier),
+            )
         if explain:
-            result["explain"] = {
+            want = _explain_filter(explain)
+            info: dict[str, Any] = {
                 "competitor_avg_used": None,
                 "competitor_method": None,
                 "min_price": round(min_price, 6),
@@ -413,21 +960,26 @@ def recommend(
                 "demand_factor_used": round(demand_factor, 6),
                 "demand_effective": round(demand_effective, 6),
                 "clamps": clamps,
-                "components": {
+            }
+            if want("components"):
+                info["components"] = {
                     "fallback_base": round(base, 6),
-                },
-                "multipliers": {
+                }
+            if want("multipliers"):
+                info["multipliers"] = {
                     "stock_multiplier": round(stock_multiplier, 6),
                     "promo_multiplier": round(promo_multiplier, 6),
                     "seasonality_multiplier": round(seasonality_multiplier, 6),
                     "current_price_smoothing": round(smoothing, 6),
-                },
-                "inputs": {
+                }
+            if want("inputs"):
+                info["inputs"] = {
                     "current_price": round(current_price, 6),
                     "cost_price": None if cost_price is None else round(cost_price, 6),
                     **min_debug,
-                },
-            }
+                }
+            result["explain"] = _shape_explain(info, explain)
+        stages.mark("formula")
         return result
 
     gamma = gamma_multiplier * competitor_avg_used
@@ -440,12 +992,12 @@ def recommend(
 
     candidate_smoothed = candidate_adj
     if current_price > 0 and smoothing > 0:
-        candidate_smoothed = (1.0 - smoothing) * candidate_adj + (smoothing * current_price)
+        candidate_smoothed = w.smoothing_keep * candidate_adj + (smoothing * current_price)
 
     if not math.isfinite(candidate_smoothed):
         raise InputError("Numeric overflow", {"recommended_price": "Computation produced a non-finite value"})
 
-    ceiling = max(min_price, competitor_avg_used * (1.0 + max(0.0, ceiling_pct)))
+    ceiling = max(min_price, competitor_avg_used * w.ceiling_factor)
     if not math.isfinite(ceiling):
         raise InputError("Numeric overflow", {"ceiling": "Computation produced a non-finite value"})
     candidate = _clamp(candidate_smoothed, min_price, ceiling)
@@ -457,7 +1009,7 @@ def recommend(
     # Confidence: reflect signal quality, not raw demand magnitude.
     competitor_quality = 0.6
     if market_sample_size > 0:
-        competitor_quality = _clamp(math.log1p(market_sample_size) / math.log1p(10.0), 0.0, 1.0)
+        competitor_quality = _clamp(math.log1p(market_sample_size) / _LOG1P_10, 0.0, 1.0)
 
     demand_quality = 1.0 if demand_source == "provided" else 0.7
 
@@ -477,11 +1029,25 @@ def recommend(
     result = {
         "recommended_price": round(candidate, 2),
         "confidence": round(confidence, 4),
-        "model_version": str(weights.get("model_version", "mock-formula-v2")),
+        "model_version": w.model_version,
     }
 
+    if sensitivity:
+        result["sensitivity"] = _sensitivity(
+            values,
+            w,
+            price=candidate,
+            clamps=clamps,
+            min_price=min_price,
+            min_debug=min_debug,
+            competitor_avg=competitor_avg_used,
+            candidate_raw=candidate_raw,
+            demand_effective=demand_effective,
+            multipliers=(stock_multiplier, promo_multiplier, seasonality_multiplier),
+        )
     if explain:
-        result["explain"] = {
+        want = _explain_filter(explain)
+        info = {
             "competitor_avg_used": round(float(competitor_avg_used), 6),
             "competitor_method": competitor_method,
             "market_sample_size": market_sample_size,
@@ -490,104 +1056,1155 @@ def recommend(
             "demand_factor_used": round(demand_factor, 6),
             "demand_effective": round(demand_effective, 6),
             "clamps": clamps,
-            "components": {
+        }
+        if want("components"):
+            info["components"] = {
                 "alpha_component": round(float(comp_component), 6),
                 "beta_component": round(float(min_component), 6),
                 "gamma_component": round(float(demand_component), 6),
                 "candidate_raw": round(float(candidate_raw), 6),
-            },
-            "multipliers": {
+            }
+        if want("multipliers"):
+            info["multipliers"] = {
                 "stock_multiplier": round(stock_multiplier, 6),
                 "promo_multiplier": round(promo_multiplier, 6),
                 "seasonality_multiplier": round(seasonality_multiplier, 6),
                 "current_price_smoothing": round(smoothing, 6),
                 "candidate_after_multipliers": round(float(candidate_adj), 6),
                 "candidate_after_smoothing": round(float(candidate_smoothed), 6),
-            },
-            "normalized_features": {
+            }
+        if want("normalized_features"):
+            info["normalized_features"] = {
                 "sales_velocity_norm": None if sales_norm is None else round(float(sales_norm), 6),
                 "stock_level_norm": None if stock_norm is None else round(float(stock_norm), 6),
                 "rating_norm": None if rating_norm is None else round(float(rating_norm), 6),
-            },
-            "weights_used": {
+            }
+        if want("weights_used"):
+            info["weights_used"] = {
                 "alpha": round(alpha, 6),
                 "beta": round(beta, 6),
                 "gamma_multiplier": round(gamma_multiplier, 6),
                 "competitive_ceiling_pct": round(ceiling_pct, 6),
                 "demand_default": round(demand_default, 6),
-            },
-            "inputs": {
+            }
+        if want("inputs"):
+            info["inputs"] = {
                 "current_price": round(current_price, 6),
                 "cost_price": None if cost_price is None else round(cost_price, 6),
                 **min_debug,
                 "demand_source": demand_source,
-            },
-            "confidence": {
+            }
+        if want("confidence"):
+            info["confidence"] = {
                 "competitor_quality": round(competitor_quality, 6),
                 "demand_quality": round(demand_quality, 6),
                 "extras_quality": round(extras_quality, 6),
                 "quality": round(quality, 6),
-            },
-        }
+            }
+        result["explain"] = _shape_explain(info, explain)
 
+    stages.mark("formula")
     return result
 
 
-class Handler(BaseHTTPRequestHandler):
-    weights: dict[str, Any] = {}
+def _uses_stored_competitors(payload: dict[str, Any]) -> bool:
+    """Payloads with a listing_id and no competitor data are priced from stored state."""
+    return (
+        payload.get("listing_id") is not None
+        and payload.get("competitor_avg") is None
+        and payload.get("competitor_prices") is None
+    )
 
-    def _send_json(self, status: int, data: dict[str, Any]) -> None:
-        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json; charset=utf-8")
-        self.send_header("Content-Length", str(len(payload)))
-        self.end_headers()
-        self.wfile.write(payload)
 
-    def do_GET(self) -> None:  # noqa: N802
-        parsed = urlsplit(self.path)
-        if parsed.path == "/health":
-            self._send_json(200, {"status": "ok"})
-            return
-        if parsed.path == "/v1/weights":
-            # Safe: contains only coefficients and training metadata (no secrets).
-            self._send_json(200, {"weights": self.weights})
-            return
-        self._send_json(404, {"message": "Not found"})
+def _with_stored_competitors(payload: dict[str, Any], competitors: CompetitorStore | None) -> dict[str, Any]:
+    """`payload` with its listing's stored prices as competitor_prices, when priced from stored state."""
+    if competitors is not None and _uses_stored_competitors(payload):
+        return _inline_stored(payload, competitors.prices(payload["listing_id"]), None)
+    return payload
 
-    def do_POST(self) -> None:  # noqa: N802
-        parsed = urlsplit(self.path)
-        if parsed.path not in ("/", "/recommend", "/v1/recommend"):
-            self._send_json(404, {"message": "Not found"})
-            return
 
-        length = int(self.headers.get("Content-Length") or 0)
-        raw = self.rfile.read(length) if length > 0 else b"{}"
+_LISTING_INPUT_KEYS = frozenset(LISTING_INPUTS)
+
+
+def _uses_listing_features(payload: dict[str, Any]) -> bool:
+    """Payloads with a listing_id and none of the static inputs are priced from the feature store."""
+    if payload.get("listing_id") is None:
+        return False
+    return _LISTING_INPUT_KEYS.isdisjoint(payload) or all(payload.get(key) is None for key in LISTING_INPUTS)
+
+
+def _with_listing_features(payload: dict[str, Any], features: FeatureStore | None) -> dict[str, Any]:
+    """`payload` with its listing's static inputs from the feature store, when priced from it."""
+    if features is not None and _uses_listing_features(payload):
+        return _inline_stored(payload, None, features.get(payload["listing_id"]))
+    return payload
+
+
+def _inline_stored(
+    payload: dict[str, Any],
+    prices: list[float] | None,
+    record: ListingFeatures | None,
+) -> dict[str, Any]:
+    """`payload` with already looked-up stored prices and feature record written into it."""
+    if prices:
+        payload = {**payload, "competitor_prices": prices}
+    if record is not None:
+        payload = {**payload, **{k: v for k, v in zip(LISTING_INPUTS, record) if v is not None}}
+    return payload
+
+
+def cached_recommend(
+    payload: dict[str, Any],
+    weights: Mapping[str, Any],
+    *,
+    explain: bool | ExplainOptions = False,
+    cache: ResultCache | None = None,
+    stages: metrics.StageTimer = metrics.NO_STAGES,
+    competitors: CompetitorStore | None = None,
+    features: FeatureStore | None = None,
+    sensitivity: bool = False,
+    flight: SingleFlight | None = None,
+    shadow: ShadowScorer | None = None,
+) -> dict[str, Any]:
+    """
+    recommend() through an optional result cache (errors are never cached) and optional
+    request coalescing (`flight`: concurrent identical requests share one computation).
+    The payload is also offered to `shadow`, with the stored inputs it is priced from.
+
+    Payloads priced from stored competitor prices or from a listing feature record bypass
+    both, since every ingest or feature file update can change their answer. Listings
+    without stored prices or a feature record are cached as usual (recommend() then
+    ignores the stores too).
+    """
+    # Looked up once: recommend() scores the same snapshot that decided the bypass.
+    record = None
+    if features is not None and _uses_listing_features(payload):
+        record = features.get(payload["listing_id"])
+    prices = None
+    if competitors is not None and _uses_stored_competitors(payload):
+        prices = competitors.prices(payload["listing_id"])
+    if shadow is not None:
+        shadow.offer([_inline_stored(payload, prices, record)])
+    if record is not None or prices:
+        return recommend(
+            payload,
+            weights,
+            explain=explain,
+            stages=stages,
+            stored_prices=prices,
+            feature_record=record,
+            sensitivity=sensitivity,
+        )
+    if cache is None and flight is None:
+        return recommend(payload, weights, explain=explain, stages=stages, sensitivity=sensitivity)
+
+    mode = explain.key() if isinstance(explain, ExplainOptions) else explain
+    key = canonical_key(payload, compile_weights(weights).model_version, mode, sensitivity=sensitivity)
+    if key is None:
+        stages.mark("cache")
+        return recommend(payload, weights, explain=explain, stages=stages, sensitivity=sensitivity)
+
+    if cache is not None:
+        hit = cache.get(key)
+        stages.mark("cache")
+        if hit is not None:
+            return hit
+
+    def compute() -> dict[str, Any]:
+        result = recommend(payload, weights, explain=explain, stages=stages, sensitivity=sensitivity)
+        if cache is not None:
+            cache.put(key, result)
+        return result
+
+    if flight is not None:
+        return flight.do(key, compute)
+    return dict(compute())
+
+
+def recommend_many(
+    items: list[Any],
+    weights: Mapping[str, Any],
+    *,
+    explain: bool | ExplainOptions = False,
+    cache: ResultCache | None = None,
+    stages: metrics.StageTimer = metrics.NO_STAGES,
+    competitors: CompetitorStore | None = None,
+    features: FeatureStore | None = None,
+    sensitivity: bool = False,
+    flight: SingleFlight | None = None,
+    shadow: ShadowScorer | None = None,
+) -> list[dict[str, Any]]:
+    """
+    Score a list of recommend() payloads, preserving order.
+
+    Each item may carry a `listing_id` (echoed back), its own `explain` flag (or
+    `fields`/`explain_format`, which replace the batch-level explain options) and its
+    own `sensitivity` flag. Per-item InputErrors are returned inline so one bad row
+    does not fail the batch.
+    """
+    return [
+        _recommend_item(
+            item,
+            weights,
+            explain=explain,
+            cache=cache,
+            stages=stages,
+            competitors=competitors,
+            features=features,
+            sensitivity=sensitivity,
+            flight=flight,
+            shadow=shadow,
+        )
+        for item in items
+    ]
+
+
+def _recommend_item(
+    item: Any,
+    weights: Mapping[str, Any],
+    *,
+    explain: bool | ExplainOptions,
+    cache: ResultCache | None,
+    stages: metrics.StageTimer = metrics.NO_STAGES,
+    competitors: CompetitorStore | None = None,
+    features: FeatureStore | None = None,
+    sensitivity: bool = False,
+    flight: SingleFlight | None = None,
+    shadow: ShadowScorer | None = None,
+) -> dict[str, Any]:
+    if not isinstance(item, dict):
+        return {"error": {"message": "Item must be an object", "errors": {}}}
+
+    entry: dict[str, Any] = {}
+    if "listing_id" in item:
+        entry["listing_id"] = item.get("listing_id")
+
+    try:
+        if item.get("fields") is None and item.get("explain_format") is None:
+            item_explain = explain or _boolish(item.get("explain"))
+        else:
+            item_explain = parse_explain(item.get("explain"), item.get("fields"), item.get("explain_format"))
+        entry.update(
+            cached_recommend(
+                item,
+                weights,
+                explain=item_explain,
+                cache=cache,
+                stages=stages,
+                competitors=competitors,
+                features=features,
+                sensitivity=sensitivity or _boolish(item.get("sensitivity")),
+                flight=flight,
+                shadow=shadow,
+            )
+        )
+    except InputError as e:
+        stages.mark("validate")
+        entry["error"] = {"message": e.message, "errors": e.errors}
+    return entry
+
+
+def recommend_lines(
+    lines: Iterable[bytes | None],
+    weights: Mapping[str, Any],
+    *,
+    explain: bool | ExplainOptions = False,
+    cache: ResultCache | None = None,
+    first_line: int = 1,
+    sensitivity: bool = False,
+) -> bytes:
+    """
+    Score NDJSON request lines and return the NDJSON result lines.
+
+    Blank lines are skipped. Lines that can't be scored get an inline error carrying
+    their 1-based `line` number; None stands for a line that exceeded the size limit.
+    """
+    entries = _score_lines(
+        lines, weights, explain=explain, cache=cache, first_line=first_line, sensitivity=sensitivity
+    )
+    return _encode_lines(entries)
+
+
+def _encode_lines(entries: list[dict[str, Any]]) -> bytes:
+    return b"".join(codec.dumps(entry) + b"\n" for entry in entries)
+
+
+def _score_lines(
+    lines: Iterable[bytes | None],
+    weights: Mapping[str, Any],
+    *,
+    explain: bool | ExplainOptions,
+    cache: ResultCache | None,
+    first_line: int,
+    stages: metrics.StageTimer = metrics.NO_STAGES,
+    competitors: CompetitorStore | None = None,
+    features: FeatureStore | None = None,
+    sensitivity: bool = False,
+    shadow: ShadowScorer | None = None,
+    flight: SingleFlight | None = None,
+) -> list[dict[str, Any]]:
+    out: list[dict[str, Any]] = []
+    for number, line in enumerate(lines, first_line):
+        if line is None:
+            entry: dict[str, Any] = {"line": number, "error": {"message": "Line too long", "errors": {}}}
+        elif not line.strip():
+            continue
+        else:
+            try:
+                item = codec.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                entry = {"line": number, "error": {"message": "Invalid JSON", "errors": {}}}
+            else:
+                stages.mark("json_decode")
+                entry = _recommend_item(
+                    item,
+                    weights,
+                    explain=explain,
+                    cache=cache,
+                    stages=stages,
+                    competitors=competitors,
+                    features=features,
+                    sensitivity=sensitivity,
+                    flight=flight,
+                    shadow=shadow,
+                )
+                if "error" in entry:
+                    entry = {"line": number, **entry}
+        out.append(entry)
+    return out
+
+
+# /v1/simulate: at most this many values per axis, and errors listed per response.
+MAX_AXIS_VALUES = 1000
+MAX_SIMULATE_ERRORS = 10
+
+
+def parse_axes(raw: Any) -> list[tuple[str, list[float]]]:
+    """
+    Sweep axes for simulate(): `{field: [values...] | {"start", "stop", "num"}}`, in
+    the order given. Any numeric payload field can be swept.
+    """
+    if not isinstance(raw, dict) or not raw:
+        raise InputError("Invalid axes", {"axes": "Must be an object mapping payload fields to values"})
+    axes: list[tuple[str, list[float]]] = []
+    errors: dict[str, str] = {}
+    for name, spec in raw.items():
+        if name not in _NUMBER_FIELDS:
+            errors[name] = "Not a numeric payload field"
+            continue
+        if isinstance(spec, dict):
+            start, stop, num = _to_float(spec.get("start")), _to_float(spec.get("stop")), _to_float(spec.get("num"))
+            if start is None or stop is None or num is None or num != int(num) or not 1 <= num <= MAX_AXIS_VALUES:
+                errors[name] = f"Range needs numeric start and stop and an integer num in 1..{MAX_AXIS_VALUES}"
+                continue
+            count = int(num)
+            step = (stop - start) / (count - 1) if count > 1 else 0.0
+            values = [start + step * i for i in range(count)]
+        elif isinstance(spec, list) and 1 <= len(spec) <= MAX_AXIS_VALUES:
+            values = [_to_float(v) for v in spec]
+            if any(v is None for v in values):
+                errors[name] = "Values must be finite numbers"
+                continue
+        else:
+            errors[name] = f"Must be a list of 1..{MAX_AXIS_VALUES} numbers or a start/stop/num range"
+            continue
+        axes.append((name, values))
+    if errors:
+        raise InputError("Invalid axes", errors)
+    return axes
+
 
+def _vectorized() -> Any:
+    # Imported on first use: vectorized imports this module (and needs numpy).
+    try:
+        import vectorized
+    except ImportError:
+        return None
+    return vectorized
+
+
+def _nest(flat: list[Any], shape: tuple[int, ...]) -> list[Any]:
+    for size in reversed(shape[1:]):
+        flat = [flat[i : i + size] for i in range(0, len(flat), size)]
+    return flat
+
+
+def simulate(
+    base: dict[str, Any],
+    axes: list[tuple[str, list[float]]],
+    weights: Mapping[str, Any],
+    *,
+    competitors: CompetitorStore | None = None,
+    features: FeatureStore | None = None,
+) -> dict[str, Any]:
+    """
+    Score `base` for every combination of the axes values: cell i of the (row-major)
+    grid equals recommend({**base, axis: value, ...}) for its values. With numpy the
+    whole grid is one vectorized.recommend_batch() pass; otherwise cells are scored
+    one by one. Sweeping competitor_avg replaces the base competitor_prices.
+    """
+    names = [name for name, _ in axes]
+    shape = tuple(len(values) for _, values in axes)
+    base = _with_listing_features(base, features)
+    if "competitor_avg" not in names:
+        base = _with_stored_competitors(base, competitors)
+
+    vec = _vectorized()
+    errors: dict[int, InputError] = {}
+    if vec is not None:
+        batch = vec.recommend_batch(vec.sweep_columns(base, axes), weights)
+        prices = batch.recommended_price.tolist()
+        confidences = batch.confidence.tolist()
+        errors = batch.errors
+        for i in errors:  # NaN rows -> null
+            prices[i] = confidences[i] = None
+    else:
+        if "competitor_avg" in names:
+            base = {k: v for k, v in base.items() if k != "competitor_prices"}
+        prices, confidences = [], []
+        for i, combo in enumerate(itertools.product(*(values for _, values in axes))):
+            try:
+                result = recommend({**base, **dict(zip(names, combo))}, weights)
+            except InputError as e:
+                errors[i] = e
+                prices.append(None)
+                confidences.append(None)
+            else:
+                prices.append(result["recommended_price"])
+                confidences.append(result["confidence"])
+
+    return {
+        "model_version": compile_weights(weights).model_version,
+        "axes": [{"name": name, "values": values} for name, values in axes],
+        "shape": list(shape),
+        "recommended_price": _nest(prices, shape),
+        "confidence": _nest(confidences, shape),
+        "error_count": len(errors),
+        "errors": [
+            {"index": i, "error": {"message": e.message, "errors": e.errors}}
+            for i, e in list(errors.items())[:MAX_SIMULATE_ERRORS]
+        ],
+    }
+
+
+_CLAMPS_ONLY = ExplainOptions(frozenset({"clamps"}))
+
+
+def shadow_pairs(
+    payloads: list[dict[str, Any]],
+    primary: Mapping[str, Any],
+    candidate: Mapping[str, Any],
+) -> list[tuple[Outcome | None, Outcome | None]]:
+    """
+    (primary, candidate) outcomes per payload for shadow.ShadowScorer. Payloads come
+    from cached_recommend() with their stored inputs inlined (see _inline_stored), so
+    both weight sets see the inputs the live request was priced from. With numpy the
+    payloads are decoded once and each weight set is one vectorized.recommend_batch()
+    pass; otherwise every payload is scored twice.
+    """
+    vec = _vectorized()
+    if vec is None:
+        return [(_outcome(payload, primary), _outcome(payload, candidate)) for payload in payloads]
+    columns = vec.columns_from_payloads(payloads)
+    first, second = (_batch_outcomes(vec.recommend_batch(columns, weights)) for weights in (primary, candidate))
+    return list(zip(first, second))
+
+
+def _outcome(payload: dict[str, Any], weights: Mapping[str, Any]) -> Outcome | None:
+    try:
+        result = recommend(payload, weights, explain=_CLAMPS_ONLY)
+    except InputError:
+        return None
+    clamps = result["explain"]["clamps"]
+    return result["recommended_price"], result["confidence"], clamps["min_price"], clamps["ceiling"]
+
+
+def _batch_outcomes(batch: Any) -> list[Outcome | None]:
+    rows = zip(
+        batch.recommended_price.tolist(),
+        batch.confidence.tolist(),
+        batch.clamp_min_price.tolist(),
+        batch.clamp_ceiling.tolist(),
+    )
+    return [None if i in batch.errors else row for i, row in enumerate(rows)]
+
+
+@dataclass
+class Response:
+    status: int
+    body: bytes
+    content_type: str = "application/json; charset=utf-8"
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+def json_response(status: int, data: Any) -> Response:
+    return Response(status, codec.dumps(data))
+
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+class LineStream:
+    """
+    Per-request state for a streamed NDJSON endpoint.
+
+    Backends feed request body blocks as they arrive and write whatever `feed()`
+    returns straight back to the client, so results flow while the upload is still
+    in progress and neither side has to hold the whole batch. `close()` must be
+    called once the request is over (also when the body turned out to be malformed).
+    """
+
+    content_type = NDJSON_CONTENT_TYPE
+
+    def __init__(
+        self,
+        weights: Mapping[str, Any],
+        *,
+        explain: bool | ExplainOptions,
+        cache: ResultCache | None,
+        recorder: metrics.Metrics | None = None,
+        route: str = "",
+        competitors: CompetitorStore | None = None,
+        features: FeatureStore | None = None,
+        options_error: InputError | None = None,
+        sensitivity: bool = False,
+        shadow: ShadowScorer | None = None,
+        flight: SingleFlight | None = None,
+    ) -> None:
+        self.weights = weights
+        self.explain = explain
+        self.sensitivity = sensitivity
+        self.shadow = shadow
+        self.flight = flight
+        self.options_error = options_error
+        self.cache = cache
+        self.competitors = competitors
+        self.features = features
+        self.recorder = recorder
+        self.route = route
+        self._splitter = streaming.LineSplitter()
+        self._next_line = 1
+        self._started = time.perf_counter()
+        self._stages = recorder.stage_timer() if recorder is not None else metrics.NO_STAGES
+        if recorder is not None:
+            recorder.start_request()
+
+    def _score(self, lines: list[bytes | None]) -> bytes:
+        first = self._next_line
+        self._next_line += len(lines)
+        stages = self._stages
+        stages.reset()
+        if self.options_error is not None:
+            # Invalid explain options in the query string fail every line, like a bad line would.
+            error = {"message": self.options_error.message, "errors": self.options_error.errors}
+            entries = [
+                {"line": number, "error": error}
+                for number, line in enumerate(lines, first)
+                if line is None or line.strip()
+            ]
+        else:
+            entries = _score_lines(
+                lines,
+                self.weights,
+                explain=self.explain,
+                cache=self.cache,
+                first_line=first,
+                stages=stages,
+                competitors=self.competitors,
+                features=self.features,
+                sensitivity=self.sensitivity,
+                flight=self.flight,
+                shadow=self.shadow,
+            )
+        if self.recorder is not None:
+            for entry in entries:
+                if "error" in entry:
+                    self.recorder.count_input_errors(entry["error"]["errors"])
+        stages.reset()
+        data = _encode_lines(entries)
+        stages.mark("serialize")
+        return data
+
+    def feed(self, block: bytes) -> bytes:
+        return self._score(self._splitter.feed(block))
+
+    def finish(self) -> bytes:
+        return self._score(self._splitter.finish())
+
+    def close(self, ok: bool = True) -> None:
+        if self.recorder is not None:
+            elapsed = time.perf_counter() - self._started
+            self.recorder.finish_request(self.route, 200 if ok else 400, elapsed, self._stages)
+            self.recorder = None
+
+
+def _decode_observation(item: Any) -> tuple[Any, list[float], float | None]:
+    """
+    One /v1/competitors/ingest item: `listing_id`, `price` or `prices`, and an optional
+    `observed_at` (epoch seconds, default now).
+    """
+    if not isinstance(item, dict):
+        raise InputError("Item must be an object")
+    errors: dict[str, str] = {}
+    if CompetitorStore.key(item.get("listing_id")) is None:
+        errors["listing_id"] = "Required (string or number)"
+
+    prices: list[float] = []
+    if item.get("prices") is not None:
+        prices, error = _decode_number_list(item["prices"])
+        if error is not None:
+            errors["prices"] = error
+    elif item.get("price") is not None:
+        price = _to_float(item["price"])
+        if price is None or price <= 0:
+            errors["price"] = "Must be a positive number"
+        else:
+            prices = [price]
+    else:
+        errors["price"] = "Provide price or prices"
+
+    observed_at = None
+    if item.get("observed_at") is not None:
+        observed_at = _to_float(item["observed_at"])
+        if observed_at is None:
+            errors["observed_at"] = "Must be epoch seconds"
+    if errors:
+        raise InputError("Invalid observation", errors)
+    return item["listing_id"], prices, observed_at
+
+
+def _explain_requested(query_string: str, body: Any = None) -> bool | ExplainOptions:
+    """Explain options from the query string; an object body's keys take precedence."""
+    query = parse_qs(query_string) if query_string else {}
+    source = body if isinstance(body, dict) else {}
+
+    def pick(name: str) -> Any:
+        value = source.get(name)
+        if value is None and name in query:
+            value = query[name][0]
+        return value
+
+    explain_qs = query.get("explain", ["0"])[0] if query else "0"
+    flag = _boolish(source.get("explain")) or _boolish(explain_qs)
+    return parse_explain(flag, pick("fields"), pick("explain_format"))
+
+
+def _sensitivity_requested(query_string: str, body: Any = None) -> bool:
+    """`sensitivity` from an object body or else the query string."""
+    if isinstance(body, dict) and body.get("sensitivity") is not None:
+        return _boolish(body["sensitivity"])
+    query = parse_qs(query_string) if query_string else {}
+    return _boolish(query.get("sensitivity", ["0"])[0])
+
+
+# Paths reported as their own `route` label in /metrics; anything else is "other".
+_METRIC_ROUTES = frozenset(
+    {
+        "/",
+        "/recommend",
+        "/v1/recommend",
+        "/v1/recommend/batch",
+        "/v1/recommend/stream",
+        "/health",
+        "/metrics",
+        "/v1/weights",
+        "/v1/cache/stats",
+        "/v1/competitors/ingest",
+        "/v1/competitor-store/stats",
+        "/v1/simulate",
+        "/v1/shadow/stats",
+        "/v1/listing-features/stats",
+    }
+)
+COMPETITORS_PREFIX = "/v1/competitors/"
+
+
+def _metric_route(path: str) -> str:
+    if path in _METRIC_ROUTES:
+        return path
+    if path.startswith(COMPETITORS_PREFIX):
+        return COMPETITORS_PREFIX + "{listing_id}"
+    return "other"
+
+
+class Handler(BaseHTTPRequestHandler):
+    weights: CompiledWeights = CompiledWeights({})
+    max_batch_size: int = 1000
+    max_simulate_cells: int = 100_000
+    result_cache: ResultCache | None = None
+    competitor_store: CompetitorStore | None = None
+    shadow_scorer: ShadowScorer | None = None
+    feature_store: FeatureStore | None = None
+    inflight: SingleFlight | None = None
+    # Counters of the serving PooledHTTPServer (threading backend with --threads), for /metrics.
+    admission_stats: Callable[[], Mapping[str, Any]] | None = None
+    request_metrics: metrics.Metrics = metrics.Metrics()
+
+    @classmethod
+    def set_weights(cls, weights: Mapping[str, Any]) -> None:
+        """Swap the served weights; cached results and shadow statistics from the old weights are dropped."""
+        cls.weights = compile_weights(weights)
+        if cls.result_cache is not None:
+            cls.result_cache.clear()
+        if cls.shadow_scorer is not None:
+            cls.shadow_scorer.reset()
+
+    # Routing is transport-agnostic so the asyncio backend (aioserver.py) serves the
+    # exact same endpoints: respond() maps (method, target, body) to a Response.
+
+    @classmethod
+    def stream_route(cls, method: str, target: str) -> LineStream | None:
+        """The streamed NDJSON endpoint, if `target` is one; backends check this first."""
+        parsed = urlsplit(target)
+        if method == "POST" and parsed.path == "/v1/recommend/stream":
+            options_error = None
+            try:
+                explain = _explain_requested(parsed.query)
+            except InputError as e:
+                explain, options_error = False, e
+            return LineStream(
+                cls.weights,
+                explain=explain,
+                cache=cls.result_cache,
+                recorder=cls.request_metrics,
+                route=parsed.path,
+                competitors=cls.competitor_store,
+                features=cls.feature_store,
+                options_error=options_error,
+                sensitivity=_sensitivity_requested(parsed.query),
+                flight=cls.inflight,
+                shadow=cls.shadow_scorer,
+            )
+        return None
+
+    @classmethod
+    def respond(
+        cls,
+        method: str,
+        target: str,
+        raw_body: bytes,
+        stages: metrics.StageTimer | None = None,
+    ) -> Response:
+        """
+        Handle one buffered request. `stages` is the request's Metrics.stage_timer() when
+        the backend already took one (to time the body read); otherwise one is taken here.
+        """
+        stream = cls.stream_route(method, target)
+        if stream is not None:
+            # Buffered fallback for callers that already hold the whole body.
+            try:
+                return Response(200, stream.feed(raw_body) + stream.finish(), stream.content_type)
+            finally:
+                stream.close()
+
+        parsed = urlsplit(target)
+        recorder = cls.request_metrics
+        recorder.start_request()
+        started = time.perf_counter()
+        if stages is None:
+            stages = recorder.stage_timer()
+        status = 500
         try:
-            body = json.loads(raw.decode("utf-8") or "{}")
-        except json.JSONDecodeError:
-            self._send_json(400, {"message": "Invalid JSON"})
-            return
+            response = cls._route(method, parsed.path, parsed.query, raw_body, stages)
+            status = response.status
+            return response
+        finally:
+            recorder.finish_request(_metric_route(parsed.path), status, time.perf_counter() - started, stages)
+
+    @classmethod
+    def _route(
+        cls,
+        method: str,
+        path: str,
+        query_string: str,
+        raw_body: bytes,
+        stages: metrics.StageTimer,
+    ) -> Response:
+        if method == "GET":
+            return cls._route_get(path)
+        if method == "POST":
+            if path == "/v1/recommend/batch":
+                return cls._handle_batch(query_string, raw_body, stages)
+            if path == "/v1/competitors/ingest":
+                return cls._handle_ingest(raw_body)
+            if path == "/v1/simulate":
+                return cls._handle_simulate(raw_body, stages)
+            if path in ("/", "/recommend", "/v1/recommend"):
+                return cls._handle_recommend(query_string, raw_body, stages)
+        return json_response(404, {"message": "Not found"})
+
+    @classmethod
+    def _route_get(cls, path: str) -> Response:
+        if path == "/health":
+            return json_response(200, {"status": "ok"})
+        if path == "/metrics":
+            cache_stats = cls.result_cache.stats() if cls.result_cache is not None else None
+            text = cls.request_metrics.render(
+                model_version=cls.weights.model_version,
+                cache_stats=cache_stats,
+                coalesce_stats=cls.inflight.stats() if cls.inflight is not None else None,
+                admission_stats=cls.admission_stats() if cls.admission_stats is not None else None,
+            )
+            return Response(200, text.encode("utf-8"), metrics.CONTENT_TYPE)
+        if path == "/v1/weights":
+            # Safe: contains only coefficients and training metadata (no secrets).
+            return json_response(200, {"weights": dict(cls.weights)})
+        if path == "/v1/cache/stats":
+            stats = {"enabled": False} if cls.result_cache is None else {"enabled": True, **cls.result_cache.stats()}
+            if cls.inflight is not None:
+                stats["coalescing"] = cls.inflight.stats()
+            return json_response(200, stats)
+        if path == "/v1/shadow/stats":
+            if cls.shadow_scorer is None:
+                return json_response(200, {"enabled": False})
+            stats = cls.shadow_scorer.stats()
+            return json_response(200, {"enabled": True, "primary_model_version": cls.weights.model_version, **stats})
+        if path == "/v1/listing-features/stats":
+            if cls.feature_store is None:
+                return json_response(200, {"enabled": False})
+            return json_response(200, {"enabled": True, **cls.feature_store.stats()})
+        if path == "/v1/competitor-store/stats":
+            # Not under COMPETITORS_PREFIX, where any name is a listing id.
+            if cls.competitor_store is None:
+                return json_response(200, {"enabled": False})
+            return json_response(200, {"enabled": True, **cls.competitor_store.stats()})
+        if path.startswith(COMPETITORS_PREFIX):
+            return cls._competitors_get(unquote(path[len(COMPETITORS_PREFIX) :]))
+        return json_response(404, {"message": "Not found"})
+
+    @classmethod
+    def _competitors_get(cls, name: str) -> Response:
+        store = cls.competitor_store
+        summary = None if store is None else store.summary(name)
+        if summary is None:
+            return json_response(404, {"message": "No competitor state for this listing"})
+        prices = store.prices(name)
+        if prices:
+            average, method = _robust_price_average(prices)
+            summary["robust_average"] = round(average, 6)
+            summary["robust_method"] = method
+        return json_response(200, summary)
+
+    @staticmethod
+    def _decode_json(raw_body: bytes) -> Any:
+        return codec.loads(raw_body or b"{}")
+
+    @classmethod
+    def _handle_recommend(cls, query_string: str, raw_body: bytes, stages: metrics.StageTimer) -> Response:
+        try:
+            body = cls._decode_json(raw_body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return json_response(400, {"message": "Invalid JSON"})
+        stages.mark("json_decode")
 
         if not isinstance(body, dict):
-            self._send_json(400, {"message": "JSON body must be an object"})
-            return
+            return json_response(400, {"message": "JSON body must be an object"})
+
+        try:
+            want_explain = _explain_requested(query_string, body)
+            result = cached_recommend(
+                body,
+                cls.weights,
+                explain=want_explain,
+                cache=cls.result_cache,
+                stages=stages,
+                competitors=cls.competitor_store,
+                features=cls.feature_store,
+                sensitivity=_sensitivity_requested(query_string, body),
+                flight=cls.inflight,
+                shadow=cls.shadow_scorer,
+            )
+        except InputError as e:
+            stages.mark("validate")
+            cls.request_metrics.count_input_errors(e.errors)
+            return json_response(400, {"message": e.message, "errors": e.errors})
+        except Exception as e:  # pragma: no cover
+            return json_response(500, {"message": "Internal error", "error": str(e)})
 
-        query = parse_qs(parsed.query)
-        explain_qs = query.get("explain", ["0"])[0] if query else "0"
-        want_explain = _boolish(body.get("explain")) or _boolish(explain_qs)
+        response = json_response(200, result)
+        stages.mark("serialize")
+        return response
 
+    @classmethod
+    def _handle_batch(cls, query_string: str, raw_body: bytes, stages: metrics.StageTimer) -> Response:
         try:
-            result = recommend(body, self.weights, explain=want_explain)
+            body = cls._decode_json(raw_body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return json_response(400, {"message": "Invalid JSON"})
+        stages.mark("json_decode")
+
+        # Accept either a bare list of payloads or { "items": [...], "explain": bool }.
+        items = body.get("items") if isinstance(body, dict) else body
+        if not isinstance(items, list):
+            return json_response(
+                400,
+                {"message": "Invalid batch", "errors": {"items": "Must be a list of payload objects"}},
+            )
+
+        if len(items) > cls.max_batch_size:
+            return json_response(
+                413,
+                {
+                    "message": "Batch too large",
+                    "errors": {"items": f"At most {cls.max_batch_size} items per request"},
+                },
+            )
+
+        try:
+            want_explain = _explain_requested(query_string, body)
         except InputError as e:
-            self._send_json(400, {"message": e.message, "errors": e.errors})
-            return
+            return json_response(400, {"message": e.message, "errors": e.errors})
+
+        try:
+            results = recommend_many(
+                items,
+                cls.weights,
+                explain=want_explain,
+                cache=cls.result_cache,
+                stages=stages,
+                competitors=cls.competitor_store,
+                features=cls.feature_store,
+                sensitivity=_sensitivity_requested(query_string, body),
+                flight=cls.inflight,
+                shadow=cls.shadow_scorer,
+            )
+        except Exception as e:  # pragma: no cover
+            return json_response(500, {"message": "Internal error", "error": str(e)})
+        for entry in results:
+            if "error" in entry:
+                cls.request_metrics.count_input_errors(entry["error"]["errors"])
+
+        stages.reset()
+        response = json_response(
+            200,
+            {
+                "model_version": cls.weights.model_version,
+                "count": len(results),
+                "results": results,
+            },
+        )
+        stages.mark("serialize")
+        return response
+
+    @classmethod
+    def _handle_simulate(cls, raw_body: bytes, stages: metrics.StageTimer) -> Response:
+        try:
+            body = cls._decode_json(raw_body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return json_response(400, {"message": "Invalid JSON"})
+        stages.mark("json_decode")
+
+        if not isinstance(body, dict) or not isinstance(body.get("payload"), dict):
+            return json_response(
+                400,
+                {"message": "Invalid simulation", "errors": {"payload": "Must be a recommend() payload object"}},
+            )
+        try:
+            axes = parse_axes(body.get("axes"))
+        except InputError as e:
+            return json_response(400, {"message": e.message, "errors": e.errors})
+        cells = math.prod(len(values) for _, values in axes)
+        if cells > cls.max_simulate_cells:
+            return json_response(
+                413,
+                {
+                    "message": "Simulation too large",
+                    "errors": {"axes": f"At most {cls.max_simulate_cells} grid cells per request"},
+                },
+            )
+
+        try:
+            result = simulate(
+                body["payload"], axes, cls.weights, competitors=cls.competitor_store, features=cls.feature_store
+            )
+        except InputError as e:
+            stages.mark("validate")
+            cls.request_metrics.count_input_errors(e.errors)
+            return json_response(400, {"message": e.message, "errors": e.errors})
         except Exception as e:  # pragma: no cover
-            self._send_json(500, {"message": "Internal error", "error": str(e)})
+            return json_response(500, {"message": "Internal error", "error": str(e)})
+        stages.mark("formula")
+        response = json_response(200, result)
+        stages.mark("serialize")
+        return response
+
+    @classmethod
+    def _handle_ingest(cls, raw_body: bytes) -> Response:
+        store = cls.competitor_store
+        if store is None:
+            return json_response(404, {"message": "Competitor state is disabled"})
+        try:
+            body = cls._decode_json(raw_body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return json_response(400, {"message": "Invalid JSON"})
+
+        # Same envelope as the batch endpoint: a bare list or { "items": [...] }.
+        items = body.get("items") if isinstance(body, dict) else body
+        if not isinstance(items, list):
+            return json_response(
+                400,
+                {"message": "Invalid observations", "errors": {"items": "Must be a list of observation objects"}},
+            )
+        if len(items) > cls.max_batch_size:
+            return json_response(
+                413,
+                {
+                    "message": "Batch too large",
+                    "errors": {"items": f"At most {cls.max_batch_size} items per request"},
+                },
+            )
+
+        accepted = 0
+        errors: list[dict[str, Any]] = []
+        for index, item in enumerate(items):
+            try:
+                listing_id, prices, observed_at = _decode_observation(item)
+                accepted += store.ingest(listing_id, prices, observed_at)
+            except InputError as e:
+                errors.append({"index": index, "error": {"message": e.message, "errors": e.errors}})
+        return json_response(200, {"accepted": accepted, "errors": errors})
+
+    def _send(self, response: Response, stages: metrics.StageTimer = metrics.NO_STAGES) -> None:
+        started = time.perf_counter()
+        self.send_response(response.status)
+        self.send_header("Content-Type", response.content_type)
+        self.send_header("Content-Length", str(len(response.body)))
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(response.body)
+        self.request_metrics.observe_stage("write", time.perf_counter() - started, stages)
+
+    def do_GET(self) -> None:  # noqa: N802
+        stages = self.request_metrics.stage_timer()
+        self._send(self.respond("GET", self.path, b"", stages), stages)
+
+    def _stream(self, stream: LineStream) -> None:
+        # Results are written as soon as each block of request lines is scored. HTTP/1.1
+        # clients get a chunked response; HTTP/1.0 ones a body delimited by closing.
+        chunked = self.request_version == "HTTP/1.1"
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            blocks = streaming.iter_chunked(self.rfile)
+        else:
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                stream.close(False)
+                self._send(json_response(400, {"message": "Invalid Content-Length"}))
+                return
+            blocks = streaming.iter_content(self.rfile, length)
+
+        if chunked and self.headers.get("Expect", "").lower() == "100-continue":
+            self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        self.close_connection = True
+        if chunked:
+            self.protocol_version = "HTTP/1.1"
+        self.send_response(200)
+        self.send_header("Content-Type", stream.content_type)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def write(data: bytes) -> None:
+            if data:
+                self.wfile.write(streaming.encode_chunk(data) if chunked else data)
+
+        ok = False
+        try:
+            for block in blocks:
+                write(stream.feed(block))
+            write(stream.finish())
+            ok = True
+        except streaming.MalformedBody as e:
+            write(codec.dumps({"error": {"message": str(e), "errors": {}}}) + b"\n")
+        except TimeoutError:
+            write(codec.dumps({"error": {"message": "Timed out reading the request body", "errors": {}}}) + b"\n")
+        finally:
+            stream.close(ok)
+        if chunked:
+            self.wfile.write(streaming.LAST_CHUNK)
+
+    def _past_deadline(self) -> bool:
+        """Answer 503 instead of doing work the caller has stopped waiting for (see admission.py)."""
+        check = getattr(self.server, "past_deadline", None)
+        if check is None or not check(self.headers.get(admission.TIMEOUT_HEADER)):
+            return False
+        self._send(json_response(503, {"message": "Request deadline exceeded"}))
+        return True
+
+    def do_POST(self) -> None:  # noqa: N802
+        if self._past_deadline():
+            return
+        stream = self.stream_route("POST", self.path)
+        if stream is not None:
+            self._stream(stream)
             return
+        length = int(self.headers.get("Content-Length") or 0)
+        stages = self.request_metrics.stage_timer()
+        raw = self.rfile.read(length) if length > 0 else b"{}"
+        stages.mark("body_read")
+        self._send(self.respond("POST", self.path, raw, stages), stages)
 
-        self._send_json(200, result)
+
+def _make_server(
+    host: str,
+    port: int,
+    *,
+    sock: socket.socket | None = None,
+    reuse_port: bool = False,
+    threads: int = 0,
+    **pool: Any,
+) -> ThreadingHTTPServer | admission.PooledHTTPServer:
+    """
+    Build the HTTP server, optionally on an inherited or SO_REUSEPORT socket. With
+    `threads` > 0 connections are served by a bounded pool (admission.PooledHTTPServer,
+    configured by `pool`) instead of a thread per connection.
+    """
+    factory: Any = ThreadingHTTPServer
+    if threads > 0:
+        factory = functools.partial(admission.PooledHTTPServer, workers=threads, **pool)
+    if sock is None and not reuse_port:
+        return factory((host, port), Handler)
+
+    httpd = factory((host, port), Handler, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = sock if sock is not None else prefork.bind_socket(host, port, reuse_port=True)
+    httpd.server_address = httpd.socket.getsockname()[:2]
+    httpd.server_name = host
+    httpd.server_port = httpd.server_address[1]
+    return httpd
+
+
+def _start_snapshots(store: CompetitorStore, path: str, interval: float) -> threading.Thread:
+    """Save `store` to `path` every `interval` seconds from a daemon thread."""
+
+    def loop() -> None:
+        while True:
+            time.sleep(max(1.0, interval))
+            try:
+                store.save(path)
+            except OSError as e:
+                print(f"Competitor snapshot failed: {e}")
+
+    thread = threading.Thread(target=loop, name="competitor-snapshots", daemon=True)
+    thread.start()
+    return thread
+
+
+def _start_feature_refresh(store: FeatureStore, interval: float) -> threading.Thread:
+    """Map a replaced feature file (see features.write) within `interval` seconds, from a daemon thread."""
+
+    def loop() -> None:
+        while True:
+            time.sleep(interval)
+            if store.refresh():
+                print(f"Listing features: {len(store)} listings from {store.path}")
+
+    thread = threading.Thread(target=loop, name="listing-features", daemon=True)
+    thread.start()
+    return thread
 
 
 def main() -> None:
@@ -599,15 +2216,249 @@ def main() -> None:
         default=os.path.join(os.path.dirname(__file__), "weights.json"),
         help="Path to weights.json",
     )
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=Handler.max_batch_size,
+        help="Maximum number of items accepted by /v1/recommend/batch",
+    )
+    parser.add_argument(
+        "--max-simulate-cells",
+        type=int,
+        default=Handler.max_simulate_cells,
+        help="Maximum grid size (product of the axis lengths) accepted by /v1/simulate",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Pre-fork this many worker processes (POSIX only); 1 = single process",
+    )
+    parser.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="With --workers, bind one SO_REUSEPORT socket per worker instead of sharing one",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("threading", "asyncio"),
+        default="threading",
+        help="threading: HTTP/1.0 served by a bounded pool of --threads workers per process; "
+        "asyncio: keep-alive HTTP/1.1 event loop",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=32,
+        help="threading backend: worker threads per process (0 = one unbounded thread per connection)",
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=128,
+        help="threading backend: connections waiting for a worker before new ones get 503 + Retry-After",
+    )
+    parser.add_argument(
+        "--max-queue-wait",
+        type=float,
+        default=3.0,
+        help="threading backend: seconds a connection may wait for a worker before it gets 503 (0 = no limit)",
+    )
+    parser.add_argument(
+        "--max-per-client",
+        type=int,
+        default=0,
+        help="threading backend: connections per client address queued or in service, beyond that 429 (0 = no limit)",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=2.0,
+        help="threading backend: seconds a client may stay idle while sending a request (0 = no limit); "
+        "keep it below --max-queue-wait so idle clients free their workers before queued requests give up",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=1024,
+        help="asyncio backend: connections served concurrently (per worker)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=10_000,
+        help="Max cached recommendation results per process (0 disables the cache)",
+    )
+    parser.add_argument("--cache-ttl", type=float, default=300.0, help="Result cache TTL in seconds")
+    parser.add_argument(
+        "--no-coalesce",
+        action="store_true",
+        help="Don't let concurrent identical recommendations share one computation",
+    )
+    parser.add_argument(
+        "--stage-sample",
+        type=int,
+        default=10,
+        help="Record per-stage /metrics timings for every Nth request (1 = every request)",
+    )
+    parser.add_argument(
+        "--competitor-listings",
+        type=int,
+        default=100_000,
+        help="Listings kept in the per-listing competitor price state (0 disables /v1/competitors)",
+    )
+    parser.add_argument(
+        "--competitor-max-age",
+        type=float,
+        default=7 * 86400.0,
+        help="Seconds a competitor price observation is kept",
+    )
+    parser.add_argument(
+        "--competitor-ring-size",
+        type=int,
+        default=64,
+        help="Most recent observations per listing used for the stored competitor average",
+    )
+    parser.add_argument("--competitor-snapshot", help="Load competitor state from / save it to this file")
+    parser.add_argument(
+        "--competitor-snapshot-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between competitor state snapshots",
+    )
+    parser.add_argument(
+        "--listing-features",
+        help="Take static inputs and min_price floors of listing_id-only payloads from this file (see features.py)",
+    )
+    parser.add_argument(
+        "--listing-features-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between checks for a replaced --listing-features file (0 = never reload)",
+    )
+    parser.add_argument(
+        "--shadow-weights",
+        help="Also score requests with this candidate weights.json in the background (see /v1/shadow/stats)",
+    )
+    parser.add_argument(
+        "--shadow-queue",
+        type=int,
+        default=10_000,
+        help="Payloads waiting for shadow scoring before new ones are dropped",
+    )
+    parser.add_argument(
+        "--shadow-cpu-budget",
+        type=float,
+        default=0.02,
+        help="Share of one core shadow scoring may use per process; payloads beyond it are dropped (0.001-1)",
+    )
     args = parser.parse_args()
 
-    weights = _load_weights(args.weights)
-    Handler.weights = weights
-
-    server = ThreadingHTTPServer((args.host, args.port), Handler)
-    print(f"AI Price Engine listening on http://{args.host}:{args.port}")
+    if args.competitor_listings > 0 and args.workers > 1:
+        # Each worker would hold its own copy, and an ingest only reaches one of them.
+        if args.competitor_snapshot:
+            raise SystemExit("--competitor-snapshot requires a single process (--workers 1)")
+        print("Competitor state is per process; disabled with --workers > 1")
+        args.competitor_listings = 0
+    if args.competitor_listings > 0:
+        Handler.competitor_store = CompetitorStore(
+            max_age=args.competitor_max_age,
+            ring_size=args.competitor_ring_size,
+            max_listings=args.competitor_listings,
+        )
+        if args.competitor_snapshot:
+            loaded = Handler.competitor_store.load(args.competitor_snapshot)
+            print(f"Competitor state: {loaded} listings from {args.competitor_snapshot}")
+            _start_snapshots(Handler.competitor_store, args.competitor_snapshot, args.competitor_snapshot_interval)
+
+    if args.listing_features:
+        # Mapped before forking: every worker reads the same pages.
+        try:
+            Handler.feature_store = FeatureStore(args.listing_features)
+        except (OSError, ValueError) as e:
+            raise SystemExit(f"--listing-features: {e}")
+        print(f"Listing features: {len(Handler.feature_store)} listings from {args.listing_features}")
+
+    if args.cache_size > 0 and args.cache_ttl > 0:
+        Handler.result_cache = ResultCache(args.cache_size, args.cache_ttl)
+    if not args.no_coalesce:
+        Handler.inflight = SingleFlight()
+    Handler.set_weights(_load_weights(args.weights))
+    # Without it an idle or slow client keeps its worker (see admission.py) indefinitely.
+    Handler.timeout = args.request_timeout if args.request_timeout > 0 else None
+    Handler.max_batch_size = max(1, args.max_batch)
+    Handler.max_simulate_cells = max(1, args.max_simulate_cells)
+    Handler.request_metrics = metrics.Metrics(stage_sample_every=args.stage_sample)
+    if args.shadow_weights:
+        # _load_weights() falls back to defaults; a missing candidate must not look like a trial.
+        if not os.path.isfile(args.shadow_weights):
+            raise SystemExit(f"--shadow-weights: no such file: {args.shadow_weights}")
+        candidate = _load_weights(args.shadow_weights)
+        Handler.shadow_scorer = ShadowScorer(
+            lambda payloads: shadow_pairs(payloads, Handler.weights, candidate),
+            model_version=candidate.model_version,
+            queue_size=args.shadow_queue,
+            cpu_budget=args.shadow_cpu_budget,
+        )
+
+    def run(sock: socket.socket | None = None, reuse_port: bool = False) -> None:
+        if Handler.shadow_scorer is not None:
+            Handler.shadow_scorer.start()  # in the worker: threads don't survive fork
+        if Handler.feature_store is not None and args.listing_features_interval > 0:
+            _start_feature_refresh(Handler.feature_store, args.listing_features_interval)
+        if args.backend == "asyncio":
+            aioserver.serve(
+                Handler.respond,
+                args.host,
+                args.port,
+                sock=sock,
+                reuse_port=reuse_port,
+                max_connections=args.max_connections,
+                stream_app=Handler.stream_route,
+                recorder=Handler.request_metrics,
+            )
+        else:
+            httpd = _make_server(
+                args.host,
+                args.port,
+                sock=sock,
+                reuse_port=reuse_port,
+                threads=args.threads,
+                queue_depth=args.queue_depth,
+                max_queue_wait=args.max_queue_wait,
+                max_per_client=args.max_per_client,
+            )
+            if isinstance(httpd, admission.PooledHTTPServer):
+                Handler.admission_stats = httpd.stats
+            httpd.serve_forever()
+
+    if args.workers <= 1:
+        print(f"AI Price Engine listening on http://{args.host}:{args.port} ({args.backend})")
+        print(f"Using weights: {args.weights}")
+        if args.shadow_weights:
+            print(f"Shadow weights: {args.shadow_weights}")
+        try:
+            run()
+        finally:
+            if Handler.competitor_store is not None and args.competitor_snapshot:
+                Handler.competitor_store.save(args.competitor_snapshot)
+        return
+
+    if not prefork.fork_supported():
+        raise SystemExit("--workers requires os.fork (POSIX only)")
+    if args.reuse_port and not prefork.reuse_port_supported():
+        raise SystemExit("--reuse-port is not supported on this platform")
+
+    # Weights are loaded above, before forking, so workers share them copy-on-write.
+    sock = None if args.reuse_port else prefork.bind_socket(args.host, args.port)
+
+    mode = "SO_REUSEPORT" if args.reuse_port else "shared socket"
+    print(
+        f"AI Price Engine listening on http://{args.host}:{args.port} "
+        f"({args.backend}, {args.workers} workers, {mode})"
+    )
     print(f"Using weights: {args.weights}")
-    server.serve_forever()
+    prefork.Supervisor(lambda: run(sock, args.reuse_port), args.workers).run()
 
 
 if __name__ == "__main__":
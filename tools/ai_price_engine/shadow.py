@@ -0,0 +1,228 @@
+"""
+Shadow scoring: compare a candidate weight set against the served one on live traffic.
+
+The server offers each scored payload to a ShadowScorer, which only appends it to a
+bounded queue (payloads are dropped, and counted, when the queue is full). A background
+thread drains the queue in batches and scores every batch with both weight sets through
+the `score` callable, off the response path; only the primary result is ever returned to
+clients. That thread still competes with request threads for the GIL and the CPU, so it
+is held to `cpu_budget` (a fraction of one core): after each batch it pauses until its
+CPU time is within the budget, the queue fills up meanwhile, and under heavy traffic
+only a sample of the payloads (`compared` out of `offered`) is scored. Divergence is
+aggregated in memory: the price delta distribution (absolute and relative, as quantile
+sketches), confidence deltas, clamp flag disagreement and payloads that only one of the
+weight sets rejects. With --workers every process keeps its own statistics over the
+requests it served.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+from sketch import QuantileSketch
+
+# (recommended_price, confidence, clamp_min_price, clamp_ceiling); None if rejected.
+Outcome = tuple[float, float, bool, bool]
+# Scores payloads with the primary and the shadow weights: one (primary, shadow) per payload.
+ScorePairs = Callable[[list[dict[str, Any]]], list[tuple[Outcome | None, Outcome | None]]]
+
+SKETCH_ACCURACY = 0.01
+QUANTILES = (0.01, 0.05, 0.5, 0.95, 0.99)
+
+
+class ShadowStats:
+    """Divergence between primary and shadow outcomes (not thread-safe; see ShadowScorer)."""
+
+    def __init__(self) -> None:
+        self.compared = 0
+        self.price_changed = 0
+        self.price_delta = QuantileSketch(SKETCH_ACCURACY)
+        self.price_delta_pct = QuantileSketch(SKETCH_ACCURACY)
+        self.abs_price_delta_sum = 0.0
+        self.max_abs_price_delta = 0.0
+        self.confidence_delta_sum = 0.0
+        self.abs_confidence_delta_sum = 0.0
+        self.clamp_disagreements = {"min_price": 0, "ceiling": 0}
+        self.primary_only_errors = 0
+        self.shadow_only_errors = 0
+        self.both_errors = 0
+
+    def record(self, primary: Outcome | None, shadow: Outcome | None) -> None:
+        if primary is None or shadow is None:
+            if primary is not None:
+                self.shadow_only_errors += 1
+            elif shadow is not None:
+                self.primary_only_errors += 1
+            else:
+                self.both_errors += 1
+            return
+        price, confidence, clamp_min_price, clamp_ceiling = primary
+        delta = shadow[0] - price
+        self.compared += 1
+        if delta:
+            self.price_changed += 1
+        self.price_delta.add(delta)
+        if price > 0:
+            self.price_delta_pct.add(100.0 * delta / price)
+        self.abs_price_delta_sum += abs(delta)
+        self.max_abs_price_delta = max(self.max_abs_price_delta, abs(delta))
+        confidence_delta = shadow[1] - confidence
+        self.confidence_delta_sum += confidence_delta
+        self.abs_confidence_delta_sum += abs(confidence_delta)
+        if clamp_min_price != shadow[2]:
+            self.clamp_disagreements["min_price"] += 1
+        if clamp_ceiling != shadow[3]:
+            self.clamp_disagreements["ceiling"] += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        n = self.compared
+        out: dict[str, Any] = {
+            "compared": n,
+            "price_changed": self.price_changed,
+            "primary_only_errors": self.primary_only_errors,
+            "shadow_only_errors": self.shadow_only_errors,
+            "both_errors": self.both_errors,
+        }
+        if n == 0:
+            return out
+        out["price_delta"] = {
+            "mean_abs": round(self.abs_price_delta_sum / n, 6),
+            "max_abs": round(self.max_abs_price_delta, 6),
+            **_quantiles(self.price_delta),
+        }
+        if self.price_delta_pct.count:
+            out["price_delta_pct"] = _quantiles(self.price_delta_pct)
+        out["confidence_delta"] = {
+            "mean": round(self.confidence_delta_sum / n, 6),
+            "mean_abs": round(self.abs_confidence_delta_sum / n, 6),
+        }
+        out["clamp_disagreement"] = {
+            name: {"count": count, "rate": round(count / n, 6)} for name, count in self.clamp_disagreements.items()
+        }
+        return out
+
+
+def _quantiles(sketch: QuantileSketch) -> dict[str, float]:
+    return {f"p{round(q * 100):02d}": round(sketch.quantile(q), 6) for q in QUANTILES}
+
+
+class ShadowScorer:
+    def __init__(
+        self,
+        score: ScorePairs,
+        *,
+        model_version: str,
+        queue_size: int = 10_000,
+        batch_size: int = 64,
+        linger: float = 0.05,
+        cpu_budget: float = 0.02,
+    ) -> None:
+        self.score = score
+        self.model_version = model_version
+        self.queue_size = max(1, queue_size)
+        self.batch_size = max(1, batch_size)
+        # Seconds the worker waits for a batch to fill up before scoring a partial one.
+        self.linger = linger
+        # Share of one core the worker may use, measured with time.thread_time().
+        self.cpu_budget = min(1.0, max(0.001, cpu_budget))
+        self._cond = threading.Condition()
+        self._pending: list[dict[str, Any]] = []
+        self._thread: threading.Thread | None = None
+        self._stats = ShadowStats()
+        self.offered = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.cpu_seconds = 0.0
+        self.throttled_seconds = 0.0
+
+    def offer(self, payloads: list[Any]) -> None:
+        """Queue payloads for shadow scoring; never blocks and never raises."""
+        items = [p for p in payloads if isinstance(p, dict)]
+        if not items:
+            return
+        with self._cond:
+            room = self.queue_size - len(self._pending)
+            self.offered += len(items)
+            if len(items) > room:
+                self.dropped += len(items) - max(0, room)
+                items = items[: max(0, room)]
+            was_empty = not self._pending
+            self._pending.extend(items)
+            if was_empty or len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def start(self) -> None:
+        """Start the background worker (call in the serving process, i.e. after fork)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                if len(self._pending) < self.batch_size:
+                    self._cond.wait(self.linger)
+            started = time.thread_time()
+            self._score_batch()
+            spent = time.thread_time() - started
+            # Idle long enough that spent / (spent + pause) stays within the budget.
+            pause = spent / self.cpu_budget - spent
+            if pause > 0:
+                with self._cond:
+                    self.throttled_seconds += pause
+                time.sleep(pause)
+
+    def process_pending(self) -> int:
+        """Score everything queued so far, in batches, ignoring cpu_budget; returns the payloads compared."""
+        done = 0
+        while True:
+            scored = self._score_batch()
+            if scored is None:
+                return done
+            done += scored
+
+    def _score_batch(self) -> int | None:
+        """Score the next batch; returns the payloads compared, or None if nothing was queued."""
+        started = time.thread_time()
+        with self._cond:
+            batch = self._pending[: self.batch_size]
+            del self._pending[: self.batch_size]
+        if not batch:
+            return None
+        try:
+            pairs = self.score(batch)
+        except Exception:
+            # Shadow problems must never reach the primary path; count and move on.
+            pairs = None
+        with self._cond:
+            self.cpu_seconds += time.thread_time() - started
+            if pairs is None:
+                self.failed_batches += 1
+                return 0
+            for primary, shadow in pairs:
+                self._stats.record(primary, shadow)
+        return len(batch)
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "shadow_model_version": self.model_version,
+                "offered": self.offered,
+                "dropped": self.dropped,
+                "queued": len(self._pending),
+                "failed_batches": self.failed_batches,
+                "cpu_budget": self.cpu_budget,
+                "cpu_seconds": round(self.cpu_seconds, 6),
+                "throttled_seconds": round(self.throttled_seconds, 6),
+                **self._stats.to_dict(),
+            }
+
+    def reset(self) -> None:
+        """Start a fresh comparison (e.g. after either weight set changed)."""
+        with self._cond:
+            self._stats = ShadowStats()
@@ -0,0 +1,153 @@
+"""
+Constant-memory quantile sketch with logarithmic buckets (DDSketch-style).
+
+Each value is counted in a bucket whose bounds lie within `relative_accuracy` of it, so
+any quantile comes back with at most that relative error however many values were
+added. Buckets are sparse: with the default 0.1% accuracy, values spanning 1e-6..1e6
+occupy at most ~14,000 buckets per sign (prices within 1..1e5 under 6,000). Values
+within `min_value` of zero are counted as zero.
+
+Counts may be fractional after decay(), which down-weights everything seen so far (used
+by incremental training). Sketches serialize to JSON-safe dicts via to_dict/from_dict.
+"""
+
+from __future__ import annotations
+
+import math
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy: float = 0.001, *, min_value: float = 1e-9) -> None:
+        if not 0.0 < relative_accuracy < 1.0:
+            raise ValueError("relative_accuracy must be in (0, 1)")
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: dict[int, float] = {}
+        self.negative: dict[int, float] = {}
+        self.zero: float = 0
+        self.count: float = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _key(self, magnitude: float) -> int:
+        return math.ceil(math.log(magnitude) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        # Midpoint (in relative terms) of the bucket (gamma^(key-1), gamma^key].
+        return 2.0 * self.gamma**key / (self.gamma + 1.0)
+
+    def add(self, value: float, count: float = 1) -> None:
+        if value > self.min_value:
+            key = self._key(value)
+            self.positive[key] = self.positive.get(key, 0) + count
+        elif value < -self.min_value:
+            key = self._key(-value)
+            self.negative[key] = self.negative.get(key, 0) + count
+        else:
+            self.zero += count
+        self.count += count
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def add_many(self, values: Iterable[float]) -> None:
+        """add() for every value; bucket keys are computed with numpy when it is available."""
+        if np is None:
+            for value in values:
+                self.add(value)
+            return
+        if not hasattr(values, "__len__"):
+            values = list(values)
+        array = np.asarray(values, dtype=np.float64)
+        if array.size == 0:
+            return
+        positive = array[array > self.min_value]
+        negative = -array[array < -self.min_value]
+        for store, magnitudes in ((self.positive, positive), (self.negative, negative)):
+            if magnitudes.size:
+                keys, counts = np.unique(np.ceil(np.log(magnitudes) / self._log_gamma), return_counts=True)
+                for key, n in zip(keys.astype(np.int64).tolist(), counts.tolist()):
+                    store[key] = store.get(key, 0) + n
+        self.zero += int(array.size - positive.size - negative.size)
+        self.count += int(array.size)
+        self.min = min(self.min, float(array.min()))
+        self.max = max(self.max, float(array.max()))
+
+    def merge(self, other: QuantileSketch) -> None:
+        """Add another sketch's counts into this one (same accuracy settings required)."""
+        if other.gamma != self.gamma or other.min_value != self.min_value:
+            raise ValueError("Cannot merge sketches with different accuracy settings")
+        for mine, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, n in theirs.items():
+                mine[key] = mine.get(key, 0) + n
+        self.zero += other.zero
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def decay(self, factor: float) -> None:
+        """Multiply every count by factor (0 < factor <= 1); min/max are kept."""
+        for store in (self.positive, self.negative):
+            for key in store:
+                store[key] *= factor
+        self.zero *= factor
+        self.count *= factor
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "min_value": self.min_value,
+            "count": self.count,
+            "zero": self.zero,
+            "min": None if self.count == 0 else self.min,
+            "max": None if self.count == 0 else self.max,
+            "positive": {str(k): n for k, n in self.positive.items()},
+            "negative": {str(k): n for k, n in self.negative.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, raw: Mapping[str, Any]) -> QuantileSketch:
+        sketch = cls(float(raw["relative_accuracy"]), min_value=float(raw["min_value"]))
+        sketch.count = raw["count"]
+        sketch.zero = raw["zero"]
+        if raw.get("min") is not None:
+            sketch.min = float(raw["min"])
+            sketch.max = float(raw["max"])
+        sketch.positive = {int(k): n for k, n in raw["positive"].items()}
+        sketch.negative = {int(k): n for k, n in raw["negative"].items()}
+        return sketch
+
+    def quantile(self, q: float) -> float:
+        """Nearest-rank quantile (same rank as train._percentile on the sorted values)."""
+        if self.count == 0:
+            raise ValueError("Empty sketch")
+        q = max(0.0, min(1.0, q))
+        rank = int(round(q * (self.count - 1)))
+        if rank == 0:
+            return self.min
+        if rank >= self.count - 1:
+            return self.max
+
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return max(self.min, -self._value(key))
+        seen += self.zero
+        if seen > rank:
+            return min(self.max, max(self.min, 0.0))
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return min(self.max, self._value(key))
+        return self.max
@@ -0,0 +1,165 @@
+"""
+Helpers for streamed (NDJSON) request and response bodies.
+
+Request bodies may arrive with a Content-Length or with chunked transfer encoding;
+either way they are read in blocks and split into lines as they come in, so a
+stream of any length is handled in constant memory. Responses are written back as
+HTTP/1.1 chunks.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator, Iterator
+from typing import BinaryIO
+
+READ_BLOCK_BYTES = 64 * 1024
+
+# Longest accepted NDJSON line (one payload); longer lines are reported and skipped.
+MAX_LINE_BYTES = 1024 * 1024
+
+# Longest accepted chunk-size line (hex size plus optional chunk extensions).
+_MAX_CHUNK_HEADER = 1024
+
+LAST_CHUNK = b"0\r\n\r\n"
+
+
+class MalformedBody(ValueError):
+    pass
+
+
+def encode_chunk(data: bytes) -> bytes:
+    """Frame `data` as one HTTP/1.1 chunk (empty data would end the body, so don't)."""
+    return b"%x\r\n%s\r\n" % (len(data), data)
+
+
+def _chunk_size(line: bytes) -> int:
+    size = line.split(b";", 1)[0].strip()
+    try:
+        value = int(size, 16)
+    except ValueError:
+        raise MalformedBody("Invalid chunk size") from None
+    if value < 0:
+        raise MalformedBody("Invalid chunk size")
+    return value
+
+
+def iter_content(rfile: BinaryIO, length: int) -> Iterator[bytes]:
+    """Read a Content-Length body in blocks."""
+    remaining = length
+    while remaining > 0:
+        block = rfile.read(min(remaining, READ_BLOCK_BYTES))
+        if not block:
+            raise MalformedBody("Body shorter than Content-Length")
+        remaining -= len(block)
+        yield block
+
+
+def iter_chunked(rfile: BinaryIO) -> Iterator[bytes]:
+    """Decode a chunked request body from a blocking file object."""
+    while True:
+        line = rfile.readline(_MAX_CHUNK_HEADER + 1)
+        if not line.endswith(b"\n"):
+            raise MalformedBody("Invalid chunk header")
+        remaining = _chunk_size(line)
+        if remaining == 0:
+            # Trailer section: header lines up to an empty line.
+            while True:
+                trailer = rfile.readline(_MAX_CHUNK_HEADER + 1)
+                if not trailer.endswith(b"\n"):
+                    raise MalformedBody("Invalid chunk trailer")
+                if trailer in (b"\r\n", b"\n"):
+                    return
+        while remaining > 0:
+            block = rfile.read(min(remaining, READ_BLOCK_BYTES))
+            if not block:
+                raise MalformedBody("Truncated chunk")
+            remaining -= len(block)
+            yield block
+        if rfile.readline(3) not in (b"\r\n", b"\n"):
+            raise MalformedBody("Missing chunk terminator")
+
+
+async def aiter_content(reader: asyncio.StreamReader, length: int) -> AsyncIterator[bytes]:
+    remaining = length
+    while remaining > 0:
+        block = await reader.read(min(remaining, READ_BLOCK_BYTES))
+        if not block:
+            raise MalformedBody("Body shorter than Content-Length")
+        remaining -= len(block)
+        yield block
+
+
+async def aiter_chunked(reader: asyncio.StreamReader) -> AsyncIterator[bytes]:
+    """Decode a chunked request body from an asyncio stream."""
+
+    async def readline() -> bytes:
+        try:
+            return await reader.readuntil(b"\n")
+        except asyncio.LimitOverrunError:
+            raise MalformedBody("Invalid chunk header") from None
+        except asyncio.IncompleteReadError:
+            raise MalformedBody("Truncated chunked body") from None
+
+    while True:
+        remaining = _chunk_size(await readline())
+        if remaining == 0:
+            while (await readline()) not in (b"\r\n", b"\n"):
+                pass
+            return
+        while remaining > 0:
+            block = await reader.read(min(remaining, READ_BLOCK_BYTES))
+            if not block:
+                raise MalformedBody("Truncated chunk")
+            remaining -= len(block)
+            yield block
+        if (await readline()) not in (b"\r\n", b"\n"):
+            raise MalformedBody("Missing chunk terminator")
+
+
+class LineSplitter:
+    """
+    Incrementally split a byte stream into lines.
+
+    `feed()` returns the lines completed by a block (without the newline); a line
+    longer than `max_line_bytes` is returned as None once and its bytes are dropped.
+    """
+
+    def __init__(self, max_line_bytes: int = MAX_LINE_BYTES) -> None:
+        self.max_line_bytes = max_line_bytes
+        self._pending = bytearray()
+        self._skipping = False
+
+    def feed(self, data: bytes) -> list[bytes | None]:
+        lines: list[bytes | None] = []
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            if self._skipping:
+                self._skipping = False
+            elif len(self._pending) + end - start > self.max_line_bytes:
+                lines.append(None)
+            elif self._pending:
+                self._pending += data[start:end]
+                lines.append(bytes(self._pending))
+            else:
+                lines.append(data[start:end])
+            self._pending.clear()
+            start = end + 1
+
+        if not self._skipping:
+            self._pending += data[start:]
+            if len(self._pending) > self.max_line_bytes:
+                lines.append(None)
+                self._pending.clear()
+                self._skipping = True
+        return lines
+
+    def finish(self) -> list[bytes | None]:
+        """Return the final line if the stream didn't end with a newline."""
+        tail = bytes(self._pending)
+        self._pending.clear()
+        self._skipping = False
+        return [tail] if tail else []
@@ -1,14 +1,38 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import http.client
+import io
+import json
 import os
+import random
 import sys
+import tempfile
+import threading
+import time
 import unittest
+import urllib.error
+import urllib.request
 
 THIS_DIR = os.path.dirname(__file__)
 if THIS_DIR not in sys.path:
     sys.path.insert(0, THIS_DIR)
 
+import features  # noqa: E402
+import score  # noqa: E402
 import server  # noqa: E402
+import train  # noqa: E402
+from competitors import CompetitorStore  # noqa: E402
+from sketch import QuantileSketch  # noqa: E402
+
+try:
+    import numpy as np
+
+    import vectorized
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+    vectorized = None
 
 
 class PriceEngineTest(unittest.TestCase):
@@ -53,6 +77,33 @@ class PriceEngineTest(unittest.TestCase):
         self.assertEqual(explain["competitor_method"], "trimmed_mean_10pct")
         self.assertLess(explain["competitor_avg_used"], 1000)
 
+    def test_long_competitor_lists_select_the_same_trimmed_core(self) -> None:
+        prices = [float((i * 7919) % 1013) + 0.25 for i in range(3000)] + [0.0, -5.0, float("nan")]
+        values = [v for v in prices if v > 0 and v == v]
+        values.sort()
+        trim = int(len(values) * 0.1)
+        core = values[trim : len(values) - trim]
+        avg, method = server._robust_price_average(prices)
+        self.assertEqual(method, "trimmed_mean_10pct")
+        self.assertEqual(avg, sum(core) / len(core))
+        for q in (0.0, 0.5, 0.95, 1.0):
+            self.assertEqual(train._quantile(values[::-1], q), train._percentile(values, q))
+
+    @unittest.skipIf(server._np is None, "numpy not installed")
+    def test_selection_trimmed_mean_is_bit_identical_to_sorting(self) -> None:
+        def sorted_trimmed_mean(prices: list[float]) -> float:
+            values = sorted(prices)
+            trim = max(1, int(len(values) * 0.1))
+            core = values[trim : len(values) - trim]
+            return sum(core) / len(core)
+
+        rng = random.Random(17)
+        for size in (5, 100, 10_000):
+            for _ in range(20):
+                prices = [rng.lognormvariate(4.0, 1.5) for _ in range(size)]
+                avg, method = server._trimmed_mean_by_selection(prices)
+                self.assertEqual((avg, method), (sorted_trimmed_mean(prices), "trimmed_mean_10pct"))
+
     def test_missing_competitor_falls_back_to_current_or_min(self) -> None:
         payload = {
             "cost_price": 100.0,
@@ -75,6 +126,986 @@ class PriceEngineTest(unittest.TestCase):
         with self.assertRaises(server.InputError):
             server.recommend(payload, self.weights)
 
+    def test_decode_errors_keep_stage_order(self) -> None:
+        # A cost error is reported before (and instead of) a later-stage error.
+        payload = {"cost_price": -1, "rating": "abc", "competitor_prices": "x"}
+        with self.assertRaises(server.InputError) as ctx:
+            server.recommend(payload, self.weights)
+        self.assertEqual(ctx.exception.errors, {"cost_price": "Must be >= 0"})
+
+        decoded = server.decode_payload({"cost_price": "12.5", "stock_level": True, "rating": None})
+        self.assertEqual(decoded.values["cost_price"], 12.5)
+        self.assertEqual(decoded.values["stock_level"], 1.0)
+        self.assertIsNone(decoded.values["rating"])
+
+    def test_compiled_weights_are_immutable_and_dict_compatible(self) -> None:
+        self.assertIsInstance(self.weights, server.CompiledWeights)
+        with self.assertRaises(AttributeError):
+            self.weights.alpha = 1.0
+        self.assertEqual(self.weights["alpha"], self.weights.alpha)
+        self.assertEqual(self.weights.ceiling_factor, 1.0 + self.weights["competitive_ceiling_pct"])
+        self.assertEqual(json.loads(json.dumps(dict(self.weights)))["model_version"], self.weights.model_version)
+
+        payload = {"competitor_avg": 200.0, "cost_price": 120.0, "stock_level": 30, "sales_velocity": 12}
+        self.assertEqual(
+            server.recommend(payload, dict(self.weights), explain=True),
+            server.recommend(payload, self.weights, explain=True),
+        )
+
+    def test_recommend_many_keeps_order_and_inlines_errors(self) -> None:
+        items = [
+            {"listing_id": 1, "competitor_avg": 200.0, "cost_price": 120.0, "desired_margin": 0.2},
+            {"listing_id": 2, "competitor_avg": 200.0, "min_price": 0},
+            "not-an-object",
+            {"listing_id": 3, "cost_price": 100.0, "current_price": 150.0},
+        ]
+
+        results = server.recommend_many(items, self.weights)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0]["listing_id"], 1)
+        self.assertEqual(
+            results[0]["recommended_price"],
+            server.recommend(items[0], self.weights)["recommended_price"],
+        )
+        self.assertEqual(results[1]["listing_id"], 2)
+        self.assertIn("min_price", results[1]["error"]["errors"])
+        self.assertIn("error", results[2])
+        self.assertEqual(results[3]["listing_id"], 3)
+        self.assertIn("recommended_price", results[3])
+
+    def test_explain_fields_and_compact_format(self) -> None:
+        payload = {"competitor_avg": 200.0, "cost_price": 120.0, "stock_level": 30}
+        full = server.recommend(payload, self.weights, explain=True)
+        options = server.parse_explain(False, "min_price, ceiling,clamps")
+        selected = server.recommend(payload, self.weights, explain=options)
+        self.assertEqual(selected["explain"], {k: full["explain"][k] for k in ("min_price", "ceiling", "clamps")})
+        self.assertEqual(selected["recommended_price"], full["recommended_price"])
+
+        compact = server.recommend(payload, self.weights, explain=server.parse_explain(True, None, "compact"))
+        self.assertEqual(compact["explain"]["clamps.ceiling"], full["explain"]["clamps"]["ceiling"])
+        self.assertEqual(
+            compact["explain"]["multipliers.stock_multiplier"],
+            full["explain"]["multipliers"]["stock_multiplier"],
+        )
+        self.assertFalse(any(isinstance(v, dict) for v in compact["explain"].values()))
+        self.assertIs(server.parse_explain("1"), True)
+        with self.assertRaises(server.InputError) as ctx:
+            server.parse_explain(True, ["min_price", "nope"])
+        self.assertIn("nope", ctx.exception.errors["fields"])
+
+        # Query options, body options and per-item options all reach the result (and cache keys).
+        cache = server.ResultCache()
+        old_cache = server.Handler.result_cache
+        server.Handler.result_cache = cache
+        try:
+            server.Handler.set_weights(self.weights)
+            body = json.dumps(payload).encode()
+            by_query = json.loads(server.Handler.respond("POST", "/v1/recommend?fields=ceiling", body).body)
+            self.assertEqual(by_query["explain"], {"ceiling": full["explain"]["ceiling"]})
+            plain = json.loads(server.Handler.respond("POST", "/v1/recommend", body).body)
+            self.assertNotIn("explain", plain)
+            bad = server.Handler.respond("POST", "/v1/recommend?fields=bogus", body)
+            self.assertEqual(bad.status, 400)
+
+            batch = {"items": [payload, {**payload, "fields": ["clamps"], "explain_format": "compact"}]}
+            results = json.loads(server.Handler.respond("POST", "/v1/recommend/batch", json.dumps(batch).encode()).body)
+            self.assertNotIn("explain", results["results"][0])
+            self.assertEqual(set(results["results"][1]["explain"]), {"clamps.min_price", "clamps.ceiling"})
+        finally:
+            server.Handler.result_cache = old_cache
+
+    def test_sensitivity_matches_finite_differences(self) -> None:
+        payload = {
+            "competitor_avg": 100.0,
+            "cost_price": 40.0,
+            "desired_margin": 0.2,
+            "current_price": 95.0,
+            "demand_factor": 0.6,
+            "stock_level": 50,
+            "seasonality_factor": 1.05,
+        }
+        result = server.recommend(payload, self.weights, sensitivity=True)
+        sensitivity = result["sensitivity"]
+        self.assertIsNone(sensitivity["active_clamp"])
+        self.assertEqual(list(sensitivity["gradients"]), list(sensitivity["elasticities"]))
+        steps = {
+            "competitor_avg": 1.0,
+            "cost_price": 1.0,
+            "current_price": 1.0,
+            "demand_factor": 0.1,
+            "stock_level": 5.0,
+            "seasonality_factor": 0.02,
+        }
+        for name, step in steps.items():
+            up = server.recommend({**payload, name: payload[name] + step}, self.weights)["recommended_price"]
+            down = server.recommend({**payload, name: payload[name] - step}, self.weights)["recommended_price"]
+            # Prices are rounded to cents, so the finite difference is only good to ~0.01 / step.
+            self.assertAlmostEqual(sensitivity["gradients"][name], (up - down) / (2 * step), delta=0.01 / step)
+        self.assertAlmostEqual(
+            sensitivity["elasticities"]["competitor_avg"],
+            sensitivity["gradients"]["competitor_avg"] * 100.0 / result["recommended_price"],
+            places=3,
+        )
+
+        # Under a clamp only the clamp's inputs move the price.
+        floored = server.recommend({"competitor_avg": 100.0, "cost_price": 120.0}, self.weights, sensitivity=True)
+        self.assertEqual(floored["sensitivity"]["active_clamp"], "min_price")
+        self.assertEqual(floored["sensitivity"]["gradients"], {"competitor_avg": 0.0, "cost_price": 1.0})
+        capped = server.recommend(
+            {"competitor_avg": 100.0, "cost_price": 10.0, "current_price": 1000.0}, self.weights, sensitivity=True
+        )
+        self.assertEqual(capped["sensitivity"]["active_clamp"], "ceiling")
+        self.assertAlmostEqual(capped["sensitivity"]["gradients"]["competitor_avg"], self.weights.ceiling_factor)
+        self.assertEqual(capped["sensitivity"]["gradients"]["current_price"], 0.0)
+
+        cache = server.ResultCache()
+        old_cache = server.Handler.result_cache
+        server.Handler.result_cache = cache
+        try:
+            server.Handler.set_weights(self.weights)
+            body = json.dumps(payload).encode()
+            plain = json.loads(server.Handler.respond("POST", "/v1/recommend", body).body)
+            self.assertNotIn("sensitivity", plain)
+            by_query = json.loads(server.Handler.respond("POST", "/v1/recommend?sensitivity=1", body).body)
+            self.assertIn("sensitivity", by_query)
+            batch = {"items": [payload, {**payload, "sensitivity": True}]}
+            results = json.loads(server.Handler.respond("POST", "/v1/recommend/batch", json.dumps(batch).encode()).body)
+            self.assertNotIn("sensitivity", results["results"][0])
+            self.assertEqual(results["results"][1]["sensitivity"]["gradients"], sensitivity["gradients"])
+        finally:
+            server.Handler.result_cache = old_cache
+
+    def test_line_splitter_handles_partial_and_oversized_lines(self) -> None:
+        splitter = server.streaming.LineSplitter(max_line_bytes=8)
+        self.assertEqual(splitter.feed(b"ab\ncd"), [b"ab"])
+        self.assertEqual(splitter.feed(b"ef\n0123456789"), [b"cdef", None])
+        self.assertEqual(splitter.feed(b"xyz\nok"), [])
+        self.assertEqual(splitter.finish(), [b"ok"])
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_lru_eviction_ttl_and_stats(self) -> None:
+        now = [0.0]
+        cache = server.ResultCache(max_entries=2, ttl_seconds=10.0, clock=lambda: now[0])
+        cache.put("a", {"v": 1})
+        cache.put("b", {"v": 2})
+        self.assertEqual(cache.get("a"), {"v": 1})  # "a" becomes most recently used
+        cache.put("c", {"v": 3})  # evicts "b"
+        self.assertIsNone(cache.get("b"))
+        now[0] = 11.0
+        self.assertIsNone(cache.get("a"))  # expired
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual((stats["evictions"], stats["expirations"]), (1, 1))
+
+    def test_cached_recommend_keys_and_invalidation(self) -> None:
+        weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+        cache = server.ResultCache()
+        payload = {"competitor_avg": 200.0, "cost_price": 120.0, "desired_margin": 0.2}
+        reordered = {"desired_margin": 0.2, "cost_price": 120.0, "competitor_avg": 200.0, "listing_id": 9}
+
+        first = server.cached_recommend(payload, weights, cache=cache)
+        self.assertEqual(server.cached_recommend(reordered, weights, cache=cache), first)
+        self.assertEqual(cache.hits, 1)
+
+        explained = server.cached_recommend(payload, weights, explain=True, cache=cache)
+        self.assertIn("explain", explained)
+        self.assertEqual(cache.hits, 1)
+
+        retrained = {**weights, "model_version": "retrained", "alpha": 0.9, "beta": 0.1}
+        self.assertEqual(server.cached_recommend(payload, retrained, cache=cache)["model_version"], "retrained")
+
+        old_cache = server.Handler.result_cache
+        server.Handler.result_cache = cache
+        try:
+            server.Handler.set_weights(weights)
+            self.assertEqual(cache.stats()["size"], 0)
+        finally:
+            server.Handler.result_cache = old_cache
+
+
+    def test_single_flight_coalesces_concurrent_identical_requests(self) -> None:
+        weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+        payload = {"competitor_avg": 200.0, "cost_price": 120.0}
+        flight = server.SingleFlight()
+        release = threading.Event()
+        original = server.recommend
+
+        def slow_recommend(*args, **kwargs):
+            release.wait(5)
+            return original(*args, **kwargs)
+
+        results: list[dict] = []
+
+        def request() -> None:
+            results.append(server.cached_recommend(payload, weights, flight=flight))
+
+        server.recommend = slow_recommend
+        try:
+            threads = [threading.Thread(target=request) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            while flight.stats()["coalesced"] < 3:
+                time.sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            server.recommend = original
+        self.assertEqual(results, [original(payload, weights)] * 4)
+        self.assertEqual(len({id(result) for result in results}), 4)  # every caller gets its own dict
+        self.assertEqual(flight.stats(), {"in_flight": 0, "computed": 1, "coalesced": 3})
+
+        # Errors reach every caller; nothing is remembered once a call is over.
+        with self.assertRaises(server.InputError):
+            server.cached_recommend({"cost_price": -1}, weights, flight=flight)
+        server.cached_recommend(payload, weights, flight=flight)
+        self.assertEqual(flight.stats()["computed"], 3)
+
+
+class CompetitorStoreTest(unittest.TestCase):
+    def test_stored_prices_expire_and_survive_a_snapshot(self) -> None:
+        now = [1_000_000.0]
+        store = CompetitorStore(max_age=100.0, ring_size=4, windows=4, clock=lambda: now[0])
+        self.assertEqual(store.ingest(12, [199.0, 205.0, -1.0]), 2)
+        now[0] += 60.0
+        store.ingest("12", [198.0, 240.0, 201.0])
+        self.assertEqual(store.prices(12), [205.0, 198.0, 240.0, 201.0])  # ring keeps the last 4
+        self.assertEqual(store.summary(12)["retained_count"], 5)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "competitors.json")
+            store.save(path)
+            restored = CompetitorStore(max_age=100.0, ring_size=4, windows=4, clock=lambda: now[0])
+            self.assertEqual(restored.load(path), 1)
+        self.assertEqual(restored.prices(12), store.prices(12))
+        self.assertEqual(restored.summary(12), store.summary(12))
+
+        now[0] += 50.0  # the first observations are now older than max_age
+        self.assertEqual(store.prices(12), [198.0, 240.0, 201.0])
+        now[0] += 100.0
+        self.assertEqual(store.prices(12), [])
+        self.assertEqual(store.stats()["listings"], 0)
+
+    def test_recommend_uses_stored_average_when_payload_has_no_competitor_data(self) -> None:
+        weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+        prices = [199, 205, 198, 240, 201]
+        payload = {"listing_id": 7, "cost_price": 120.0, "desired_margin": 20, "current_price": 189.0}
+        store = CompetitorStore()
+
+        old_store = server.Handler.competitor_store
+        server.Handler.competitor_store = store
+        try:
+            ingest = {"items": [{"listing_id": 7, "prices": prices}, {"listing_id": 8}]}
+            response = server.Handler.respond("POST", "/v1/competitors/ingest", json.dumps(ingest).encode())
+            body = json.loads(response.body)
+            self.assertEqual(body["accepted"], 5)
+            self.assertEqual(body["errors"][0]["index"], 1)
+
+            response = server.Handler.respond("POST", "/v1/recommend?explain=1", json.dumps(payload).encode())
+            result = json.loads(response.body)
+            direct = server.recommend({**payload, "competitor_prices": prices}, server.Handler.weights, explain=True)
+            self.assertEqual(result["recommended_price"], direct["recommended_price"])
+            self.assertEqual(result["explain"]["competitor_method"], "stored_trimmed_mean_10pct")
+
+            # Competitor data in the payload always wins over the stored state.
+            explicit = {**payload, "competitor_avg": 150.0}
+            self.assertEqual(
+                server.recommend(explicit, weights, competitors=store),
+                server.recommend(explicit, weights),
+            )
+            summary = json.loads(server.Handler.respond("GET", "/v1/competitors/7", b"").body)
+            self.assertEqual(summary["recent_count"], 5)
+
+            # Listings without stored prices (e.g. competitor_avg: null) still use the result cache.
+            cache = server.ResultCache()
+            no_prices = {"listing_id": 9, "competitor_avg": None, "cost_price": 120.0}
+            for _ in range(2):
+                server.cached_recommend(no_prices, weights, cache=cache, competitors=store)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            lookups: list[object] = []
+            original_prices = store.prices
+            store.prices = lambda listing_id: lookups.append(listing_id) or original_prices(listing_id)
+            try:
+                self.assertEqual(
+                    server.cached_recommend(payload, weights, cache=cache, competitors=store),
+                    server.recommend({**payload, "competitor_prices": prices}, weights),
+                )
+            finally:
+                del store.prices
+            self.assertEqual((cache.hits, cache.misses), (1, 1))  # listing 7: priced from the store
+            self.assertEqual(lookups, [7])  # one snapshot, shared by the bypass check and recommend()
+
+            # A listing may be called "stats": the store counters live on their own route.
+            store.ingest("stats", [10.0])
+            summary = json.loads(server.Handler.respond("GET", "/v1/competitors/stats", b"").body)
+            self.assertEqual(summary["recent_count"], 1)
+            stats = json.loads(server.Handler.respond("GET", "/v1/competitor-store/stats", b"").body)
+            self.assertEqual((stats["enabled"], stats["listings"]), (True, 2))
+        finally:
+            server.Handler.competitor_store = old_store
+
+
+class FeatureStoreTest(unittest.TestCase):
+    def test_listing_features_replace_static_inputs_and_reload_after_swap(self) -> None:
+        weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+        listings = {
+            "A-1": {"cost_price": 120.0, "desired_margin": 20, "shipping_cost": 7.5, "platform_fee_pct": 12},
+            "A-2": {"min_price": 95.0},
+            "A-3": {"cost_price": 80.0, "min_price": 150.0, "platform_fee_pct": 0.1},
+            42: {"cost_price": 10.0},
+        }
+        market = {"competitor_avg": 180.0, "current_price": 170.0, "demand_factor": 0.4, "stock_level": 12}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "listings.bin")
+            rows = [(listing_id, server.listing_features(inputs)) for listing_id, inputs in listings.items()]
+            self.assertEqual(features.write(path, rows), 4)
+            store = features.FeatureStore(path, memo_size=2)
+            for listing_id, inputs in listings.items():
+                payload = {"listing_id": listing_id, **market}
+                for explain in (False, True):
+                    self.assertEqual(
+                        server.recommend(payload, weights, features=store, explain=explain, sensitivity=True),
+                        server.recommend({**payload, **inputs}, weights, explain=explain, sensitivity=True),
+                    )
+            self.assertIsNotNone(store.get("42"))  # ids are matched as strings
+            self.assertIsNone(store.get("A-4"))
+            # Static inputs in the payload always win over the stored ones.
+            explicit = {"listing_id": "A-1", "cost_price": 60.0, **market}
+            self.assertEqual(server.recommend(explicit, weights, features=store), server.recommend(explicit, weights))
+            with self.assertRaises(server.InputError):
+                server.recommend({"listing_id": "A-4", **market}, weights, features=store)
+            with self.assertRaises(server.InputError):
+                server.listing_features({"cost_price": -1.0})
+
+            # write() swaps the file atomically; refresh() maps the new one.
+            self.assertFalse(store.refresh())
+            features.write(path, [("A-1", server.listing_features({"cost_price": 200.0}))])
+            self.assertTrue(store.refresh())
+            self.assertEqual((len(store), store.get("A-2")), (1, None))
+            self.assertEqual(
+                server.recommend({"listing_id": "A-1", **market}, weights, features=store),
+                server.recommend({"cost_price": 200.0, **market}, weights),
+            )
+
+            old_store = server.Handler.feature_store
+            server.Handler.feature_store = store
+            try:
+                body = json.dumps({"items": [{"listing_id": "A-1", **market}, {"listing_id": "A-2", **market}]})
+                results = json.loads(server.Handler.respond("POST", "/v1/recommend/batch", body.encode()).body)
+                self.assertIn("recommended_price", results["results"][0])
+                self.assertIn("error", results["results"][1])
+                stats = json.loads(server.Handler.respond("GET", "/v1/listing-features/stats", b"").body)
+                self.assertEqual((stats["enabled"], stats["listings"], stats["reloads"]), (True, 1, 1))
+            finally:
+                server.Handler.feature_store = old_store
+
+            # Only listings with a record skip the result cache, and each is looked up once.
+            cache = server.ResultCache()
+            lookups = store.hits + store.misses
+            with self.assertRaises(server.InputError):
+                server.cached_recommend({"listing_id": "A-9", **market}, weights, cache=cache, features=store)
+            self.assertEqual((cache.misses, store.hits + store.misses), (1, lookups + 1))
+            self.assertEqual(
+                server.cached_recommend({"listing_id": "A-1", **market}, weights, cache=cache, features=store),
+                server.recommend({"cost_price": 200.0, **market}, weights),
+            )
+            self.assertEqual((cache.misses, store.hits + store.misses), (1, lookups + 2))
+
+
+class ShadowScorerTest(unittest.TestCase):
+    def test_shadow_weights_divergence_off_the_response_path(self) -> None:
+        primary = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+        candidate = server.compile_weights({**primary, "model_version": "candidate", "alpha": primary["alpha"] + 0.1})
+        payloads = [
+            {"competitor_avg": 200.0, "cost_price": 120.0},
+            {"competitor_avg": 100.0, "cost_price": 150.0},  # at the floor with both weight sets
+            {"cost_price": -1},
+        ]
+        expected = [
+            (server.recommend(p, primary)["recommended_price"], server.recommend(p, candidate)["recommended_price"])
+            for p in payloads[:2]
+        ]
+
+        # The vectorized and the scalar pairs agree with recommend().
+        pairs = server.shadow_pairs(payloads, primary, candidate)
+        original = server._vectorized
+        server._vectorized = lambda: None
+        try:
+            self.assertEqual(server.shadow_pairs(payloads, primary, candidate), pairs)
+        finally:
+            server._vectorized = original
+        self.assertEqual([(a[0], b[0]) for a, b in pairs[:2]], expected)
+        self.assertEqual(pairs[2], (None, None))
+
+        scorer = server.ShadowScorer(
+            lambda batch: server.shadow_pairs(batch, server.Handler.weights, candidate),
+            model_version="candidate",
+            queue_size=3,
+        )
+        old_scorer, old_weights = server.Handler.shadow_scorer, server.Handler.weights
+        server.Handler.shadow_scorer = scorer
+        server.Handler.weights = primary
+        try:
+            first = json.loads(server.Handler.respond("POST", "/v1/recommend", json.dumps(payloads[0]).encode()).body)
+            self.assertEqual(first["model_version"], primary.model_version)
+            batch = json.dumps({"items": payloads}).encode()
+            server.Handler.respond("POST", "/v1/recommend/batch", batch)  # one item over the queue bound
+            self.assertEqual(scorer.process_pending(), 3)
+
+            stats = json.loads(server.Handler.respond("GET", "/v1/shadow/stats", b"").body)
+            self.assertEqual((stats["offered"], stats["dropped"], stats["queued"]), (4, 1, 0))
+            self.assertEqual((stats["compared"], stats["both_errors"]), (3, 0))
+            self.assertEqual(stats["price_changed"], 2)
+            delta = expected[0][1] - expected[0][0]
+            self.assertAlmostEqual(stats["price_delta"]["max_abs"], abs(delta))
+            self.assertEqual(stats["clamp_disagreement"]["min_price"]["count"], 0)
+        finally:
+            server.Handler.shadow_scorer, server.Handler.weights = old_scorer, old_weights
+
+    def test_shadow_scores_stored_inputs_as_of_the_request(self) -> None:
+        store = CompetitorStore()
+        store.ingest(7, [199.0, 205.0, 198.0])
+        seen: list[dict] = []
+        scorer = server.ShadowScorer(lambda batch: seen.extend(batch) or [], model_version="candidate")
+        old = server.Handler.competitor_store, server.Handler.shadow_scorer
+        server.Handler.competitor_store, server.Handler.shadow_scorer = store, scorer
+        try:
+            body = json.dumps({"listing_id": 7, "cost_price": 120.0}).encode()
+            live = json.loads(server.Handler.respond("POST", "/v1/recommend", body).body)
+            store.ingest(7, [400.0, 410.0])  # lands before the shadow worker gets to the request
+            scorer.process_pending()
+        finally:
+            server.Handler.competitor_store, server.Handler.shadow_scorer = old
+        self.assertEqual(seen, [{"listing_id": 7, "cost_price": 120.0, "competitor_prices": [199.0, 205.0, 198.0]}])
+        self.assertEqual(server.recommend(seen[0], server.Handler.weights), live)
+
+    def test_shadow_worker_stays_within_cpu_budget(self) -> None:
+        def busy(batch: list[dict]) -> list[tuple[None, None]]:
+            until = time.thread_time() + 0.01
+            while time.thread_time() < until:
+                pass
+            return [(None, None)] * len(batch)
+
+        scorer = server.ShadowScorer(busy, model_version="candidate", batch_size=1, linger=0, cpu_budget=0.2)
+        scorer.offer([{}] * 100)
+        scorer.start()
+        time.sleep(0.5)
+        stats = scorer.stats()
+        # 0.5 s at 20% of a core leaves room for about 10 batches of 10 ms, not 100.
+        self.assertLess(stats["both_errors"], 20)
+        self.assertGreater(stats["throttled_seconds"], 0)
+        self.assertLessEqual(stats["cpu_seconds"], 0.2)
+
+
+class ScoreCliTest(unittest.TestCase):
+    def _run(self, *argv: str) -> None:
+        old_argv, old_stderr = sys.argv, sys.stderr
+        sys.argv, sys.stderr = ["score.py", *argv], open(os.devnull, "w")
+        try:
+            score.main()
+        finally:
+            sys.stderr.close()
+            sys.argv, sys.stderr = old_argv, old_stderr
+
+    def test_scores_csv_with_error_column_and_resume(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            data = os.path.join(tmp, "listings.csv")
+            with open(data, "w", encoding="utf-8") as f:
+                f.write("listing_id,competitor_avg,cost_price,competitor_prices\n")
+                f.write('A,200,120,\nB,,abc,\nC,,100,"199,205,198"\n')
+            out = os.path.join(tmp, "scored.jsonl")
+            self._run("--data", data, "--out", out, "--workers", "1", "--engine", "scalar")
+            with open(out, encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f]
+
+            self.assertEqual([r["row"] for r in rows], [0, 1, 2])
+            self.assertEqual([r["listing_id"] for r in rows], ["A", "B", "C"])
+            weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+            expected = server.recommend({"competitor_avg": 200.0, "cost_price": 120.0}, weights)
+            self.assertEqual(rows[0]["recommended_price"], expected["recommended_price"])
+            self.assertEqual(rows[1]["error"]["errors"], {"cost_price": "Must be a finite number"})
+            self.assertIn("recommended_price", rows[2])
+
+            # Simulate a run killed after row 0 (with a half-written line), then resume.
+            with open(out, "r+b") as f:
+                f.truncate(len(f.readline()) + 5)
+            self._run("--data", data, "--out", out, "--workers", "1", "--resume")
+            with open(out, encoding="utf-8") as f:
+                self.assertEqual([json.loads(line) for line in f], rows)
+
+    @unittest.skipIf(score.np is None, "numpy not installed")
+    def test_npz_rows_are_read_in_slices(self) -> None:
+        np = score.np
+        with tempfile.TemporaryDirectory() as tmp:
+            data = os.path.join(tmp, "listings.npz")
+            cost = np.array([120.0, np.nan, 90.0, 80.0, np.nan, 60.0, 50.0])
+            np.savez(data, listing_id=np.arange(7), cost_price=cost)
+            old_slice, score._NPZ_SLICE = score._NPZ_SLICE, 3
+            try:
+                rows = list(score.iter_rows(data))
+            finally:
+                score._NPZ_SLICE = old_slice
+        self.assertEqual([r["listing_id"] for r in rows], list(range(7)))
+        self.assertEqual([r.get("cost_price") for r in rows], [120.0, None, 90.0, 80.0, None, 60.0, 50.0])
+
+
+class TrainerTest(unittest.TestCase):
+    def test_quantile_sketch_relative_error(self) -> None:
+        values = [((i * 7919) % 1000) / 10.0 - 20.0 for i in range(5000)]
+        sketch = QuantileSketch()
+        for v in values:
+            sketch.add(v)
+        ordered = sorted(values)
+        for q in (0.0, 0.05, 0.5, 0.95, 1.0):
+            exact = train._percentile(ordered, q)
+            self.assertAlmostEqual(sketch.quantile(q), exact, delta=abs(exact) * sketch.relative_accuracy + 1e-9)
+
+    def test_sufficient_stats_match_in_memory_fit(self) -> None:
+        path = os.path.join(os.path.dirname(__file__), "sample_dataset.csv")
+        rows = [r for r in map(train._parse_row, train._load_dataset(path)) if r is not None]
+        built = train.SufficientStats()
+        xs, ys, defaults = train._build_features(rows, stats=built)
+        xs_scaled, scales = train._scale_features(xs)
+        w_scaled = train._solve_ridge(xs_scaled, ys, ridge_lambda=0.01)
+        self.assertEqual(built.to_dict(), train._fold_stats(rows).to_dict())
+        # Given the same scales (as --cv folds are), the statistics fit the same ridge problem.
+        for got, exact in zip(built.solve(0.01, scales), (w / s for w, s in zip(w_scaled, scales))):
+            self.assertAlmostEqual(got, exact, places=9)
+
+        [stats], counts = train._fit_streaming(path, val_split=0.0, seed=42, chunk_size=7)
+        self.assertEqual((counts["rows_parsed"], counts["rows_val"], stats.n), (len(rows), 0, len(xs)))
+        for got, exact in zip(stats.solve(0.01), (w / s for w, s in zip(w_scaled, scales))):
+            self.assertAlmostEqual(got, exact, delta=0.01)
+        for key, value in stats.defaults().items():
+            self.assertAlmostEqual(value, defaults[key], delta=value * 0.001)
+
+        raw = train._load_dataset(path)
+        held_out = [train._in_validation(r, 0.5, 42) for r in raw]
+        self.assertEqual(held_out, [train._in_validation(r, 0.5, 42) for r in raw])
+        self.assertTrue(any(held_out) and not all(held_out))
+
+    def test_streaming_tolerates_rows_with_extra_fields(self) -> None:
+        path = os.path.join(os.path.dirname(__file__), "sample_dataset.csv")
+        with open(path, encoding="utf-8") as f:
+            header, *lines = f.readlines()
+        with tempfile.TemporaryDirectory() as tmp:
+            ragged = os.path.join(tmp, "ragged.csv")
+            with open(ragged, "w", encoding="utf-8") as f:
+                f.writelines([header, lines[0].rstrip("\n") + ",extra,fields\n", *lines[1:]])
+            [stats], counts = train._fit_streaming(ragged, val_split=0.2, seed=42, chunk_size=7)
+            [plain], _ = train._fit_streaming(path, val_split=0.2, seed=42, chunk_size=7)
+        self.assertEqual(counts["rows_parsed"], len(lines))
+        self.assertEqual(stats.n, plain.n)
+
+    def test_cross_validation_picks_lambda_from_fold_stats(self) -> None:
+        path = os.path.join(os.path.dirname(__file__), "sample_dataset.csv")
+        fold_stats, counts = train._fit_streaming(path, val_split=0.05, seed=1, chunk_size=100, folds=3)
+        self.assertEqual(sum(s.n for s in fold_stats), counts["rows_train"])
+        sources = [train._StreamFold(path, 0.05, 1, 3, fold) for fold in range(3)]
+        self.assertEqual([len(list(src.rows())) for src in sources], [s.n for s in fold_stats])
+
+        weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+        best, report = train._cross_validate(
+            fold_stats, sources, [1e-3, 1e4], base_weights=weights, metric="mae", workers=1
+        )
+        self.assertEqual(best, min(report["path"], key=lambda e: e["mae"])["ridge_lambda"])
+        self.assertEqual(best, 1e-3)
+        self.assertEqual([len(e["folds"]) for e in report["path"]], [3, 3])
+        self.assertEqual(report["path"][0]["n"], counts["rows_train"])
+
+    def test_incremental_stats_round_trip_and_decay(self) -> None:
+        path = os.path.join(os.path.dirname(__file__), "sample_dataset.csv")
+        with open(path, encoding="utf-8") as f:
+            header, *lines = f.readlines()
+        with tempfile.TemporaryDirectory() as tmp:
+            parts = []
+            for name, chunk in (("old.csv", lines[:20]), ("new.csv", lines[20:])):
+                parts.append(os.path.join(tmp, name))
+                with open(parts[-1], "w", encoding="utf-8") as f:
+                    f.writelines([header, *chunk])
+            [full], _ = train._fit_streaming(path, val_split=0.1, seed=3, chunk_size=8)
+            [old], _ = train._fit_streaming(parts[0], val_split=0.1, seed=3, chunk_size=8)
+            [new], _ = train._fit_streaming(parts[1], val_split=0.1, seed=3, chunk_size=8)
+
+            sidecar = os.path.join(tmp, "weights.stats.json")
+            train._save_stats(sidecar, old, {"runs": 1})
+            restored, meta = train._load_stats(sidecar)
+            self.assertEqual(meta, {"runs": 1})
+            restored.merge(new)
+            self.assertEqual(restored.n, full.n)
+            for got, want in zip(restored.solve(0.01), full.solve(0.01)):
+                self.assertAlmostEqual(got, want, places=9)
+            self.assertEqual(restored.defaults(), full.defaults())
+
+            restored.decay(0.5)
+            self.assertEqual(restored.n, full.n / 2)
+            self.assertAlmostEqual(restored.xty[0], full.xty[0] / 2)
+
+    @unittest.skipIf(train.vectorized is None, "numpy not installed")
+    def test_batched_evaluation_matches_row_by_row(self) -> None:
+        path = os.path.join(os.path.dirname(__file__), "sample_dataset.csv")
+        rows = [r for r in (train._parse_row(raw, segment_field="rating") for raw in train._load_dataset(path)) if r]
+        rows.append(train.TrainingRow(payload={"competitor_avg": 100.0}, y=90.0, segment="4.0"))  # no floor: skipped
+        weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+
+        [batched] = train._evaluate(rows, [weights], by_segment=True, batch_size=16)
+        vectorized_module, train.vectorized = train.vectorized, None
+        try:
+            [scalar] = train._evaluate(rows, [weights], by_segment=True)
+        finally:
+            train.vectorized = vectorized_module
+
+        self.assertEqual(batched.n, len(rows) - 1)
+        self.assertEqual(batched.metrics(), scalar.metrics())
+        self.assertAlmostEqual(batched.pearson_r(), scalar.pearson_r(), places=9)
+        self.assertEqual(batched.calibration(10), scalar.calibration(10))
+        self.assertEqual(batched.segment_report(), scalar.segment_report())
+        self.assertEqual(sum(b["n"] for b in batched.calibration(10)), batched.n)
+
+    def test_ridge_solver_wide_and_collinear(self) -> None:
+        xs = [[((i * (j + 3)) % 17) / 4.0 + (1.0 if j == i % 8 else 0.0) for j in range(8)] for i in range(200)]
+        true_w = [0.5, -1.0, 2.0, 0.0, 3.0, -0.25, 1.5, 0.75]
+        ys = [sum(w * x for w, x in zip(true_w, row)) for row in xs]
+        a, b = train._gram(xs, ys)
+        for got, want in zip(train._cholesky_solve(a, b), true_w):
+            self.assertAlmostEqual(got, want, places=6)
+        for got, want in zip(train._solve_ridge(xs, ys, ridge_lambda=0.0), true_w):
+            self.assertAlmostEqual(got, want, places=6)
+
+        if train.np is None:
+            return
+        # A duplicated column makes X^T X singular: least-squares fallback, weight split evenly.
+        dup = [row + [row[0]] for row in xs]
+        w = train._solve_ridge(dup, ys, ridge_lambda=0.0)
+        self.assertAlmostEqual(w[0], w[-1], places=6)
+        self.assertAlmostEqual(w[0] + w[-1], true_w[0], places=6)
+
+
+class HttpServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        server.Handler.weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+        server.Handler.log_message = lambda *args: None  # keep test output quiet
+        sock = server.prefork.bind_socket("127.0.0.1", 0)
+        cls.httpd = server._make_server("127.0.0.1", 0, sock=sock)
+        cls.base_url = f"http://127.0.0.1:{cls.httpd.server_port}"
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def _request(self, path: str, body: object | None = None) -> tuple[int, dict]:
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        req = urllib.request.Request(self.base_url + path, data=data, method="GET" if data is None else "POST")
+        try:
+            with urllib.request.urlopen(req, timeout=5) as res:
+                return res.status, json.loads(res.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_health_on_inherited_socket(self) -> None:
+        self.assertEqual(self._request("/health"), (200, {"status": "ok"}))
+
+    def test_batch_rejects_oversized_batches(self) -> None:
+        status, body = self._request("/v1/recommend/batch", [{}] * (server.Handler.max_batch_size + 1))
+        self.assertEqual(status, 413)
+        self.assertIn("items", body["errors"])
+
+    def test_metrics_reports_routes_stages_and_input_errors(self) -> None:
+        self._request("/v1/recommend", {"competitor_avg": 200.0, "cost_price": 120.0})
+        self._request("/v1/recommend", {"competitor_avg": 200.0, "min_price": 0})
+        with urllib.request.urlopen(self.base_url + "/metrics", timeout=5) as res:
+            self.assertTrue(res.headers["Content-Type"].startswith("text/plain"))
+            text = res.read().decode("utf-8")
+
+        self.assertRegex(text, r'price_engine_requests_total\{route="/v1/recommend",status="200"\} [1-9]')
+        self.assertRegex(text, r'price_engine_requests_total\{route="/v1/recommend",status="400"\} [1-9]')
+        self.assertRegex(text, r'price_engine_input_errors_total\{field="min_price"\} [1-9]')
+        for stage in ("body_read", "json_decode", "min_price", "competitor", "formula", "serialize"):
+            self.assertRegex(text, rf'price_engine_stage_duration_seconds_count\{{stage="{stage}"\}} [1-9]')
+        self.assertIn('le="+Inf"', text)
+        self.assertIn("price_engine_in_flight_requests 1", text)
+        self.assertIn(f'price_engine_model_info{{model_version="{server.Handler.weights.model_version}"}} 1', text)
+
+    def test_stage_sampling_decides_once_per_request(self) -> None:
+        old_metrics = server.Handler.request_metrics
+        server.Handler.request_metrics = recorder = server.metrics.Metrics(stage_sample_every=2)
+        try:
+            for _ in range(5):
+                self._request("/v1/recommend", {"competitor_avg": 200.0, "cost_price": 120.0})
+            self._request("/v1/listing-features/stats")
+        finally:
+            server.Handler.request_metrics = old_metrics
+        # Requests 0, 2 and 4 are timed, all of their stages including the body read and the write.
+        counts = {stage: recorder.stage_seconds[stage].count for stage in ("body_read", "json_decode", "write")}
+        self.assertEqual(counts, {"body_read": 3, "json_decode": 3, "write": 3})
+        self.assertIn(("/v1/listing-features/stats", 200), recorder.requests)
+
+    def test_stream_accepts_chunked_ndjson(self) -> None:
+        lines = [
+            b'{"listing_id": 1, "competitor_avg": 200.0, "cost_price": 120.0}\n',
+            b"\nnot json\n",
+            b'{"listing_id": 2, "competitor_avg": 200.0, "min_price": 0}\n{"listing_id": 3, ',
+            b'"cost_price": 100.0, "current_price": 150.0}',
+        ]
+        conn = http.client.HTTPConnection("127.0.0.1", self.httpd.server_port, timeout=5)
+        conn.request("POST", "/v1/recommend/stream", body=iter(lines), encode_chunked=True)
+        res = conn.getresponse()
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.getheader("Transfer-Encoding"), "chunked")
+        results = [json.loads(line) for line in res.read().splitlines()]
+        conn.close()
+
+        self.assertEqual([r.get("listing_id") for r in results], [1, None, 2, 3])
+        self.assertEqual(results[0], server.recommend(json.loads(lines[0]), server.Handler.weights) | {"listing_id": 1})
+        self.assertEqual(results[1], {"line": 3, "error": {"message": "Invalid JSON", "errors": {}}})
+        self.assertEqual(results[2]["line"], 4)
+        self.assertIn("min_price", results[2]["error"]["errors"])
+        self.assertIn("recommended_price", results[3])
+
+
+class AdmissionControlTest(unittest.TestCase):
+    def _wait_for(self, httpd, key: str, value: int) -> None:
+        deadline = time.monotonic() + 5
+        while httpd.stats()[key] != value:
+            self.assertLess(time.monotonic(), deadline, f"{key} never reached {value}")
+            time.sleep(0.001)
+
+    def _connect(self, httpd, request: bytes):
+        import socket
+
+        conn = socket.create_connection(("127.0.0.1", httpd.server_port), timeout=5)
+        conn.sendall(request)
+        return conn
+
+    def _response(self, conn) -> bytes:
+        chunks = []
+        while chunk := conn.recv(65536):
+            chunks.append(chunk)
+        conn.close()
+        return b"".join(chunks)
+
+    def test_bounded_pool_rejects_sheds_and_limits_clients(self) -> None:
+        server.Handler.log_message = lambda *args: None
+        httpd = server._make_server("127.0.0.1", 0, threads=1, queue_depth=1)
+        self.assertIsInstance(httpd, server.admission.PooledHTTPServer)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        try:
+            # Hold the only worker with a stream whose body never ends, then fill the queue.
+            busy = self._connect(
+                httpd, b"POST /v1/recommend/stream HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+            )
+            self._wait_for(httpd, "active", 1)
+            queued = self._connect(httpd, b"GET /health HTTP/1.0\r\n\r\n")
+            self._wait_for(httpd, "queued", 1)
+
+            overflow = self._response(self._connect(httpd, b"GET /health HTTP/1.0\r\n\r\n"))
+            self.assertTrue(overflow.startswith(b"HTTP/1.0 503"))
+            self.assertIn(b"Retry-After: 1\r\n", overflow)
+            httpd.max_per_client = 2
+            limited = self._response(self._connect(httpd, b"GET /health HTTP/1.0\r\n\r\n"))
+            self.assertTrue(limited.startswith(b"HTTP/1.0 429"))
+
+            busy.sendall(b"0\r\n\r\n")
+            self.assertIn(b" 200 ", self._response(busy).split(b"\r\n")[0])
+            self.assertTrue(self._response(queued).endswith(b'{"status":"ok"}'))
+
+            # A caller whose budget is already spent gets 503 without being scored.
+            late = self._connect(
+                httpd,
+                b"POST /v1/recommend HTTP/1.0\r\nX-Request-Timeout: 0\r\nContent-Length: 2\r\n\r\n{}",
+            )
+            self.assertTrue(self._response(late).startswith(b"HTTP/1.0 503"))
+            stats = httpd.stats()
+            self.assertEqual(
+                (stats["rejected_queue_full"], stats["rejected_client_limit"], stats["shed_deadline"]), (1, 1, 1)
+            )
+            self._wait_for(httpd, "served", 3)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def test_idle_connections_neither_hold_workers_nor_queued_requests(self) -> None:
+        server.Handler.log_message = lambda *args: None
+        old_timeout = server.Handler.timeout
+        server.Handler.timeout = 0.3
+        httpd = server._make_server("127.0.0.1", 0, threads=2, queue_depth=8, max_queue_wait=0.2)
+        threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        try:
+            idle = [self._connect(httpd, b"") for _ in range(6)]
+            self._wait_for(httpd, "queued", 4)  # two more are waiting in the workers
+            # Queued behind busy workers: answered by the accept thread once the wait is over.
+            self.assertTrue(self._response(idle[-1]).startswith(b"HTTP/1.0 503"))
+            self.assertGreaterEqual(httpd.stats()["shed_queue_wait"], 1)
+
+            # Idle clients time out and free their workers, so /health gets through.
+            started = time.monotonic()
+            health = self._response(self._connect(httpd, b"GET /health HTTP/1.0\r\n\r\n"))
+            self.assertTrue(health.endswith(b'{"status":"ok"}'))
+            self.assertLess(time.monotonic() - started, 3)
+            self.assertEqual(httpd.stats()["shed_idle"], 2)
+            for conn in idle[:-1]:
+                conn.close()
+        finally:
+            server.Handler.timeout = old_timeout
+            httpd.shutdown()
+            httpd.server_close()
+
+
+class AsyncBackendTest(unittest.TestCase):
+    def test_keep_alive_and_pipelining(self) -> None:
+        server.Handler.weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+        body = json.dumps({"competitor_avg": 200.0, "min_price": 0}).encode("utf-8")
+        pipelined = (
+            b"GET /health HTTP/1.1\r\nHost: x\r\n\r\n"
+            + b"POST /v1/recommend HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n" % len(body)
+            + body
+            + b"GET /v1/weights HTTP/1.1\r\nConnection: close\r\n\r\n"
+        )
+
+        async def scenario() -> bytes:
+            http = server.aioserver.AsyncHTTPServer(server.Handler.respond)
+            sock = server.prefork.bind_socket("127.0.0.1", 0)
+            port = sock.getsockname()[1]
+            task = asyncio.ensure_future(http.serve("127.0.0.1", port, sock=sock))
+            await asyncio.sleep(0.05)
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(pipelined)
+            data = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            task.cancel()
+            return data
+
+        data = asyncio.run(scenario()).decode("utf-8")
+        self.assertEqual(data.count("HTTP/1.1 "), 3)
+        self.assertLess(data.index("200 OK"), data.index("400 Bad Request"))
+        self.assertIn("Connection: keep-alive", data)
+        self.assertIn('"weights"', data)
+        self.assertIn("Connection: close", data)
+
+    def test_app_errors_become_500_responses(self) -> None:
+        def app(method: str, target: str, body: bytes) -> server.Response:
+            raise RuntimeError("boom")
+
+        async def scenario() -> bytes:
+            http = server.aioserver.AsyncHTTPServer(app)
+            sock = server.prefork.bind_socket("127.0.0.1", 0)
+            port = sock.getsockname()[1]
+            task = asyncio.ensure_future(http.serve("127.0.0.1", port, sock=sock))
+            await asyncio.sleep(0.05)
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /health HTTP/1.1\r\nHost: x\r\n\r\n")
+            data = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            task.cancel()
+            return data
+
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            data = asyncio.run(scenario())
+        self.assertTrue(data.startswith(b"HTTP/1.1 500 "))
+        self.assertIn("RuntimeError: boom", stderr.getvalue())
+
+
+@unittest.skipIf(vectorized is None, "numpy not installed")
+class VectorizedEngineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+
+    def test_recommend_batch_matches_scalar_path(self) -> None:
+        payloads = [
+            {
+                "competitor_prices": [199, 205, 198, 240, 9999],
+                "cost_price": 120.0,
+                "shipping_cost": 10.0,
+                "platform_fee_pct": 5,
+                "desired_margin": 20,
+                "current_price": 189.0,
+                "demand_factor": 0.6,
+                "sales_velocity": 12,
+                "stock_level": 30,
+                "rating": 4.6,
+                "promo_factor": 10,
+                "seasonality_factor": 1.05,
+            },
+            {"competitor_avg": 200.0, "cost_price": 190.0, "desired_margin": 0.3},
+            {"competitor_avg": 150.0, "min_price": 100.0, "current_price": 500.0, "demand_factor": 80},
+            {"cost_price": 100.0, "desired_margin": 0.2, "current_price": 150.0, "stock_level": 900},
+            {"cost_price": 100.0, "desired_margin": 0.2},
+            {"competitor_avg": 200.0, "min_price": 0},
+            {"competitor_avg": 200.0, "cost_price": -1, "desired_margin": -2},
+            {"competitor_avg": "abc", "cost_price": 100.0},
+            {"competitor_prices": [0, None], "cost_price": 100.0},
+            {"competitor_avg": 200.0},
+        ]
+
+        batch = vectorized.recommend_batch(vectorized.columns_from_payloads(payloads), self.weights)
+        self.assertEqual(batch.to_results(), server.recommend_many(payloads, self.weights))
+        self.assertEqual(sorted(batch.errors), [5, 6, 7, 8, 9])
+
+        explain = server.recommend(payloads[1], self.weights, explain=True)["explain"]
+        self.assertEqual(bool(batch.clamp_ceiling[1]), explain["clamps"]["ceiling"])
+        self.assertEqual(round(float(batch.min_price[1]), 6), explain["min_price"])
+
+    def test_round_half_even_matches_python_round(self) -> None:
+        values = np.array([0.125, 2.675, 1.005, 123.455, 0.0, 1e300, -3.14159])
+        expected = [round(float(v), 2) for v in values]
+        self.assertEqual(vectorized.round_half_even(values, 2).tolist(), expected)
+
+    def test_simulate_grid_matches_scalar_recommend(self) -> None:
+        base = {"competitor_prices": [199, 205, 198, 240, 201], "cost_price": 120.0, "current_price": 189.0}
+        axes = server.parse_axes(
+            {
+                "competitor_avg": {"start": 100, "stop": 300, "num": 5},
+                "promo_factor": [0.8, 1.0, 10],
+                "stock_level": [0, 500],
+            }
+        )
+        grid = server.simulate(base, axes, self.weights)
+        self.assertEqual(grid["shape"], [5, 3, 2])
+        self.assertEqual(grid["axes"][0]["values"], [100.0, 150.0, 200.0, 250.0, 300.0])
+        for i, avg in enumerate(grid["axes"][0]["values"]):
+            cell = {"competitor_avg": avg, "promo_factor": 10, "stock_level": 500}
+            expected = server.recommend({"cost_price": 120.0, "current_price": 189.0, **cell}, self.weights)
+            self.assertEqual(grid["recommended_price"][i][2][1], expected["recommended_price"])
+            self.assertEqual(grid["confidence"][i][2][1], expected["confidence"])
+
+        # The scalar fallback (no numpy) produces the same grid.
+        original = server._vectorized
+        server._vectorized = lambda: None
+        try:
+            self.assertEqual(server.simulate(base, axes, self.weights), grid)
+        finally:
+            server._vectorized = original
+
+        bad = server.simulate({"min_price": 0}, server.parse_axes({"demand_factor": [0.1, 0.9]}), self.weights)
+        self.assertEqual((bad["recommended_price"], bad["error_count"]), ([None, None], 2))
+        with self.assertRaises(server.InputError) as ctx:
+            server.parse_axes({"listing_id": [1], "demand_factor": "high"})
+        self.assertEqual(set(ctx.exception.errors), {"listing_id", "demand_factor"})
+        too_big = {"demand_factor": {"start": 0, "stop": 1, "num": 1000}, "rating": [1] * 1000}
+        body = json.dumps({"payload": base, "axes": too_big}).encode()
+        self.assertEqual(server.Handler.respond("POST", "/v1/simulate", body).status, 413)
+
+        # Errors raised while simulating are answered like /v1/recommend's, never dropped.
+        body = json.dumps({"payload": base, "axes": {"demand_factor": [0.5]}}).encode()
+        original = server.simulate
+        try:
+            for error, status in ((server.InputError("Invalid inputs", {"x": "bad"}), 400), (ValueError(), 500)):
+
+                def failing(*args, error=error, **kwargs):
+                    raise error
+
+                server.simulate = failing
+                self.assertEqual(server.Handler.respond("POST", "/v1/simulate", body).status, status)
+        finally:
+            server.simulate = original
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -3,20 +3,38 @@ from __future__ import annotations
 import argparse
 import csv
 import datetime as dt
+import hashlib
+import itertools
 import json
 import math
+import multiprocessing
 import os
 import random
+from collections.abc import Iterable, Iterator, Mapping
 from dataclasses import dataclass
 from typing import Any
 
+import codec
 import server
+from sketch import QuantileSketch
+
+try:
+    import numpy as np
+
+    import vectorized
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+    vectorized = None
+
+# Distinct --calibration-segment values reported separately; the rest share "(other)".
+MAX_CALIBRATION_SEGMENTS = 50
 
 
 @dataclass(frozen=True)
 class TrainingRow:
     payload: dict[str, Any]
     y: float
+    segment: str | None = None  # value of --calibration-segment, for per-segment calibration
 
 
 def _percentile(sorted_values: list[float], q: float) -> float:
@@ -27,68 +45,341 @@ def _percentile(sorted_values: list[float], q: float) -> float:
     return sorted_values[idx]
 
 
-def _pearson_r(xs: list[float], ys: list[float]) -> float | None:
-    if len(xs) != len(ys) or len(xs) < 2:
-        return None
-    mx = sum(xs) / len(xs)
-    my = sum(ys) / len(ys)
-    num = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
-    denx = math.sqrt(sum((x - mx) ** 2 for x in xs))
-    deny = math.sqrt(sum((y - my) ** 2 for y in ys))
-    if denx == 0 or deny == 0:
-        return None
-    return num / (denx * deny)
+def _quantile(values: list[float], q: float) -> float:
+    """
+    _percentile of unsorted values: the same nearest-rank element, found by selection
+    (np.partition, linear time) for long inputs when numpy is available.
+    """
+    if not values:
+        raise ValueError("Empty list")
+    q = max(0.0, min(1.0, q))
+    idx = int(round(q * (len(values) - 1)))
+    if np is not None and len(values) >= server.SELECT_MIN_SIZE:
+        return float(np.partition(np.asarray(values, dtype=np.float64), idx)[idx])
+    return sorted(values)[idx]
 
 
-def _mae(y_true: list[float], y_pred: list[float]) -> float:
-    return sum(abs(a - b) for a, b in zip(y_true, y_pred)) / max(1, len(y_true))
+class ValidationStats:
+    """
+    Running validation metrics (MAE, RMSE, MAPE, Pearson r of confidence vs absolute
+    error and confidence calibration buckets) in constant memory.
+
+    Rows come one at a time (add) or as numpy batches (add_batch). Calibration buckets
+    (quartiles, deciles, ...) are cut from per-confidence totals: confidence is rounded to
+    4 decimals, so there are at most 10,001 of them, and any number of buckets costs the
+    same. A tie group split across a cut contributes its average error to both sides.
+    With by_segment=True, rows carrying a segment are also tracked per segment.
+    """
 
+    def __init__(self, *, by_segment: bool = False) -> None:
+        self.n = 0
+        self.abs_error_sum = 0.0
+        self.sq_error_sum = 0.0
+        self.ape_sum = 0.0
+        self.ape_n = 0
+        # Running means and co-moments of (confidence, absolute error).
+        self._mean_conf = 0.0
+        self._mean_err = 0.0
+        self._m2_conf = 0.0
+        self._m2_err = 0.0
+        self._co_moment = 0.0
+        self.by_confidence: dict[float, list[float]] = {}  # confidence -> [n, abs error sum]
+        self.segments: dict[str, ValidationStats] | None = {} if by_segment else None
+
+    def _segment(self, name: str) -> ValidationStats:
+        assert self.segments is not None
+        stats = self.segments.get(name)
+        if stats is None:
+            if len(self.segments) >= MAX_CALIBRATION_SEGMENTS:
+                name = "(other)"
+                stats = self.segments.get(name)
+            if stats is None:
+                stats = self.segments[name] = ValidationStats()
+        return stats
+
+    def add(self, y_true: float, y_pred: float, confidence: float, segment: str | None = None) -> None:
+        err = abs(y_pred - y_true)
+        self.n += 1
+        self.abs_error_sum += err
+        self.sq_error_sum += err * err
+        if y_true != 0:
+            self.ape_sum += err / abs(y_true)
+            self.ape_n += 1
+
+        # Welford update.
+        d_conf = confidence - self._mean_conf
+        self._mean_conf += d_conf / self.n
+        d_err = err - self._mean_err
+        self._mean_err += d_err / self.n
+        self._m2_conf += d_conf * (confidence - self._mean_conf)
+        self._m2_err += d_err * (err - self._mean_err)
+        self._co_moment += d_conf * (err - self._mean_err)
+
+        group = self.by_confidence.get(confidence)
+        if group is None:
+            self.by_confidence[confidence] = [1, err]
+        else:
+            group[0] += 1
+            group[1] += err
+
+        if self.segments is not None and segment is not None:
+            self._segment(segment).add(y_true, y_pred, confidence)
+
+    def add_batch(
+        self,
+        y_true: np.ndarray,
+        y_pred: np.ndarray,
+        confidence: np.ndarray,
+        segments: np.ndarray | None = None,
+    ) -> None:
+        """add() for whole numpy arrays (finite values only), with array operations."""
+        m = int(y_true.shape[0])
+        if m == 0:
+            return
+        err = np.abs(y_pred - y_true)
+        self.abs_error_sum += float(err.sum())
+        self.sq_error_sum += float(err @ err)
+        nonzero = y_true != 0
+        self.ape_sum += float((err[nonzero] / np.abs(y_true[nonzero])).sum())
+        self.ape_n += int(nonzero.sum())
+
+        # Combine the batch's co-moments with the running ones (Chan et al.).
+        mean_conf = float(confidence.mean())
+        mean_err = float(err.mean())
+        d_conf = confidence - mean_conf
+        d_err = err - mean_err
+        n_before = self.n
+        n = n_before + m
+        delta_conf = mean_conf - self._mean_conf
+        delta_err = mean_err - self._mean_err
+        weight = n_before * m / n
+        self._m2_conf += float(d_conf @ d_conf) + delta_conf * delta_conf * weight
+        self._m2_err += float(d_err @ d_err) + delta_err * delta_err * weight
+        self._co_moment += float(d_conf @ d_err) + delta_conf * delta_err * weight
+        self._mean_conf += delta_conf * m / n
+        self._mean_err += delta_err * m / n
+        self.n = n
+
+        values, inverse, counts = np.unique(confidence, return_inverse=True, return_counts=True)
+        err_sums = np.bincount(inverse, weights=err)
+        for value, count, err_sum in zip(values.tolist(), counts.tolist(), err_sums.tolist()):
+            group = self.by_confidence.get(value)
+            if group is None:
+                self.by_confidence[value] = [count, err_sum]
+            else:
+                group[0] += count
+                group[1] += err_sum
+
+        if self.segments is not None and segments is not None:
+            names, inverse = np.unique(segments, return_inverse=True)
+            for i, name in enumerate(names.tolist()):
+                mask = inverse == i
+                self._segment(name).add_batch(y_true[mask], y_pred[mask], confidence[mask])
+
+    def metrics(self) -> dict[str, float]:
+        n = max(1, self.n)
+        return {
+            "mae": round(self.abs_error_sum / n, 6),
+            "rmse": round(math.sqrt(self.sq_error_sum / n), 6),
+            "mape": round(self.ape_sum / max(1, self.ape_n), 6),
+        }
 
-def _rmse(y_true: list[float], y_pred: list[float]) -> float:
-    return math.sqrt(
-        sum((a - b) ** 2 for a, b in zip(y_true, y_pred)) / max(1, len(y_true))
-    )
+    def pearson_r(self) -> float | None:
+        # Variances this small are rounding noise around a constant column.
+        if self.n < 2 or self._m2_conf / self.n < 1e-12 or self._m2_err / self.n < 1e-12:
+            return None
+        return self._co_moment / math.sqrt(self._m2_conf * self._m2_err)
+
+    def calibration(self, buckets: int = 4) -> list[dict[str, Any]]:
+        """Equal-count confidence buckets (4 = quartiles, 10 = deciles), lowest confidence first."""
+        if not self.n:
+            return []
+        q = max(1, self.n // buckets)
+        cuts = [q * (i + 1) for i in range(buckets - 1)] + [self.n]
+        last = buckets - 1
+        acc = [[0, 0.0, 0.0] for _ in range(buckets)]  # n, confidence sum, abs error sum
+        pos = 0
+        bucket = 0
+        for confidence, (count, err_sum) in sorted(self.by_confidence.items()):
+            remaining = int(count)
+            while remaining:
+                while bucket < last and pos >= cuts[bucket]:
+                    bucket += 1
+                take = remaining if bucket == last else min(remaining, cuts[bucket] - pos)
+                acc[bucket][0] += take
+                acc[bucket][1] += confidence * take
+                acc[bucket][2] += err_sum * take / count
+                pos += take
+                remaining -= take
+        return [
+            {"avg_confidence": round(c / n, 4), "mae": round(e / n, 6), "n": n}
+            for n, c, e in acc
+            if n
+        ]
+
+    def segment_report(self) -> dict[str, dict[str, Any]]:
+        """Metrics and confidence quartiles per segment (by_segment=True only)."""
+        return {
+            name: {"n": stats.n, **stats.metrics(), "quartiles": stats.calibration(4)}
+            for name, stats in sorted((self.segments or {}).items())
+        }
 
 
-def _mape(y_true: list[float], y_pred: list[float]) -> float:
-    parts = []
-    for a, b in zip(y_true, y_pred):
-        if a == 0:
-            continue
-        parts.append(abs(a - b) / abs(a))
-    return sum(parts) / max(1, len(parts))
+def _evaluate(
+    rows: Iterable[TrainingRow],
+    weight_sets: list[Mapping[str, Any]],
+    *,
+    by_segment: bool = False,
+    batch_size: int = 10_000,
+) -> list[ValidationStats]:
+    """
+    Score rows under each weight set with the deployed formula (clamps + confidence)
+    and accumulate one ValidationStats per weight set. With numpy, every batch of rows
+    is decoded into columns once and scored by vectorized.recommend_batch (identical to
+    recommend()) for each weight set; otherwise recommend() runs row by row.
+    Rows that fail validation are skipped.
+    """
+    compiled = [server.compile_weights(w) for w in weight_sets]
+    evaluations = [ValidationStats(by_segment=by_segment) for _ in compiled]
+
+    if vectorized is None:
+        for tr in rows:
+            for weights, evaluation in zip(compiled, evaluations):
+                try:
+                    res = server.recommend(tr.payload, weights, explain=False)
+                except server.InputError:
+                    continue
+                evaluation.add(
+                    tr.y, float(res["recommended_price"]), float(res["confidence"]), tr.segment or "(missing)"
+                )
+        return evaluations
+
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, max(1, batch_size)))
+        if not batch:
+            break
+        columns = vectorized.columns_from_payloads(tr.payload for tr in batch)
+        y_true = np.fromiter((tr.y for tr in batch), dtype=np.float64, count=len(batch))
+        segments = np.array([tr.segment or "(missing)" for tr in batch]) if by_segment else None
+        for weights, evaluation in zip(compiled, evaluations):
+            result = vectorized.recommend_batch(columns, weights)
+            ok = np.isfinite(result.recommended_price)
+            evaluation.add_batch(
+                y_true[ok],
+                result.recommended_price[ok],
+                result.confidence[ok],
+                None if segments is None else segments[ok],
+            )
+    return evaluations
+
+
+# Cholesky pivots below this fraction of the largest one mean cond(A) beyond ~1e12.
+_CHOLESKY_MIN_PIVOT_RATIO = 1e-6
 
 
 def _solve_ridge(
-    x_rows: list[list[float]],
-    y: list[float],
+    x_rows: list[list[float]] | np.ndarray,
+    y: list[float] | np.ndarray,
     *,
     ridge_lambda: float,
 ) -> list[float]:
     """
-    Solve (X^T X + λI) w = X^T y with a small, pure-Python Gaussian elimination.
-    x_rows is n x p.
+    Solve (X^T X + λI) w = X^T y. x_rows is n x p, for any number of features p.
+    With numpy the Gram matrix is a BLAS matrix product; see _solve_spd for the solve.
     """
-    if not x_rows:
+    if len(x_rows) == 0:
         raise ValueError("No training rows")
     p = len(x_rows[0])
     if p == 0:
         raise ValueError("No features")
 
-    # A = X^T X
+    a, b = _gram(x_rows, y)
+    for i in range(p):
+        a[i][i] += ridge_lambda
+    return _solve_spd(a, b)
+
+
+def _gram(
+    x_rows: list[list[float]] | np.ndarray,
+    y: list[float] | np.ndarray,
+) -> tuple[list[list[float]], list[float]]:
+    """X^T X and X^T y."""
+    if np is not None:
+        x = np.asarray(x_rows, dtype=np.float64)
+        yv = np.asarray(y, dtype=np.float64)
+        return (x.T @ x).tolist(), (x.T @ yv).tolist()
+
+    p = len(x_rows[0])
     a = [[0.0 for _ in range(p)] for __ in range(p)]
-    b = [0.0 for _ in range(p)]  # X^T y
+    b = [0.0 for _ in range(p)]
 
     for row, yi in zip(x_rows, y):
         for i in range(p):
             b[i] += row[i] * yi
             for j in range(p):
                 a[i][j] += row[i] * row[j]
+    return a, b
+
 
+def _solve_spd(a: list[list[float]], b: list[float]) -> list[float]:
+    """
+    Solve A w = b for the symmetric positive semi-definite A of the normal equations.
+
+    Cholesky (A = L L^T, two triangular solves) when A is positive definite and
+    reasonably conditioned. Otherwise numpy falls back to an SVD least-squares solve
+    (minimum-norm w), and the pure-Python path to Gaussian elimination with pivoting.
+    """
+    if np is not None:
+        am = np.asarray(a, dtype=np.float64)
+        bv = np.asarray(b, dtype=np.float64)
+        try:
+            lower = np.linalg.cholesky(am)
+        except np.linalg.LinAlgError:
+            lower = None
+        if lower is not None:
+            pivots = np.diag(lower)
+            if pivots.min() > _CHOLESKY_MIN_PIVOT_RATIO * pivots.max():
+                z = np.linalg.solve(lower, bv)
+                return np.linalg.solve(lower.T, z).tolist()
+        w, *_ = np.linalg.lstsq(am, bv, rcond=None)
+        return w.tolist()
+
+    w = _cholesky_solve(a, b)
+    return w if w is not None else _solve_linear(a, b)
+
+
+def _cholesky_solve(a: list[list[float]], b: list[float]) -> list[float] | None:
+    """Pure-Python Cholesky solve; None if A is not (numerically) positive definite."""
+    p = len(b)
+    lower = [[0.0] * p for _ in range(p)]
     for i in range(p):
-        a[i][i] += ridge_lambda
+        for j in range(i + 1):
+            acc = a[i][j] - sum(lower[i][k] * lower[j][k] for k in range(j))
+            if i == j:
+                if acc <= 0.0:
+                    return None
+                lower[i][i] = math.sqrt(acc)
+            else:
+                lower[i][j] = acc / lower[j][j]
+
+    pivots = [lower[i][i] for i in range(p)]
+    if min(pivots) <= _CHOLESKY_MIN_PIVOT_RATIO * max(pivots):
+        return None
+
+    # L z = b, then L^T w = z.
+    z = [0.0] * p
+    for i in range(p):
+        z[i] = (b[i] - sum(lower[i][k] * z[k] for k in range(i))) / lower[i][i]
+    w = [0.0] * p
+    for i in reversed(range(p)):
+        w[i] = (z[i] - sum(lower[k][i] * w[k] for k in range(i + 1, p))) / lower[i][i]
+    return w
+
 
-    # Solve A w = b via Gaussian elimination with partial pivoting.
+def _solve_linear(a: list[list[float]], b: list[float]) -> list[float]:
+    """Solve A w = b via Gaussian elimination with partial pivoting."""
+    p = len(b)
     aug = [a[i] + [b[i]] for i in range(p)]
 
     for col in range(p):
@@ -132,49 +423,73 @@ def _load_dataset(path: str) -> list[dict[str, Any]]:
             reader = csv.DictReader(f)
             return [dict(r) for r in reader]
 
-    raise ValueError("Unsupported dataset format (use .csv or .json)")
+    if ext in (".jsonl", ".ndjson"):
+        return list(_iter_dataset(path))
 
+    raise ValueError("Unsupported dataset format (use .csv, .json or .jsonl)")
 
-def _parse_row(row: dict[str, Any]) -> TrainingRow | None:
-    """
-    Create a payload compatible with server.recommend + extract label.
 
-    Required:
-    - actual_best_price
-    - competitor_avg OR competitor_prices (list)
-    - cost_price (>0) OR min_price (>0)
+def _iter_dataset(path: str) -> Iterator[dict[str, Any]]:
     """
-    y = server._to_float(row.get("actual_best_price") or row.get("label") or row.get("y"))
-    if y is None or y <= 0:
-        return None
+    Stream dataset rows without holding the file in memory (.csv and .jsonl/.ndjson).
+    A .json document has to be parsed whole, so it is loaded with _load_dataset.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+    elif ext in (".jsonl", ".ndjson"):
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = codec.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                if isinstance(row, dict):
+                    yield row
+    else:
+        yield from _load_dataset(path)
+
+
+# Dataset columns copied into the recommend() payload as numbers.
+PAYLOAD_NUMERIC_FIELDS: tuple[str, ...] = (
+    "competitor_avg",
+    "cost_price",
+    "desired_margin",
+    "demand_factor",
+    "current_price",
+    "min_price",
+    "shipping_cost",
+    "platform_fee_pct",
+    "sales_velocity",
+    "stock_level",
+    "rating",
+    "promo_factor",
+    "seasonality_factor",
+    "market_sample_size",
+)
+
+
+def payload_from_row(row: dict[str, Any], *, keep_invalid: bool = False) -> dict[str, Any]:
+    """
+    Map a dataset row (CSV strings or JSON values) to a server.recommend payload.
 
+    Blank cells count as missing. Unparseable numbers are dropped, or kept as-is with
+    keep_invalid=True so that recommend() reports them (used by score.py and features.py).
+    """
     payload: dict[str, Any] = {}
 
-    def put_num(key: str, value: Any) -> None:
-        if key not in row or value is None or value == "":
-            return
+    for key in PAYLOAD_NUMERIC_FIELDS:
+        value = row.get(key)
+        if value is None or value == "":
+            continue
         f = server._to_float(value)
-        if f is None:
-            return
-        payload[key] = f
-
-    for k in (
-        "competitor_avg",
-        "cost_price",
-        "desired_margin",
-        "demand_factor",
-        "current_price",
-        "min_price",
-        "shipping_cost",
-        "platform_fee_pct",
-        "sales_velocity",
-        "stock_level",
-        "rating",
-        "promo_factor",
-        "seasonality_factor",
-        "market_sample_size",
-    ):
-        put_num(k, row.get(k))
+        if f is not None:
+            payload[key] = f
+        elif keep_invalid:
+            payload[key] = value
 
     # competitor_prices supports: JSON list string, comma-separated list, or list (JSON dataset).
     comp_prices = row.get("competitor_prices")
@@ -192,6 +507,27 @@ def _parse_row(row: dict[str, Any]) -> TrainingRow | None:
             parts = [p.strip() for p in s.split(",") if p.strip()]
             parsed_list = parts
         payload["competitor_prices"] = parsed_list
+    elif keep_invalid and comp_prices is not None and comp_prices != "":
+        payload["competitor_prices"] = comp_prices
+
+    return payload
+
+
+def _parse_row(row: dict[str, Any], *, segment_field: str | None = None) -> TrainingRow | None:
+    """
+    Create a payload compatible with server.recommend + extract label (and the
+    segment_field value, if given).
+
+    Required:
+    - actual_best_price
+    - competitor_avg OR competitor_prices (list)
+    - cost_price (>0) OR min_price (>0)
+    """
+    y = server._to_float(row.get("actual_best_price") or row.get("label") or row.get("y"))
+    if y is None or y <= 0:
+        return None
+
+    payload = payload_from_row(row)
 
     # Ensure we have a usable competitor signal for training.
     has_comp = False
@@ -208,126 +544,552 @@ def _parse_row(row: dict[str, Any]) -> TrainingRow | None:
     if min_price is None and (cost_price is None or cost_price <= 0):
         return None
 
-    return TrainingRow(payload=payload, y=y)
+    segment = None
+    if segment_field is not None:
+        value = row.get(segment_field)
+        segment = "(missing)" if value is None or value == "" else str(value)
+
+    return TrainingRow(payload=payload, y=y, segment=segment)
+
 
+FEATURES: tuple[str, ...] = ("competitor_avg", "min_price", "competitor_avg*demand_effective")
 
-def _build_features(rows: list[TrainingRow]) -> tuple[list[list[float]], list[float], dict[str, float]]:
+# Format version of the training statistics sidecar (see _save_stats).
+STATS_VERSION = 1
+
+
+def _row_features(payload: dict[str, Any], weights: server.CompiledWeights) -> tuple[list[float], float] | None:
     """
-    Build linear features matching the deployed formula:
+    Linear features matching the deployed formula, plus the row's demand_factor:
       y ≈ alpha*Pc + beta*min_price + gamma_multiplier*(Pc*demand_effective)
+    None when the row has no usable floor or competitor signal.
+    """
+    # Use server logic to compute the same min_price + demand_effective used in recommend().
+    # We call the internal helpers to avoid parsing strictness.
+    cost_price = server._to_float(payload.get("cost_price"))
+    desired_margin = server._to_float(payload.get("desired_margin")) or 0.0
+    shipping_cost = server._to_float(payload.get("shipping_cost")) or 0.0
+    platform_fee_pct = server._to_float(payload.get("platform_fee_pct")) or 0.0
+    min_price_input = server._to_float(payload.get("min_price"))
+
+    try:
+        min_price, _ = server._compute_min_price(
+            cost_price=cost_price,
+            desired_margin=desired_margin,
+            min_price_input=min_price_input,
+            shipping_cost=shipping_cost,
+            platform_fee_pct=platform_fee_pct,
+        )
+    except server.InputError:
+        return None
+
+    # Competitor avg (robust if list provided).
+    competitor_avg = server._to_float(payload.get("competitor_avg"))
+    if competitor_avg is None or competitor_avg <= 0:
+        comp_prices_raw = payload.get("competitor_prices")
+        comp_prices: list[float] = []
+        if isinstance(comp_prices_raw, list):
+            for x in comp_prices_raw:
+                f = server._to_float(x)
+                if f is not None and f > 0:
+                    comp_prices.append(f)
+        if not comp_prices:
+            return None
+        competitor_avg, _ = server._robust_price_average(comp_prices)
+
+    demand_factor = server._to_float(payload.get("demand_factor"))
+    if demand_factor is None:
+        demand_factor = 0.5
+    if demand_factor > 1:
+        demand_factor = demand_factor / 100.0
+    demand_factor = server._clamp(demand_factor, 0.0, 1.0)
+
+    # Match server's demand_effective adjustment (sales_velocity + rating).
+    sales_velocity = server._to_float(payload.get("sales_velocity"))
+    rating = server._to_float(payload.get("rating"))
+
+    sales_norm = None
+    if sales_velocity is not None:
+        sales_norm = server._log_ratio(max(0.0, sales_velocity), weights.sales_velocity_log_ref)
+
+    rating_norm = None
+    if rating is not None:
+        rating_norm = server._clamp(rating / 5.0, 0.0, 1.0)
+
+    demand_effective = demand_factor
+    if sales_norm is not None:
+        demand_effective += weights.sales_velocity_weight * ((sales_norm - 0.5) * 2.0)
+    if rating_norm is not None:
+        demand_effective += weights.rating_weight * ((rating_norm - 0.5) * 2.0)
+    demand_effective = server._clamp(demand_effective, 0.0, 1.0)
+
+    return [competitor_avg, min_price, competitor_avg * demand_effective], demand_factor
+
+
+def _defaults(demand_median: float | None, ratio_p95: float | None) -> dict[str, float]:
+    """Dataset-derived defaults from the demand_factor median and the p95 of y/Pc - 1."""
+    demand_default = 0.5
+    if demand_median is not None:
+        demand_default = float(demand_median)
+
+    ceiling_pct = 0.07
+    if ratio_p95 is not None:
+        ceiling_pct = float(server._clamp(max(0.0, ratio_p95), 0.0, 0.3))
+        ceiling_pct = max(0.05, ceiling_pct)
+
+    return {"demand_default": demand_default, "competitive_ceiling_pct": ceiling_pct}
+
+
+def _build_features(
+    rows: list[TrainingRow],
+    *,
+    quantiles: str = "exact",
+    stats: SufficientStats | None = None,
+) -> tuple[list[list[float]], list[float], dict[str, float]]:
+    """
+    Features (see _row_features), labels and dataset-derived defaults for in-memory rows.
+    quantiles="sketch" estimates the defaults with QuantileSketch (as --stream does)
+    instead of keeping every demand factor and price ratio for exact selection. The same
+    rows are also added to `stats`, if given, so the statistics sidecar needs no second pass.
     """
     xs: list[list[float]] = []
     ys: list[float] = []
+    demands: list[float] = []
 
-    demand_values: list[float] = []
-    ratios: list[float] = []
+    demand_values: list[float] | QuantileSketch = QuantileSketch() if quantiles == "sketch" else []
+    ratios: list[float] | QuantileSketch = QuantileSketch() if quantiles == "sketch" else []
 
     weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
 
     for tr in rows:
-        payload = dict(tr.payload)
-        # Use server logic to compute the same min_price + demand_effective used in recommend().
-        # We call the internal helpers to avoid parsing strictness.
-        cost_price = server._to_float(payload.get("cost_price"))
-        desired_margin = server._to_float(payload.get("desired_margin")) or 0.0
-        shipping_cost = server._to_float(payload.get("shipping_cost")) or 0.0
-        platform_fee_pct = server._to_float(payload.get("platform_fee_pct")) or 0.0
-        min_price_input = server._to_float(payload.get("min_price"))
+        features = _row_features(tr.payload, weights)
+        if features is None:
+            continue
+        x, demand_factor = features
+        xs.append(x)
+        ys.append(tr.y)
+        if stats is not None:
+            demands.append(demand_factor)
+        if isinstance(demand_values, QuantileSketch):
+            demand_values.add(demand_factor)
+        else:
+            demand_values.append(demand_factor)
+        if x[0] > 0:
+            ratio = (tr.y / x[0]) - 1.0
+            if isinstance(ratios, QuantileSketch):
+                ratios.add(ratio)
+            else:
+                ratios.append(ratio)
+
+    if stats is not None:
+        stats.add(xs, ys, demands)
+    if isinstance(demand_values, QuantileSketch) and isinstance(ratios, QuantileSketch):
+        return xs, ys, _defaults(
+            demand_values.quantile(0.5) if demand_values.count else None,
+            ratios.quantile(0.95) if ratios.count else None,
+        )
+    return xs, ys, _defaults(
+        _quantile(demand_values, 0.5) if demand_values else None,
+        _quantile(ratios, 0.95) if ratios else None,
+    )
 
-        try:
-            min_price, _ = server._compute_min_price(
-                cost_price=cost_price,
-                desired_margin=desired_margin,
-                min_price_input=min_price_input,
-                shipping_cost=shipping_cost,
-                platform_fee_pct=platform_fee_pct,
-            )
-        except server.InputError:
+
+def _scale_features(
+    xs: list[list[float]] | np.ndarray,
+    *,
+    quantiles: str = "exact",
+) -> tuple[list[list[float]] | np.ndarray, list[float]]:
+    # Robust feature scaling to improve numeric stability.
+    if quantiles == "sketch":
+        x = np.asarray(xs, dtype=np.float64) if np is not None else None
+        scales = []
+        for j in range(len(xs[0])):
+            sketch = QuantileSketch()
+            sketch.add_many(np.abs(x[:, j]) if x is not None else (abs(r[j]) for r in xs))
+            scale = sketch.quantile(0.95)
+            scales.append(scale if scale > 1e-6 else 1.0)
+        if x is not None:
+            return x / np.asarray(scales), scales
+        return [[r[j] / scales[j] for j in range(len(scales))] for r in xs], scales
+
+    if np is not None:
+        x = np.abs(np.asarray(xs, dtype=np.float64))
+        idx = int(round(0.95 * (len(x) - 1)))  # same nearest rank as _percentile
+        p95 = np.partition(x, idx, axis=0)[idx]
+        scales = [float(v) if v > 1e-6 else 1.0 for v in p95]
+        return np.asarray(xs, dtype=np.float64) / np.asarray(scales), scales
+
+    p = len(xs[0])
+    scales = []
+    for j in range(p):
+        scale = _quantile([abs(r[j]) for r in xs], 0.95)
+        scales.append(scale if scale > 1e-6 else 1.0)
+    xs_scaled = [[r[j] / scales[j] for j in range(p)] for r in xs]
+    return xs_scaled, scales
+
+
+def _row_hash(row: dict[str, Any], seed: int) -> int:
+    """
+    64-bit keyed hash of a row's contents. Splits derived from it need no shuffle buffer
+    and are the same on every pass (and every run); duplicate rows always land together.
+    Fields csv.DictReader found beyond the header (under the key None) are left out.
+    """
+    key = "\x1f".join(f"{k}={row[k]}" for k in sorted(k for k in row if isinstance(k, str))).encode("utf-8")
+    digest = hashlib.blake2b(key, digest_size=8, key=str(seed).encode("utf-8")).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _in_validation(row: dict[str, Any], val_split: float, seed: int) -> bool:
+    """Hash-based validation split (see _row_hash)."""
+    return _row_hash(row, seed) < val_split * 2**64
+
+
+class SufficientStats:
+    """
+    Everything the ridge fit and the dataset defaults need, accumulated in one pass:
+    X^T X, X^T y, the row count, and percentile sketches for the feature scales
+    (p95 of |x_j|), demand_default (median demand_factor) and competitive_ceiling_pct
+    (p95 of y/Pc - 1). Memory does not depend on the number of rows.
+    """
+
+    def __init__(self, p: int = len(FEATURES)) -> None:
+        self.p = p
+        self.n: float = 0
+        self.xtx = [[0.0] * p for _ in range(p)]
+        self.xty = [0.0] * p
+        self.abs_features = [QuantileSketch() for _ in range(p)]
+        self.demand = QuantileSketch()
+        self.ratio = QuantileSketch()
+
+    def add(self, xs: list[list[float]], ys: list[float], demands: list[float]) -> None:
+        """Fold in a chunk of feature rows, labels and demand factors."""
+        if not xs:
+            return
+        if np is not None:
+            x = np.asarray(xs, dtype=np.float64)
+            y = np.asarray(ys, dtype=np.float64)
+            a, b = _gram(x, y)
+            for j, sketch in enumerate(self.abs_features):
+                sketch.add_many(np.abs(x[:, j]))
+            self.demand.add_many(np.asarray(demands, dtype=np.float64))
+            priced = x[:, 0] > 0
+            self.ratio.add_many(y[priced] / x[priced, 0] - 1.0)
+        else:
+            a, b = _gram(xs, ys)
+            for row, label, demand in zip(xs, ys, demands):
+                for sketch, value in zip(self.abs_features, row):
+                    sketch.add(abs(value))
+                self.demand.add(demand)
+                if row[0] > 0:
+                    self.ratio.add((label / row[0]) - 1.0)
+        for i in range(self.p):
+            self.xty[i] += b[i]
+            acc = self.xtx[i]
+            for j in range(self.p):
+                acc[j] += a[i][j]
+        self.n += len(xs)
+
+    def merge(self, other: SufficientStats) -> SufficientStats:
+        """Add another pass's statistics into this one (in place); returns self."""
+        if other.p != self.p:
+            raise ValueError("Feature count mismatch")
+        for i in range(self.p):
+            self.xty[i] += other.xty[i]
+            for j in range(self.p):
+                self.xtx[i][j] += other.xtx[i][j]
+        for mine, theirs in zip(self.abs_features, other.abs_features):
+            mine.merge(theirs)
+        self.demand.merge(other.demand)
+        self.ratio.merge(other.ratio)
+        self.n += other.n
+        return self
+
+    @classmethod
+    def merged(cls, parts: Iterable[SufficientStats]) -> SufficientStats:
+        total = cls()
+        for part in parts:
+            total.merge(part)
+        return total
+
+    def decay(self, factor: float) -> None:
+        """Down-weight everything accumulated so far: each row counts `factor` times as much."""
+        for i in range(self.p):
+            self.xty[i] *= factor
+            for j in range(self.p):
+                self.xtx[i][j] *= factor
+        for sketch in (*self.abs_features, self.demand, self.ratio):
+            sketch.decay(factor)
+        self.n *= factor
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "features": list(FEATURES),
+            "n": self.n,
+            "xtx": self.xtx,
+            "xty": self.xty,
+            "abs_features": [sketch.to_dict() for sketch in self.abs_features],
+            "demand": self.demand.to_dict(),
+            "ratio": self.ratio.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, raw: Mapping[str, Any]) -> SufficientStats:
+        if list(raw.get("features") or []) != list(FEATURES):
+            raise ValueError(f"Statistics were accumulated for different features: {raw.get('features')}")
+        stats = cls(len(FEATURES))
+        stats.n = raw["n"]
+        stats.xtx = [[float(v) for v in row] for row in raw["xtx"]]
+        stats.xty = [float(v) for v in raw["xty"]]
+        stats.abs_features = [QuantileSketch.from_dict(s) for s in raw["abs_features"]]
+        stats.demand = QuantileSketch.from_dict(raw["demand"])
+        stats.ratio = QuantileSketch.from_dict(raw["ratio"])
+        return stats
+
+    def scales(self) -> list[float]:
+        """Same robust scaling as _scale_features (p95 of |x_j|), from the sketches."""
+        scales = []
+        for sketch in self.abs_features:
+            scale = sketch.quantile(0.95)
+            scales.append(scale if scale > 1e-6 else 1.0)
+        return scales
+
+    def solve(self, ridge_lambda: float, scales: list[float] | None = None) -> list[float]:
+        """
+        Ridge weights in the original feature units. The fit runs on scaled features:
+        with D = diag(scales), (D^-1 X^T X D^-1 + λI) w_s = D^-1 X^T y and w = D^-1 w_s.
+        `scales` defaults to self.scales().
+        """
+        if self.n == 0:
+            raise ValueError("No training rows")
+        if scales is None:
+            scales = self.scales()
+        a = [[self.xtx[i][j] / (scales[i] * scales[j]) for j in range(self.p)] for i in range(self.p)]
+        b = [self.xty[i] / scales[i] for i in range(self.p)]
+        for i in range(self.p):
+            a[i][i] += ridge_lambda
+        w_scaled = _solve_spd(a, b)
+        return [w_scaled[j] / scales[j] for j in range(self.p)]
+
+    def defaults(self) -> dict[str, float]:
+        return _defaults(
+            self.demand.quantile(0.5) if self.demand.count else None,
+            self.ratio.quantile(0.95) if self.ratio.count else None,
+        )
+
+
+def _fold_stats(rows: list[TrainingRow]) -> SufficientStats:
+    """SufficientStats of in-memory rows (used for the --cv folds of the in-memory mode)."""
+    xs, ys, demands = [], [], []
+    weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+    for tr in rows:
+        features = _row_features(tr.payload, weights)
+        if features is None:
             continue
+        xs.append(features[0])
+        ys.append(tr.y)
+        demands.append(features[1])
+    stats = SufficientStats()
+    stats.add(xs, ys, demands)
+    return stats
 
-        # Competitor avg (robust if list provided).
-        competitor_avg = server._to_float(payload.get("competitor_avg"))
-        if competitor_avg is None or competitor_avg <= 0:
-            comp_prices_raw = payload.get("competitor_prices")
-            comp_prices: list[float] = []
-            if isinstance(comp_prices_raw, list):
-                for x in comp_prices_raw:
-                    f = server._to_float(x)
-                    if f is not None and f > 0:
-                        comp_prices.append(f)
-            if not comp_prices:
+
+def _fit_streaming(
+    path: str,
+    *,
+    val_split: float,
+    seed: int,
+    chunk_size: int,
+    folds: int = 1,
+) -> tuple[list[SufficientStats], dict[str, int]]:
+    """
+    One pass over the dataset in chunks of chunk_size rows; validation rows are only
+    counted. Training rows are spread over `folds` SufficientStats by row hash (for --cv;
+    the full fit merges them).
+    """
+    weights = server._load_weights(os.path.join(os.path.dirname(__file__), "weights.json"))
+    fold_stats = [SufficientStats() for _ in range(folds)]
+    counts = {"rows_total": 0, "rows_parsed": 0, "rows_train": 0, "rows_val": 0}
+    threshold = val_split * 2**64
+    rows = _iter_dataset(path)
+    while True:
+        chunk = list(itertools.islice(rows, max(1, chunk_size)))
+        if not chunk:
+            break
+        parts: list[tuple[list[list[float]], list[float], list[float]]] = [([], [], []) for _ in range(folds)]
+        for raw in chunk:
+            counts["rows_total"] += 1
+            tr = _parse_row(raw)
+            if tr is None:
                 continue
-            competitor_avg, _ = server._robust_price_average(comp_prices)
-
-        demand_factor = server._to_float(payload.get("demand_factor"))
-        if demand_factor is None:
-            demand_factor = 0.5
-        if demand_factor > 1:
-            demand_factor = demand_factor / 100.0
-        demand_factor = server._clamp(demand_factor, 0.0, 1.0)
-        demand_values.append(demand_factor)
-
-        # Match server's demand_effective adjustment (sales_velocity + rating).
-        sales_velocity = server._to_float(payload.get("sales_velocity"))
-        rating = server._to_float(payload.get("rating"))
-
-        sales_norm = None
-        if sales_velocity is not None:
-            sales_norm = server._log_norm(
-                max(0.0, sales_velocity),
-                float(weights.get("sales_velocity_ref", 50.0)),
-            )
+            counts["rows_parsed"] += 1
+            h = _row_hash(raw, seed)
+            if h < threshold:
+                counts["rows_val"] += 1
+                continue
+            counts["rows_train"] += 1
+            features = _row_features(tr.payload, weights)
+            if features is None:
+                continue
+            xs, ys, demands = parts[h % folds]
+            xs.append(features[0])
+            ys.append(tr.y)
+            demands.append(features[1])
+        for stats, (xs, ys, demands) in zip(fold_stats, parts):
+            stats.add(xs, ys, demands)
+    return fold_stats, counts
 
-        rating_norm = None
-        if rating is not None:
-            rating_norm = server._clamp(rating / 5.0, 0.0, 1.0)
 
-        demand_effective = demand_factor
-        if sales_norm is not None:
-            w = float(weights.get("sales_velocity_weight", 0.12))
-            demand_effective += w * ((sales_norm - 0.5) * 2.0)
-        if rating_norm is not None:
-            w = float(weights.get("rating_weight", 0.08))
-            demand_effective += w * ((rating_norm - 0.5) * 2.0)
-        demand_effective = server._clamp(demand_effective, 0.0, 1.0)
+def _iter_validation_rows(
+    path: str,
+    *,
+    val_split: float,
+    seed: int,
+    segment_field: str | None = None,
+) -> Iterator[TrainingRow]:
+    """Second pass for --stream: the parsed rows that _in_validation held out."""
+    for raw in _iter_dataset(path):
+        if not _in_validation(raw, val_split, seed):
+            continue
+        tr = _parse_row(raw, segment_field=segment_field)
+        if tr is not None:
+            yield tr
 
-        xs.append([competitor_avg, min_price, competitor_avg * demand_effective])
-        ys.append(tr.y)
 
-        if competitor_avg > 0:
-            ratios.append((tr.y / competitor_avg) - 1.0)
+def _stats_path(weights_path: str) -> str:
+    """Default sidecar for the training statistics: weights.json -> weights.stats.json."""
+    return os.path.splitext(weights_path)[0] + ".stats.json"
 
-    # Defaults derived from the dataset.
-    demand_default = 0.5
-    if demand_values:
-        demand_values_sorted = sorted(demand_values)
-        demand_default = float(_percentile(demand_values_sorted, 0.5))
 
-    ceiling_pct = 0.07
-    if ratios:
-        ratios_sorted = sorted(ratios)
-        p95 = _percentile(ratios_sorted, 0.95)
-        ceiling_pct = float(server._clamp(max(0.0, p95), 0.0, 0.3))
-        ceiling_pct = max(0.05, ceiling_pct)
+def _load_stats(path: str) -> tuple[SufficientStats, dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    if not isinstance(raw, dict) or raw.get("version") != STATS_VERSION:
+        raise ValueError(f"Unsupported statistics file: {path}")
+    return SufficientStats.from_dict(raw["stats"]), raw.get("meta") or {}
 
-    return xs, ys, {"demand_default": demand_default, "competitive_ceiling_pct": ceiling_pct}
 
+def _save_stats(path: str, stats: SufficientStats, meta: dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": STATS_VERSION, "meta": meta, "stats": stats.to_dict()}, f)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+@dataclass(frozen=True)
+class _StreamFold:
+    """Where a --stream worker re-reads the rows of one CV fold from."""
+
+    path: str
+    val_split: float
+    seed: int
+    folds: int
+    fold: int
+
+    def rows(self) -> Iterator[TrainingRow]:
+        threshold = self.val_split * 2**64
+        for raw in _iter_dataset(self.path):
+            h = _row_hash(raw, self.seed)
+            if h < threshold or h % self.folds != self.fold:
+                continue
+            tr = _parse_row(raw)
+            if tr is not None:
+                yield tr
+
+
+def _trained_weights(base_weights: Mapping[str, Any], w: list[float], defaults: dict[str, float]) -> dict[str, Any]:
+    """Raw fitted weights merged into base_weights and sanitized like the deployed model."""
+    return dict(
+        server._sanitize_weights(
+            {
+                **base_weights,
+                "model_version": "mock-formula-v2",
+                "alpha": w[0],
+                "beta": w[1],
+                "gamma_multiplier": w[2],
+                "competitive_ceiling_pct": defaults["competitive_ceiling_pct"],
+                "demand_default": defaults["demand_default"],
+            }
+        )
+    )
+
+
+def _score_fold(task: tuple[list[TrainingRow] | _StreamFold, list[dict[str, Any]]]) -> list[dict[str, float]]:
+    """Validation metrics of one held-out fold under each candidate weight set (one scan)."""
+    source, weight_sets = task
+    rows = source.rows() if isinstance(source, _StreamFold) else source
+    return [{"n": e.n, **e.metrics()} for e in _evaluate(rows, weight_sets)]
+
+
+def _cross_validate(
+    fold_stats: list[SufficientStats],
+    fold_sources: list[list[TrainingRow] | _StreamFold],
+    ridge_grid: list[float],
+    *,
+    base_weights: Mapping[str, Any],
+    metric: str,
+    workers: int,
+    scales: list[float] | None = None,
+) -> tuple[float, dict[str, Any]]:
+    """
+    K-fold selection of the ridge lambda. Each fold's training Gram matrix is the merge of
+    the other folds' statistics, so the whole lambda path costs one small solve per value;
+    each fold's rows are then scanned once for every lambda, folds in parallel. Pass the
+    final fit's feature `scales`: λ penalizes the scaled weights, so it is only chosen for
+    the fit it is used in if every fold is scaled the same way (default: each fold's own
+    sketch scales). Returns the lambda with the lowest pooled `metric` and the per-fold report.
+    """
+    tasks = []
+    for fold in range(len(fold_stats)):
+        train_stats = SufficientStats.merged(s for i, s in enumerate(fold_stats) if i != fold)
+        if train_stats.n < 10:
+            raise SystemExit(f"Not enough usable rows to train CV fold {fold}: {train_stats.n}")
+        defaults = train_stats.defaults()
+        weight_sets = [_trained_weights(base_weights, train_stats.solve(lam, scales), defaults) for lam in ridge_grid]
+        tasks.append((fold_sources[fold], weight_sets))
+
+    workers = max(1, min(workers, len(tasks)))
+    if workers == 1:
+        per_fold = [_score_fold(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            per_fold = pool.map(_score_fold, tasks)
+
+    path = []
+    for i, lam in enumerate(ridge_grid):
+        folds = [{"fold": fold, **scores[i]} for fold, scores in enumerate(per_fold)]
+        n = sum(f["n"] for f in folds)
+        pooled = {
+            "mae": sum(f["mae"] * f["n"] for f in folds) / max(1, n),
+            "rmse": math.sqrt(sum(f["rmse"] ** 2 * f["n"] for f in folds) / max(1, n)),
+            "mape": sum(f["mape"] * f["n"] for f in folds) / max(1, n),
+        }
+        path.append({"ridge_lambda": lam, **{k: round(v, 6) for k, v in pooled.items()}, "n": n, "folds": folds})
+
+    best = min(path, key=lambda entry: entry[metric])
+    report = {
+        "folds": len(fold_stats),
+        "metric": metric,
+        "best_ridge_lambda": best["ridge_lambda"],
+        "path": path,
+    }
+    return best["ridge_lambda"], report
 
-def _scale_features(xs: list[list[float]]) -> tuple[list[list[float]], list[float]]:
-    # Robust feature scaling to improve numeric stability.
-    p = len(xs[0])
-    scales = []
-    for j in range(p):
-        col = sorted(abs(r[j]) for r in xs)
-        scale = _percentile(col, 0.95)
-        scales.append(scale if scale > 1e-6 else 1.0)
-    xs_scaled = [[r[j] / scales[j] for j in range(p)] for r in xs]
-    return xs_scaled, scales
+
+def _parse_grid(value: str) -> list[float]:
+    try:
+        grid = sorted({float(v) for v in value.split(",") if v.strip()})
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected comma-separated numbers") from None
+    if not grid or any(not math.isfinite(v) or v < 0 for v in grid):
+        raise argparse.ArgumentTypeError("expected non-negative finite numbers")
+    return grid
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Train AI Price Engine weights from CSV/JSON data.")
-    parser.add_argument("--data", required=True, help="Path to dataset (.csv or .json)")
+    parser.add_argument("--data", required=True, help="Path to dataset (.csv, .json or .jsonl)")
     parser.add_argument(
         "--out",
         default=os.path.join(os.path.dirname(__file__), "weights.json"),
@@ -336,41 +1098,159 @@ def main() -> None:
     parser.add_argument("--ridge", type=float, default=1e-2, help="Ridge lambda (L2)")
     parser.add_argument("--val-split", type=float, default=0.2, help="Validation split fraction")
     parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Constant-memory training: one pass in chunks, hash-based validation split, sketched percentiles",
+    )
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="Rows per chunk with --stream")
+    parser.add_argument(
+        "--quantiles",
+        choices=("exact", "sketch"),
+        default="exact",
+        help="How the in-memory mode finds the p95 scales, demand median and ceiling (--stream always sketches)",
+    )
+    parser.add_argument("--cv", type=int, default=0, help="K-fold CV over the training rows to pick the ridge lambda")
+    parser.add_argument(
+        "--ridge-grid",
+        type=_parse_grid,
+        help="Comma-separated ridge lambdas for --cv (default: 1e-4,...,10 by decade)",
+    )
+    parser.add_argument("--cv-metric", choices=("mae", "mape"), default="mae", help="Validation metric --cv minimizes")
+    parser.add_argument("--workers", type=int, default=0, help="Processes scoring CV folds (0 = one per CPU)")
+    parser.add_argument(
+        "--calibration-segment",
+        metavar="COLUMN",
+        help="Also report validation metrics and confidence quartiles per value of this dataset column",
+    )
+    parser.add_argument(
+        "--stats",
+        help="Training statistics sidecar, written on every run (default: <out>.stats.json next to --out)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Fold only the rows in --data (new since the last run) into the saved statistics and re-solve",
+    )
+    parser.add_argument(
+        "--decay",
+        type=float,
+        default=1.0,
+        help="With --incremental, weight of the previously accumulated rows (0 < decay <= 1)",
+    )
     args = parser.parse_args()
 
-    raw_rows = _load_dataset(args.data)
-    parsed_rows = [r for r in (_parse_row(rr) for rr in raw_rows) if r is not None]
-    if len(parsed_rows) < 20:
-        raise SystemExit(f"Not enough valid rows for training: {len(parsed_rows)}")
-
-    random.Random(args.seed).shuffle(parsed_rows)
-    val_n = max(1, int(len(parsed_rows) * server._clamp(args.val_split, 0.05, 0.5)))
-    val_rows = parsed_rows[:val_n]
-    train_rows = parsed_rows[val_n:]
-
-    xs, ys, defaults = _build_features(train_rows)
-    if len(xs) < 10:
-        raise SystemExit(f"Not enough usable rows after feature build: {len(xs)}")
+    ridge_lambda = max(0.0, args.ridge)
+    val_split = server._clamp(args.val_split, 0.05, 0.5)
+    folds = args.cv if args.cv > 0 else (5 if args.ridge_grid else 0)
+    if folds == 1:
+        parser.error("--cv needs at least 2 folds")
+    ridge_grid = args.ridge_grid or [1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0]
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    base_weights = server._load_weights(args.out)
+    cv_report = None
+    stats_path = args.stats or _stats_path(args.out)
+    stats_meta: dict[str, Any] = {"runs": 0, "rows_seen": 0}
+    if args.incremental and folds:
+        parser.error("--cv can't be combined with --incremental")
+    if not 0.0 < args.decay <= 1.0:
+        parser.error("--decay must be in (0, 1]")
+
+    val_rows: Iterable[TrainingRow]
+    if args.incremental:
+        try:
+            stats, stats_meta = _load_stats(stats_path)
+        except FileNotFoundError:
+            raise SystemExit(f"No training statistics at {stats_path}; run once without --incremental") from None
+        [delta], counts = _fit_streaming(args.data, val_split=val_split, seed=args.seed, chunk_size=args.chunk_size)
+        stats.decay(args.decay)
+        stats.merge(delta)
+        if stats.n < 10:
+            raise SystemExit(f"Not enough usable rows after feature build: {stats.n}")
+        w = stats.solve(ridge_lambda)
+        defaults = stats.defaults()
+        val_rows = _iter_validation_rows(
+            args.data, val_split=val_split, seed=args.seed, segment_field=args.calibration_segment
+        )
+    elif args.stream:
+        fold_stats, counts = _fit_streaming(
+            args.data,
+            val_split=val_split,
+            seed=args.seed,
+            chunk_size=args.chunk_size,
+            folds=max(1, folds),
+        )
+        stats = SufficientStats.merged(fold_stats)
+        if counts["rows_parsed"] < 20:
+            raise SystemExit(f"Not enough valid rows for training: {counts['rows_parsed']}")
+        if stats.n < 10:
+            raise SystemExit(f"Not enough usable rows after feature build: {stats.n}")
+        if folds:
+            sources: list[list[TrainingRow] | _StreamFold] = [
+                _StreamFold(args.data, val_split, args.seed, folds, fold) for fold in range(folds)
+            ]
+            ridge_lambda, cv_report = _cross_validate(
+                fold_stats,
+                sources,
+                ridge_grid,
+                base_weights=base_weights,
+                metric=args.cv_metric,
+                workers=workers,
+                scales=stats.scales(),
+            )
+        w = stats.solve(ridge_lambda)
+        defaults = stats.defaults()
+        val_rows = _iter_validation_rows(
+            args.data, val_split=val_split, seed=args.seed, segment_field=args.calibration_segment
+        )
+    else:
+        raw_rows = _load_dataset(args.data)
+        parsed_rows = [
+            r for r in (_parse_row(rr, segment_field=args.calibration_segment) for rr in raw_rows) if r is not None
+        ]
+        if len(parsed_rows) < 20:
+            raise SystemExit(f"Not enough valid rows for training: {len(parsed_rows)}")
+
+        random.Random(args.seed).shuffle(parsed_rows)
+        val_n = max(1, int(len(parsed_rows) * val_split))
+        val_rows = parsed_rows[:val_n]
+        train_rows = parsed_rows[val_n:]
+        counts = {
+            "rows_total": len(raw_rows),
+            "rows_parsed": len(parsed_rows),
+            "rows_train": len(train_rows),
+            "rows_val": len(val_rows),
+        }
 
-    xs_scaled, scales = _scale_features(xs)
+        # With --cv the sidecar is merged from the fold statistics instead.
+        stats = SufficientStats()
+        xs, ys, defaults = _build_features(train_rows, quantiles=args.quantiles, stats=None if folds else stats)
+        if len(xs) < 10:
+            raise SystemExit(f"Not enough usable rows after feature build: {len(xs)}")
+        xs_scaled, scales = _scale_features(xs, quantiles=args.quantiles)
+
+        if folds:
+            # Rows are already shuffled, so round-robin folds are random folds.
+            fold_rows = [train_rows[fold::folds] for fold in range(folds)]
+            fold_stats = [_fold_stats(rows) for rows in fold_rows]
+            ridge_lambda, cv_report = _cross_validate(
+                fold_stats,
+                list(fold_rows),
+                ridge_grid,
+                base_weights=base_weights,
+                metric=args.cv_metric,
+                workers=workers,
+                scales=scales,
+            )
 
-    w_scaled = _solve_ridge(xs_scaled, ys, ridge_lambda=max(0.0, args.ridge))
-    w = [w_scaled[j] / scales[j] for j in range(len(w_scaled))]
+        w_scaled = _solve_ridge(xs_scaled, ys, ridge_lambda=ridge_lambda)
+        w = [w_scaled[j] / scales[j] for j in range(len(w_scaled))]
+        if folds:
+            stats = SufficientStats.merged(fold_stats)
 
     alpha_raw, beta_raw, gamma_multiplier_raw = w[0], w[1], w[2]
 
-    base_weights = server._load_weights(args.out)
-    trained = server._sanitize_weights(
-        {
-            **base_weights,
-            "model_version": "mock-formula-v2",
-            "alpha": alpha_raw,
-            "beta": beta_raw,
-            "gamma_multiplier": gamma_multiplier_raw,
-            "competitive_ceiling_pct": defaults["competitive_ceiling_pct"],
-            "demand_default": defaults["demand_default"],
-        }
-    )
+    trained = server.compile_weights(_trained_weights(base_weights, w, defaults))
 
     # Surface any big post-sanitize changes (negative weights, clamping, renormalization).
     deltas = {
@@ -388,46 +1268,20 @@ def main() -> None:
     if abs(deltas["alpha"]) > 0.05 or abs(deltas["beta"]) > 0.05:
         sanitize_warnings.append("alpha/beta changed noticeably after renormalization.")
 
-    # Evaluate on validation with the deployed recommend() (includes clamps + confidence).
-    y_true: list[float] = []
-    y_pred: list[float] = []
-    confidences: list[float] = []
-    abs_errors: list[float] = []
+    # Evaluate on validation with the deployed formula (includes clamps + confidence).
+    [evaluation] = _evaluate(val_rows, [trained], by_segment=args.calibration_segment is not None)
 
-    for tr in val_rows:
-        try:
-            res = server.recommend(tr.payload, trained, explain=False)
-        except server.InputError:
-            continue
-        pred = float(res["recommended_price"])
-        conf = float(res["confidence"])
-        y_true.append(tr.y)
-        y_pred.append(pred)
-        confidences.append(conf)
-        abs_errors.append(abs(pred - tr.y))
-
-    metrics = {
-        "mae": round(_mae(y_true, y_pred), 6),
-        "rmse": round(_rmse(y_true, y_pred), 6),
-        "mape": round(_mape(y_true, y_pred), 6),
+    metrics = evaluation.metrics()
+    r_conf_err = evaluation.pearson_r()
+    # Confidence buckets (quartiles, deciles) for a calibration sanity check.
+    calibration: dict[str, Any] = {
+        "pearson_r_conf_abs_error": None if r_conf_err is None else round(r_conf_err, 6),
+        "quartiles": evaluation.calibration(4),
+        "deciles": evaluation.calibration(10),
     }
-
-    r_conf_err = _pearson_r(confidences, abs_errors)
-
-    # Confidence buckets (quartiles) for a quick calibration sanity check.
-    buckets = []
-    if confidences:
-        paired = sorted(zip(confidences, abs_errors), key=lambda t: t[0])
-        q = max(1, len(paired) // 4)
-        for i in range(4):
-            chunk = paired[i * q : (i + 1) * q] if i < 3 else paired[i * q :]
-            if not chunk:
-                continue
-            avg_conf = sum(c for c, _ in chunk) / len(chunk)
-            avg_err = sum(e for _, e in chunk) / len(chunk)
-            buckets.append(
-                {"avg_confidence": round(avg_conf, 4), "mae": round(avg_err, 6), "n": len(chunk)}
-            )
+    if args.calibration_segment is not None:
+        calibration["segment_field"] = args.calibration_segment
+        calibration["segments"] = evaluation.segment_report()
 
     today = dt.datetime.now(dt.timezone.utc).strftime("%Y%m%d")
     model_version = f"mock-formula-v2-trained-{today}"
@@ -437,20 +1291,31 @@ def main() -> None:
     out["training"] = {
         "timestamp_utc": dt.datetime.now(dt.timezone.utc).isoformat(),
         "dataset": os.path.basename(args.data),
-        "rows_total": len(raw_rows),
-        "rows_parsed": len(parsed_rows),
-        "rows_train": len(train_rows),
-        "rows_val": len(val_rows),
-        "ridge_lambda": max(0.0, args.ridge),
-        "val_split": server._clamp(args.val_split, 0.05, 0.5),
-        "features": ["competitor_avg", "min_price", "competitor_avg*demand_effective"],
+        **counts,
+        "mode": "incremental" if args.incremental else ("streaming" if args.stream else "in_memory"),
+        "ridge_lambda": ridge_lambda,
+        "val_split": val_split,
+        "features": list(FEATURES),
         "metrics_val": metrics,
-        "confidence_calibration": {
-            "pearson_r_conf_abs_error": None if r_conf_err is None else round(r_conf_err, 6),
-            "quartiles": buckets,
-        },
+        "confidence_calibration": calibration,
+    }
+    if cv_report is not None:
+        out["training"]["cv"] = cv_report
+    stats_meta = {
+        "runs": int(stats_meta.get("runs", 0)) + 1,
+        "rows_seen": int(stats_meta.get("rows_seen", 0)) + counts["rows_train"],
+        "updated_utc": out["training"]["timestamp_utc"],
+        "model_version": model_version,
+    }
+    out["training"]["stats"] = {
+        "path": os.path.basename(stats_path),
+        "incremental": args.incremental,
+        "decay": args.decay if args.incremental else None,
+        "rows_effective": round(stats.n, 3),
+        **stats_meta,
     }
 
+    _save_stats(stats_path, stats, stats_meta)
     os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
     with open(args.out, "w", encoding="utf-8") as f:
         json.dump(out, f, ensure_ascii=False, indent=2)
@@ -464,6 +1329,11 @@ def main() -> None:
     print(f"  gamma_multiplier: {out['gamma_multiplier']:.6f}")
     print(f"  competitive_ceiling_pct: {out['competitive_ceiling_pct']:.6f}")
     print(f"  demand_default: {out['demand_default']:.6f}")
+    if cv_report is not None:
+        print(f"Cross-validation ({cv_report['folds']} folds, lowest {cv_report['metric']}):")
+        for entry in cv_report["path"]:
+            marker = "  <- best" if entry["ridge_lambda"] == ridge_lambda else ""
+            print(f"  ridge {entry['ridge_lambda']:g}: mae {entry['mae']:.4f}  mape {entry['mape']:.4f}{marker}")
     print("Validation metrics:", metrics)
     if r_conf_err is not None:
         print(
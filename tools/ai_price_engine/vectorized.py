@@ -0,0 +1,469 @@
+"""
+Columnar (NumPy) version of server.recommend().
+
+recommend_batch() takes one float64 array per payload field (NaN = field missing) and
+computes the same floors, multipliers, clamps and confidence as the scalar formula for
+every row at once. Operations are kept in the same order as recommend() so that, after
+rounding, results are identical to the scalar path.
+
+Use columns_from_payloads() to turn recommend()-style dicts into columns; competitor
+price lists are aggregated per row with server._robust_price_average.
+"""
+
+from __future__ import annotations
+
+import math
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+import server
+
+# Payload fields understood by recommend_batch(), in the order recommend() parses them.
+NUMERIC_FIELDS: tuple[str, ...] = (
+    "cost_price",
+    "desired_margin",
+    "current_price",
+    "shipping_cost",
+    "platform_fee_pct",
+    "min_price",
+    "competitor_avg",
+    "market_sample_size",
+    "demand_factor",
+    "sales_velocity",
+    "stock_level",
+    "rating",
+    "promo_factor",
+    "seasonality_factor",
+)
+
+# Extra (non-payload) columns produced by columns_from_payloads().
+COMPETITOR_SAMPLE_SIZE = "competitor_sample_size"
+COMPETITOR_PRICES_ERROR = "competitor_prices_error"
+
+_COMPETITOR_PRICES_ERRORS = {
+    1: "Must be a list of numbers",
+    2: "List contains a non-numeric value",
+    3: "Must include at least one positive number",
+}
+_COMPETITOR_PRICES_ERROR_CODES = {message: code for code, message in _COMPETITOR_PRICES_ERRORS.items()}
+
+
+@dataclass
+class BatchResult:
+    """Columnar output of recommend_batch(); rows listed in `errors` have NaN outputs."""
+
+    recommended_price: np.ndarray
+    confidence: np.ndarray
+    min_price: np.ndarray
+    ceiling: np.ndarray
+    competitor_avg_used: np.ndarray
+    demand_effective: np.ndarray
+    stock_multiplier: np.ndarray
+    promo_multiplier: np.ndarray
+    seasonality_multiplier: np.ndarray
+    clamp_min_price: np.ndarray
+    clamp_ceiling: np.ndarray
+    model_version: str
+    errors: dict[int, server.InputError] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return int(self.recommended_price.shape[0])
+
+    def to_results(self, listing_ids: list[Any] | None = None) -> list[dict[str, Any]]:
+        """Row dicts shaped like server.recommend_many() (without explain)."""
+        prices = self.recommended_price.tolist()
+        confidences = self.confidence.tolist()
+        out: list[dict[str, Any]] = []
+        for i in range(len(prices)):
+            entry: dict[str, Any] = {}
+            if listing_ids is not None and listing_ids[i] is not None:
+                entry["listing_id"] = listing_ids[i]
+            err = self.errors.get(i)
+            if err is not None:
+                entry["error"] = {"message": err.message, "errors": err.errors}
+            else:
+                entry["recommended_price"] = prices[i]
+                entry["confidence"] = confidences[i]
+                entry["model_version"] = self.model_version
+            out.append(entry)
+        return out
+
+
+def round_half_even(values: np.ndarray, ndigits: int) -> np.ndarray:
+    """
+    Round like Python's round(float, ndigits).
+
+    np.round scales, rounds and unscales, which only disagrees with Python's correctly
+    rounded result next to a .5 tie (or when scaling loses precision for huge values);
+    those few elements are re-rounded in Python.
+    """
+    with np.errstate(over="ignore", invalid="ignore"):
+        scaled = values * 10.0**ndigits
+        out = np.round(values, ndigits)
+        frac = scaled - np.floor(scaled)
+        redo = (np.abs(frac - 0.5) < 1e-6) | ~(np.abs(scaled) < 2.0**52)
+    redo &= np.isfinite(values)
+    for i in np.flatnonzero(redo):
+        out[i] = round(float(values[i]), ndigits)
+    return out
+
+
+def _log1p(values: np.ndarray) -> np.ndarray:
+    """
+    math.log1p over an array.
+
+    NumPy's SIMD log1p may differ from libm by one ulp, which is enough to flip a
+    rounded digit now and then; evaluating libm once per distinct value keeps results
+    identical to the scalar path (stock levels and sample sizes repeat heavily).
+    """
+    uniques, inverse = np.unique(values, return_inverse=True)
+    logs = np.fromiter(map(math.log1p, uniques.tolist()), dtype=np.float64, count=uniques.shape[0])
+    return logs[inverse.reshape(values.shape)]
+
+
+def _log_norm(values: np.ndarray, log_ref: float) -> np.ndarray:
+    normed = np.clip(_log1p(values) / log_ref, 0.0, 1.0)
+    return np.where(values <= 0, 0.0, normed)
+
+
+def columns_from_payloads(payloads: Iterable[dict[str, Any]]) -> dict[str, np.ndarray]:
+    """
+    Convert recommend() payload dicts to float64 columns.
+
+    Payloads are decoded with server.decode_payload (the shared schema). Missing/null
+    fields become NaN and unparseable values become +inf (reported by recommend_batch()
+    as "Must be a finite number", like the scalar path).
+    `competitor_prices` lists are reduced to `competitor_avg` + `competitor_sample_size`.
+    """
+    rows = list(payloads)
+    n = len(rows)
+    cols = {key: np.full(n, np.nan) for key in NUMERIC_FIELDS}
+    sample_size = np.zeros(n)
+    prices_error = np.zeros(n, dtype=np.int8)
+    competitor_avg_col = cols["competitor_avg"]
+
+    for i, payload in enumerate(rows):
+        decoded = server.decode_payload(payload)
+        errors = decoded.errors or {}
+        for key in NUMERIC_FIELDS:
+            if key in errors:
+                cols[key][i] = math.inf
+            elif decoded.values[key] is not None:
+                cols[key][i] = decoded.values[key]
+
+        prices_message = errors.get("competitor_prices")
+        if prices_message is not None:
+            prices_error[i] = _COMPETITOR_PRICES_ERROR_CODES[prices_message]
+        elif decoded.competitor_prices:
+            # A valid list wins over competitor_avg, but a non-finite avg must still error.
+            if "competitor_avg" not in errors:
+                competitor_avg_col[i], _ = server._robust_price_average(decoded.competitor_prices)
+            sample_size[i] = len(decoded.competitor_prices)
+
+    cols[COMPETITOR_SAMPLE_SIZE] = sample_size
+    cols[COMPETITOR_PRICES_ERROR] = prices_error
+    return cols
+
+
+def _column(columns: dict[str, Any], key: str, n: int) -> np.ndarray:
+    col = columns.get(key)
+    if col is None:
+        return np.full(n, np.nan)
+    return np.asarray(col, dtype=np.float64)
+
+
+def _batch_length(columns: dict[str, Any]) -> int:
+    lengths = {len(np.asarray(v)) for v in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same length")
+    return lengths.pop() if lengths else 0
+
+
+def _collect_errors(
+    cols: dict[str, np.ndarray],
+    prices_error: np.ndarray,
+    min_missing: np.ndarray,
+    min_nonpositive: np.ndarray,
+    smoothed_nonfinite: np.ndarray,
+    ceiling_nonfinite: np.ndarray,
+) -> dict[int, server.InputError]:
+    """Report the first error per row, in the order recommend() would raise them."""
+    errors: dict[int, server.InputError] = {}
+
+    def first_nonfinite(keys: tuple[str, ...]) -> None:
+        for key in keys:
+            for i in np.flatnonzero(np.isinf(cols[key])):
+                errors.setdefault(
+                    int(i), server.InputError("Invalid numeric inputs", {key: "Must be a finite number"})
+                )
+
+    first_nonfinite(("cost_price", "desired_margin", "current_price", "shipping_cost", "platform_fee_pct"))
+
+    negatives = {
+        key: cols[key] < 0
+        for key in ("cost_price", "desired_margin", "current_price", "shipping_cost", "platform_fee_pct")
+    }
+    any_negative = np.logical_or.reduce(list(negatives.values()))
+    for i in np.flatnonzero(any_negative):
+        invalids = {key: "Must be >= 0" for key, mask in negatives.items() if mask[i]}
+        errors.setdefault(int(i), server.InputError("Invalid numeric inputs", invalids))
+
+    first_nonfinite(("min_price",))
+
+    for i in np.flatnonzero(min_missing):
+        errors.setdefault(
+            int(i),
+            server.InputError(
+                "Missing required pricing inputs",
+                {"min_price": "Provide min_price, or provide cost_price (>0) to compute it."},
+            ),
+        )
+    for i in np.flatnonzero(min_nonpositive):
+        errors.setdefault(
+            int(i), server.InputError("Invalid numeric inputs", {"min_price": "min_price must be > 0"})
+        )
+
+    first_nonfinite(("competitor_avg",))
+
+    for i in np.flatnonzero(prices_error):
+        message = _COMPETITOR_PRICES_ERRORS[int(prices_error[i])]
+        errors.setdefault(int(i), server.InputError("Invalid numeric inputs", {"competitor_prices": message}))
+
+    first_nonfinite(
+        (
+            "market_sample_size",
+            "demand_factor",
+            "sales_velocity",
+            "stock_level",
+            "rating",
+            "promo_factor",
+            "seasonality_factor",
+        )
+    )
+
+    for i in np.flatnonzero(smoothed_nonfinite):
+        errors.setdefault(
+            int(i),
+            server.InputError(
+                "Numeric overflow", {"recommended_price": "Computation produced a non-finite value"}
+            ),
+        )
+    for i in np.flatnonzero(ceiling_nonfinite):
+        errors.setdefault(
+            int(i), server.InputError("Numeric overflow", {"ceiling": "Computation produced a non-finite value"})
+        )
+
+    return {i: errors[i] for i in sorted(errors)}
+
+
+@np.errstate(over="ignore", invalid="ignore", divide="ignore")
+def recommend_batch(columns: dict[str, Any], weights: Mapping[str, Any]) -> BatchResult:
+    """
+    Vectorized equivalent of server.recommend(payload, weights) for every row.
+
+    `columns` maps payload field names to equal-length arrays (NaN = missing). It may
+    also carry `competitor_sample_size` (number of prices behind competitor_avg) and
+    `competitor_prices_error`, as produced by columns_from_payloads().
+    """
+    w = server.compile_weights(weights)
+    n = _batch_length(columns)
+    cols = {key: _column(columns, key, n) for key in NUMERIC_FIELDS}
+    sample_size = _column(columns, COMPETITOR_SAMPLE_SIZE, n)
+    sample_size = np.where(np.isnan(sample_size), 0.0, sample_size)
+    prices_error = np.asarray(columns.get(COMPETITOR_PRICES_ERROR, np.zeros(n, dtype=np.int8)))
+
+    # Non-finite inputs are reported as errors; compute on zeros so they don't spread.
+    finite = {key: np.where(np.isinf(col), np.nan, col) for key, col in cols.items()}
+
+    def present(key: str) -> np.ndarray:
+        return ~np.isnan(finite[key])
+
+    def or_zero(key: str) -> np.ndarray:
+        return np.where(present(key), finite[key], 0.0)
+
+    cost_price = finite["cost_price"]
+    has_cost = present("cost_price")
+    desired_margin = or_zero("desired_margin")
+    current_price = or_zero("current_price")
+    shipping_cost = or_zero("shipping_cost")
+    platform_fee_pct = or_zero("platform_fee_pct")
+
+    # _compute_min_price
+    margin_pct = np.clip(np.where(desired_margin > 1.0, desired_margin / 100.0, desired_margin), 0.0, 1.0)
+    fee_pct = np.clip(np.where(platform_fee_pct > 1.0, platform_fee_pct / 100.0, platform_fee_pct), 0.0, 0.3)
+    shipping = np.maximum(0.0, shipping_cost)
+
+    has_floor = has_cost & (np.where(has_cost, cost_price, 0.0) > 0)
+    subtotal_cost = np.maximum(0.0, np.where(has_floor, cost_price, 0.0)) + shipping
+    fee_divisor = np.maximum(0.01, 1.0 - fee_pct)
+    computed_floor = (subtotal_cost / fee_divisor) * (1.0 + margin_pct)
+
+    min_price_input = finite["min_price"]
+    has_min_input = present("min_price")
+    min_missing = ~has_min_input & ~has_floor
+    min_nonpositive = has_min_input & (np.where(has_min_input, min_price_input, 1.0) <= 0)
+    min_price = np.where(
+        has_min_input,
+        np.where(has_floor & (computed_floor > min_price_input), computed_floor, min_price_input),
+        computed_floor,
+    )
+    min_price = np.where(min_missing | min_nonpositive, np.nan, min_price)
+
+    # Competitor signal.
+    competitor_avg = finite["competitor_avg"]
+    has_competitor = present("competitor_avg") & (np.where(present("competitor_avg"), competitor_avg, 0.0) > 0)
+    competitor_avg_used = np.where(has_competitor, competitor_avg, np.nan)
+
+    market_sample_size = np.trunc(or_zero("market_sample_size"))
+    market_sample_size = np.maximum(sample_size, market_sample_size)
+
+    # Demand signal.
+    demand_default = w.demand_default
+    demand_provided = present("demand_factor")
+    demand_factor = np.where(demand_provided, finite["demand_factor"], demand_default)
+    demand_factor = np.clip(np.where(demand_factor > 1, demand_factor / 100.0, demand_factor), 0.0, 1.0)
+
+    has_sales = present("sales_velocity")
+    has_stock = present("stock_level")
+    has_rating = present("rating")
+    has_promo = present("promo_factor")
+    has_season = present("seasonality_factor")
+
+    sales_norm = _log_norm(np.maximum(0.0, or_zero("sales_velocity")), w.sales_velocity_log_ref)
+    rating_norm = np.clip(or_zero("rating") / 5.0, 0.0, 1.0)
+
+    demand_effective = demand_factor
+    demand_effective = np.where(
+        has_sales, demand_effective + w.sales_velocity_weight * ((sales_norm - 0.5) * 2.0), demand_effective
+    )
+    demand_effective = np.where(
+        has_rating, demand_effective + w.rating_weight * ((rating_norm - 0.5) * 2.0), demand_effective
+    )
+    demand_effective = np.clip(demand_effective, 0.0, 1.0)
+
+    stock_norm = _log_norm(np.maximum(0.0, or_zero("stock_level")), w.stock_level_log_ref)
+    stock_delta = w.stock_max_delta * ((0.5 - stock_norm) * 2.0)
+    stock_multiplier = np.where(
+        has_stock, np.clip(1.0 + stock_delta, w.stock_multiplier_low, w.stock_multiplier_high), 1.0
+    )
+
+    promo_factor = or_zero("promo_factor")
+    promo_pct = (promo_factor >= 1.5) & (promo_factor <= 100)
+    promo_multiplier = np.where(promo_pct, 1.0 - (promo_factor / 100.0), promo_factor)
+    promo_multiplier = np.where(has_promo, np.clip(promo_multiplier, 0.70, 1.20), 1.0)
+
+    seasonality_multiplier = np.where(has_season, np.clip(or_zero("seasonality_factor"), 0.85, 1.15), 1.0)
+
+    # Fallback branch (no competitor signal).
+    fallback_base = np.where(current_price > 0, current_price, min_price)
+    fallback_raw = np.maximum(min_price, fallback_base)
+
+    # Competitor branch.
+    gamma = w.gamma_multiplier * np.where(has_competitor, competitor_avg_used, 0.0)
+    comp_component = w.alpha * np.where(has_competitor, competitor_avg_used, 0.0)
+    min_component = w.beta * min_price
+    demand_component = gamma * demand_effective
+    competitor_raw = comp_component + min_component + demand_component
+
+    candidate_raw = np.where(has_competitor, competitor_raw, fallback_raw)
+    candidate_adj = candidate_raw * stock_multiplier * promo_multiplier * seasonality_multiplier
+
+    candidate_smoothed = candidate_adj
+    if w.smoothing > 0:
+        candidate_smoothed = np.where(
+            current_price > 0,
+            w.smoothing_keep * candidate_adj + (w.smoothing * current_price),
+            candidate_adj,
+        )
+
+    ceiling = np.maximum(min_price, np.where(has_competitor, competitor_avg_used, 0.0) * w.ceiling_factor)
+    ceiling = np.where(has_competitor, ceiling, np.nan)
+
+    candidate = np.where(
+        has_competitor,
+        np.maximum(min_price, np.minimum(ceiling, candidate_smoothed)),
+        np.maximum(min_price, candidate_smoothed),
+    )
+
+    valid_min = ~(min_missing | min_nonpositive)
+    smoothed_nonfinite = valid_min & ~np.isfinite(candidate_smoothed)
+    ceiling_nonfinite = valid_min & has_competitor & ~smoothed_nonfinite & ~np.isfinite(ceiling)
+
+    clamp_min_price = candidate <= min_price + 1e-9
+    clamp_ceiling = has_competitor & (candidate >= ceiling - 1e-9)
+
+    # Confidence.
+    fallback_quality = 0.30 + 0.20 * np.where(demand_provided, 1.0, 0.6)
+    fallback_confidence = np.clip(0.35 + 0.6 * fallback_quality, 0.0, 1.0)
+
+    competitor_quality = np.where(
+        market_sample_size > 0,
+        np.clip(_log1p(np.maximum(market_sample_size, 0.0)) / server._LOG1P_10, 0.0, 1.0),
+        0.6,
+    )
+    demand_quality = np.where(demand_provided, 1.0, 0.7)
+    extras_present = (
+        (has_sales & (or_zero("sales_velocity") != 0)).astype(np.int64)
+        + (has_stock & (or_zero("stock_level") != 0))
+        + (has_rating & (or_zero("rating") != 0))
+        + (shipping_cost != 0)
+        + (platform_fee_pct != 0)
+    )
+    extras_quality = np.clip(extras_present / 5.0, 0.0, 1.0)
+    quality = (0.55 * competitor_quality) + (0.25 * demand_quality) + (0.20 * extras_quality)
+    competitor_confidence = 0.35 + (0.6 * quality)
+    competitor_confidence = competitor_confidence - np.where(clamp_min_price, 0.05, 0.0)
+    competitor_confidence = competitor_confidence - np.where(clamp_ceiling, 0.05, 0.0)
+    competitor_confidence = np.clip(competitor_confidence, 0.0, 1.0)
+
+    confidence = np.where(has_competitor, competitor_confidence, fallback_confidence)
+
+    errors = _collect_errors(
+        cols, prices_error, min_missing, min_nonpositive, smoothed_nonfinite, ceiling_nonfinite
+    )
+    if errors:
+        bad = np.fromiter(errors.keys(), dtype=np.int64, count=len(errors))
+        candidate = candidate.copy()
+        confidence = confidence.copy()
+        candidate[bad] = np.nan
+        confidence[bad] = np.nan
+
+    return BatchResult(
+        recommended_price=round_half_even(candidate, 2),
+        confidence=round_half_even(confidence, 4),
+        min_price=min_price,
+        ceiling=ceiling,
+        competitor_avg_used=competitor_avg_used,
+        demand_effective=demand_effective,
+        stock_multiplier=stock_multiplier,
+        promo_multiplier=promo_multiplier,
+        seasonality_multiplier=seasonality_multiplier,
+        clamp_min_price=clamp_min_price & valid_min,
+        clamp_ceiling=clamp_ceiling & valid_min,
+        model_version=w.model_version,
+        errors=errors,
+    )
+
+
+def sweep_columns(base: dict[str, Any], axes: list[tuple[str, list[float]]]) -> dict[str, np.ndarray]:
+    """
+    Columns for every combination of the `axes` values (first axis varies slowest) on top
+    of the `base` payload, without decoding a payload per grid cell.
+
+    Each cell scores like recommend({**base, name: value, ...}); sweeping competitor_avg
+    drops the base `competitor_prices`, which would otherwise take precedence.
+    """
+    names = [name for name, _ in axes]
+    if "competitor_avg" in names:
+        base = {k: v for k, v in base.items() if k != "competitor_prices"}
+    row = columns_from_payloads([base])
+    shape = tuple(len(values) for _, values in axes)
+    cells = math.prod(shape)
+    cols = {key: np.broadcast_to(col, (cells,)) for key, col in row.items()}
+    grids = np.meshgrid(*(np.asarray(values, dtype=np.float64) for _, values in axes), indexing="ij")
+    for name, grid in zip(names, grids):
+        cols[name] = grid.ravel()
+    return cols